@@ -1,34 +1,207 @@
-import boto3
+import datetime
+import gzip
+import json
+import re
+import threading
+
+import metrics
+import payload_encoder
+import startup
 from setting_management import GlobalSetting
 
+boto3 = startup.lazy_import('boto3')
+
 JSON_CONTENT = 'application/json'
 IMAGE_PNG_CONTENT = 'image/png'
 
+BUCKET_NAME = 'jijinalimi'
+
 JSON_PATH = 'v3/{0}'
 IMAGE_PATH = 'v3/img/{0}'
+VERSIONED_JSON_PATH = 'v3/{0}/{1}'  # 버전, 파일 이름
+MANIFEST_PATH = 'v3/latest_{0}.json'  # kma, jma
+BUNDLE_FILE_NAME = 'bundle.json'
+
+# 버전 키의 객체는 바뀌지 않으므로 오래 캐시하고, manifest는 매번 재검증
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+MANIFEST_CACHE_CONTROL = 'no-cache'
 
 g_setting: GlobalSetting
-s3_resource = None
+s3_resource: startup.Deferred
+
+# 크롤러 이름: 마지막으로 올린 manifest 내용
+manifests = {}
+# 여러 발행 작업자가 manifest와 예전 경로의 파일을 동시에 갱신하지 않도록 잠금
+publish_lock = threading.Lock()
 
 
 def init_aws_s3(setting):
     global g_setting
     global s3_resource
     g_setting = setting
-    s3_resource = boto3.resource('s3', aws_access_key_id=g_setting.aws.aws_access_key_id,
-                                 aws_secret_access_key=g_setting.aws.aws_secret_access_key,
-                                 region_name=g_setting.aws.region_name)
+    # boto3는 불러오는데 오래 걸리므로 처음 사용할 때 만들거나 백그라운드에서 미리 만듦
+    s3_resource = startup.Deferred('s3', lambda: boto3.resource('s3',
+                                                               aws_access_key_id=g_setting.aws.aws_access_key_id,
+                                                               aws_secret_access_key=g_setting.aws.aws_secret_access_key,
+                                                               region_name=g_setting.aws.region_name))
+    if g_setting.warm_clients:
+        s3_resource.warm()
 
 
-def save_s3(data, path: str, content_type=JSON_CONTENT):
+def save_s3(data, path: str, content_type=JSON_CONTENT, content_encoding=None, cache_control=None):
     """
     S3에 데이터를 저장하는 함수
 
     :param data: 저장할 데이터
     :param path: 경로 + 파일 이름
     :param content_type: 컨텐트 타입
+    :param content_encoding: 컨텐트 인코딩 (ex. gzip)
+    :param cache_control: Cache-Control 헤더
     :return: void
     """
 
-    global s3_resource
-    s3_resource.Bucket('jijinalimi').put_object(Body=data, Key=path, ContentType=content_type)
+    extra = {}
+    if content_encoding is not None:
+        extra['ContentEncoding'] = content_encoding
+    if cache_control is not None:
+        extra['CacheControl'] = cache_control
+    with metrics.S3_PUT_SECONDS.time():
+        s3_resource.get().Bucket(BUCKET_NAME).put_object(Body=data, Key=path, ContentType=content_type, **extra)
+
+
+def probe():
+    """
+    S3 연결을 유지하기 위한 가벼운 요청 (connection_keeper에서 주기적으로 호출)
+    """
+    s3_resource.get().meta.client.head_bucket(Bucket=BUCKET_NAME)
+
+
+def load_s3_json(path: str):
+    """
+    S3에서 JSON 데이터를 불러오는 함수
+
+    :param path: 경로 + 파일 이름
+    :return: 불러온 데이터 (없거나 실패하면 None)
+    """
+    try:
+        body = s3_resource.get().Object(BUCKET_NAME, path).get()['Body'].read()
+    except Exception:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def build_bundle(contents: dict) -> dict:
+    """
+    언어별 지진 데이터를 하나로 묶음. 모든 언어에서 같은 필드는 shared에 한 번만 넣고
+    언어마다 다른 필드(번역된 문자열)만 언어별로 넣음
+
+    :param contents: {언어: 지진 데이터}
+    :return: {'shared': 공통 필드, 'languages': {언어: 번역된 필드}}
+    """
+    languages = list(contents.keys())
+    keys = set()
+    for value in contents.values():
+        keys.update(value.keys())
+
+    shared = {}
+    translated = {language: {} for language in languages}
+    for key in sorted(keys):
+        values = [contents[language].get(key) for language in languages]
+        if all(key in contents[language] for language in languages) and all(v == values[0] for v in values):
+            shared[key] = values[0]
+        else:
+            for language in languages:
+                if key in contents[language]:
+                    translated[language][key] = contents[language][key]
+    return {'shared': shared, 'languages': translated}
+
+
+class Publication:
+    """
+    한 번의 발행에서 올리는 JSON 파일을 gzip으로 압축해서 바뀌지 않는 버전 키에 저장하고,
+    모든 파일을 올린 뒤에 마지막으로 manifest(latest_{이름}.json)를 갱신하는 클래스
+
+    클라이언트는 manifest만 재검증하면 되고, 서로 다른 발행의 파일이 섞여 보이지 않음
+    """
+
+    def __init__(self, name: str, version: str, order: str = None):
+        """
+        :param name: 크롤러 이름 (kma, jma)
+        :param version: 발행 버전 (같은 데이터를 다시 발행하면 같은 값이어야 함)
+        :param order: 발행 순서를 비교하는 값 (ex. 발표 시각). manifest의 값보다 작으면 갱신하지 않음
+        """
+        self.name = name
+        self.version = re.sub(r'[^0-9A-Za-z_-]', '_', version)
+        self.order = order
+        self.files = {}
+        self.legacy = {}  # 예전 경로에 저장할 파일 {파일 이름: JSON 문자열}
+
+    def key(self, file_name: str) -> str:
+        return VERSIONED_JSON_PATH.format(self.version, file_name)
+
+    def put(self, file_name: str, body: str, aliases=()):
+        """
+        JSON 파일을 gzip으로 압축해서 버전 키에 저장
+
+        :param file_name: 파일 이름 (ex. data_kma_ko.json)
+        :param body: JSON 문자열
+        :param aliases: 내용이 같은 다른 파일 이름 (따로 저장하지 않고 manifest에서 같은 버전 키를 가리킴)
+        """
+        save_s3(gzip.compress(body.encode('utf8'), mtime=0), self.key(file_name), JSON_CONTENT,
+                content_encoding='gzip', cache_control=IMMUTABLE_CACHE_CONTROL)
+        for name in (file_name, *aliases):
+            self.files[name] = self.key(file_name)
+
+    def put_bundle(self, contents: dict):
+        """
+        언어별 지진 데이터를 하나의 파일로 묶어서 버전 키에 저장
+
+        :param contents: {언어: 지진 데이터}
+        """
+        self.put(BUNDLE_FILE_NAME, payload_encoder.dumps(build_bundle(contents)))
+
+    def record(self, file_name: str):
+        """
+        재시작 전에 이미 올린 파일을 manifest에 포함시킴
+        """
+        self.files[file_name] = self.key(file_name)
+
+    def put_legacy(self, file_name: str, body: str):
+        """
+        예전 경로(v3/{파일 이름})에 저장할 파일을 등록. manifest를 갱신할 때 같이 저장함
+
+        :param file_name: 파일 이름 (ex. data_kma_ko.json)
+        :param body: JSON 문자열
+        """
+        self.legacy[file_name] = body
+
+    def commit(self) -> bool:
+        """
+        예전 경로의 파일을 저장하고 manifest를 갱신. 이번 발행에 없는 파일은 이전 manifest의 값을 유지
+
+        여러 지진의 발행이 늦게 끝나는 순서가 바뀌어도 이전 지진이 최신 지진을 덮어쓰지 않도록,
+        잠금을 잡고 manifest의 발행 순서보다 이 발행이 이전이면 갱신하지 않음
+
+        :return: 갱신했는지 여부
+        """
+        with publish_lock:
+            manifest = manifests.get(self.name)
+            if manifest is None:
+                manifest = load_s3_json(MANIFEST_PATH.format(self.name)) or {'files': {}}
+            if self.order is not None and manifest.get('order') is not None and manifest['order'] > self.order:
+                return False
+            for file_name, body in self.legacy.items():
+                save_s3(body, JSON_PATH.format(file_name), JSON_CONTENT)
+            manifest = {
+                'version': self.version,
+                'order': self.order,
+                'updated': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'files': dict(manifest.get('files', {}), **self.files)
+            }
+            save_s3(json.dumps(manifest), MANIFEST_PATH.format(self.name), JSON_CONTENT,
+                    cache_control=MANIFEST_CACHE_CONTROL)
+            manifests[self.name] = manifest
+        return True
@@ -0,0 +1,307 @@
+"""
+기상청 지진 이력을 다시 불러와서 저장하는 스크립트 (데이터를 잃어버렸거나 새 저장소를 채울 때 사용)
+
+일본 기상청은 장기 피드(eqvol_l.xml)의 entry마다 연결된 상세 XML을, 한국 기상청은 지진 목록의 상세 페이지를 불러옴
+요청은 여러 스레드에서 동시에 보내되 전체 요청 수를 초당 --rate개로 제한하고,
+파싱은 크롤러와 같은 함수(parse_eqk_xml, parse_detail_page)를 프로세스 풀에서 실행함
+결과는 배치 단위로 저장하고 처리가 끝난 key를 기록하므로 중간에 멈춰도 다시 실행하면 이어서 진행함
+
+사용법 :
+    python backfill.py jma [--feed URL] [--workers 8] [--rate 5] [--processes 4] [--batch 100] [--upload]
+    python backfill.py kma [--list list.json] [--since 20200101] [--until 20201231] ...
+"""
+import argparse
+import collections
+import concurrent.futures
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+import aws_s3
+import connection_keeper
+import geocoder
+import informations as i
+import payload_encoder
+import startup
+import upstream
+from setting_management import GlobalSetting
+from state_store import atomic_write_json
+
+bs4 = startup.lazy_import('bs4')
+
+logger = logging.getLogger('backfill')
+
+# 요청 하나의 최대 시도 횟수와 제한 시간(초)
+MAX_ATTEMPTS = 3
+REQUEST_TIMEOUT = 10
+# 진행 상황을 출력하는 간격(초)
+PROGRESS_INTERVAL = 10
+
+BACKFILL_S3_PATH = 'v3/backfill/{0}/{1:06d}.jsonl.gz'  # 크롤러 이름, 배치 번호
+
+# key: 저장소에서 지진을 구분하는 값, url/params: 상세 페이지 요청, extra: 파싱에 필요한 값
+BackfillJob = collections.namedtuple('BackfillJob', ['key', 'url', 'params', 'extra'])
+
+
+class RateLimiter:
+    """
+    여러 스레드의 요청을 합쳐서 초당 rate개로 제한하는 클래스
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        time.sleep(max(0, slot - now))
+
+
+class BackfillStore:
+    """
+    결과를 배치 단위로 JSON Lines 파일에 덧붙이고, 배치를 쓴 뒤에 처리가 끝난 key를 기록하는 클래스
+
+    배치를 쓴 직후에 멈추면 다시 실행할 때 같은 배치가 한 번 더 저장될 수 있으므로 읽는 쪽에서 key로 중복을 제거해야 함
+    """
+
+    def __init__(self, output_path, name, batch_size, upload):
+        """
+        :param output_path: 결과 파일을 저장할 디렉토리
+        :param name: 크롤러 이름 (kma, jma)
+        :param batch_size: 한 번에 저장할 지진 수
+        :param upload: 배치를 S3에도 저장할지 여부
+        """
+        self.name = name
+        self.batch_size = batch_size
+        self.upload = upload
+        self.data_path = os.path.join(output_path, f'backfill_{name}.jsonl')
+        self.state_path = os.path.join(output_path, f'backfill_{name}_state.json')
+        os.makedirs(output_path, exist_ok=True)
+        try:
+            with open(self.state_path, 'r', encoding='utf8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        self.done = set(state.get('done', []))
+        self.batches = state.get('batches', 0)
+        self._buffer = []
+
+    def is_done(self, key) -> bool:
+        return key in self.done
+
+    def add(self, key, record: dict):
+        self._buffer.append((key, record))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._buffer) == 0:
+            return
+        body = ''.join(payload_encoder.dumps({'key': key, 'data': record}) + '\n' for key, record in self._buffer)
+        with open(self.data_path, 'a', encoding='utf8') as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        if self.upload:
+            aws_s3.save_s3(gzip.compress(body.encode('utf8'), mtime=0),
+                           BACKFILL_S3_PATH.format(self.name, self.batches), aws_s3.JSON_CONTENT,
+                           content_encoding='gzip')
+        self.batches += 1
+        self.done.update(key for key, _ in self._buffer)
+        self._buffer = []
+        atomic_write_json(self.state_path, {'done': sorted(self.done), 'batches': self.batches})
+
+
+def fetch(session, limiter, url, params=None):
+    """
+    요청 수 제한을 지키면서 페이지를 불러옴. 실패하면 MAX_ATTEMPTS번까지 다시 시도
+
+    :raises requests.exceptions.RequestException: 모든 시도가 실패한 경우
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.acquire()
+        try:
+            response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(upstream.backoff(attempt, REQUEST_TIMEOUT))
+        else:
+            response.encoding = 'utf8'
+            return response.text
+
+
+def init_worker(name):
+    """
+    파싱 프로세스 초기화. 크롤러의 파싱 함수가 사용하는 전역 변수를 채움
+    """
+    geocoder.init_geocoder()
+    if name == 'kma':
+        import kma_scraper
+        kma_scraper.logger = logger
+        kma_scraper.code = kma_scraper.load_codes(kma_scraper.codes_path)
+    else:
+        import jma_scraper
+        jma_scraper.logger = logger
+
+
+def parse_jma(job: BackfillJob, text):
+    import jma_scraper
+    success, data = jma_scraper.parse_eqk_xml(text, job.key, job.extra)
+    return data.to_dict() if success else None
+
+
+def parse_kma(job: BackfillJob, text):
+    import kma_scraper
+    return kma_scraper.parse_detail_page(text, kma_scraper.EqkBaseData.create(job.extra)).to_dict()
+
+
+def jma_jobs(session, limiter, feed_url):
+    """
+    일본 기상청 피드의 지진 entry로 작업 목록을 만듦
+
+    피드에는 요약만 있으므로 작업의 url은 entry가 가리키는 지진별 상세 XML이고,
+    run에서 스레드 풀로 상세 XML을 불러온 뒤 parse_jma(parse_eqk_xml)로 파싱함
+    """
+    import jma_scraper
+    feed = bs4.BeautifulSoup(fetch(session, limiter, feed_url), 'lxml-xml')
+    jobs = []
+    for entry in feed.find_all('entry'):
+        if entry.title.text not in jma_scraper.eqk_info_list:
+            continue
+        link = entry.find('link', href=True)
+        if link is None:
+            logger.warning(f'<jma> 상세 XML 주소가 없는 entry : {entry.id.text}')
+            continue
+        jobs.append(BackfillJob(entry.id.text, link.attrs['href'], None,
+                                jma_scraper.eqk_info_list.index(entry.title.text)))
+    feed.decompose()
+    return jobs
+
+
+def kma_jobs(session, limiter, list_path, since, until):
+    """
+    한국 기상청 지진 목록(list.do 형식)에서 발표 날짜가 범위 안에 있는 지진 정보로 작업 목록을 만듦
+
+    :param list_path: list.do 응답을 저장한 JSON 파일 (None이면 현재 list.do를 불러옴)
+    :param since: 시작 날짜 (YYYYMMDD, None이면 제한 없음)
+    :param until: 끝 날짜 (YYYYMMDD, None이면 제한 없음)
+    """
+    import kma_scraper
+    if list_path is None:
+        items = json.loads(fetch(session, limiter, i.kma_list_url))
+    else:
+        with open(list_path, 'r', encoding='utf8') as f:
+            items = json.load(f)
+    jobs = []
+    for item in items:
+        if item['tp'] not in [kma_scraper.EQK_TYPE_INFO, kma_scraper.EQK_TYPE_BREAKING_INFO]:
+            continue
+        day = item['tmFc'][:8]
+        if (since is not None and day < since) or (until is not None and day > until):
+            continue
+        jobs.append(BackfillJob(item['data'], i.kma_detail_url, {'eqk': item['data']}, item))
+    return jobs
+
+
+def run(name, jobs, parse, store, session, limiter, workers, processes):
+    """
+    작업마다 상세 페이지(jma는 entry의 상세 XML)를 스레드 풀에서 동시에 불러와서 프로세스 풀에서 파싱하고 저장
+
+    :return: (저장한 지진 수, 실패한 지진 수)
+    """
+    jobs = [job for job in jobs if not store.is_done(job.key)]
+    print(f'<{name}> 작업 {len(jobs)}개 (이미 끝난 작업 {len(store.done)}개는 건너뜀)')
+    saved = 0
+    failed = 0
+    start = time.monotonic()
+    last_progress = start
+
+    def collect(futures, block):
+        nonlocal saved, failed
+        done, _ = concurrent.futures.wait(list(futures), timeout=None if block else 0)
+        for future in done:
+            job = futures.pop(future)
+            try:
+                record = future.result()
+            except Exception as e:
+                record = None
+                logger.warning(f'<{name}> 파싱 실패 : {job.key} ({e})')
+            if record is None:
+                failed += 1
+            else:
+                store.add(job.key, record)
+                saved += 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as fetch_pool, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                                                   initargs=(name,)) as parse_pool:
+        fetches = {fetch_pool.submit(fetch, session, limiter, job.url, job.params): job for job in jobs}
+        parses = {}
+        for future in concurrent.futures.as_completed(fetches):
+            job = fetches[future]
+            try:
+                text = future.result()
+            except requests.exceptions.RequestException as e:
+                logger.warning(f'<{name}> 불러오기 실패 : {job.key} ({e})')
+                failed += 1
+            else:
+                parses[parse_pool.submit(parse, job, text)] = job
+            collect(parses, block=False)
+
+            now = time.monotonic()
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                print(f'<{name}> {saved + failed}/{len(jobs)} 처리, {saved / (now - start):.1f} events/s')
+        collect(parses, block=True)
+    store.flush()
+
+    elapsed = time.monotonic() - start
+    print(f'<{name}> 완료 : 저장 {saved}개, 실패 {failed}개, {elapsed:.1f}초, '
+          f'{saved / elapsed if elapsed > 0 else 0:.1f} events/s')
+    return saved, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='기상청 지진 이력 백필')
+    parser.add_argument('name', choices=['kma', 'jma'])
+    parser.add_argument('--feed', default=i.jma_xml_long_url, help='일본 기상청 피드 주소')
+    parser.add_argument('--list', default=None, help='list.do 응답을 저장한 JSON 파일 (없으면 현재 목록)')
+    parser.add_argument('--since', default=None, help='시작 날짜 YYYYMMDD (kma)')
+    parser.add_argument('--until', default=None, help='끝 날짜 YYYYMMDD (kma)')
+    parser.add_argument('--workers', type=int, default=8, help='동시에 보내는 요청 수')
+    parser.add_argument('--rate', type=float, default=5, help='초당 최대 요청 수')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='파싱 프로세스 수')
+    parser.add_argument('--batch', type=int, default=100, help='한 번에 저장할 지진 수')
+    parser.add_argument('--upload', action='store_true', help='배치를 S3에도 저장')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    setting = GlobalSetting.create()
+    if args.upload:
+        aws_s3.init_aws_s3(setting)
+
+    session = connection_keeper.create_session(args.workers)
+    limiter = RateLimiter(args.rate)
+    store = BackfillStore(os.path.join(setting.data_path, 'backfill'), args.name, args.batch, args.upload)
+    if args.name == 'jma':
+        jobs = jma_jobs(session, limiter, args.feed)
+        parse = parse_jma
+    else:
+        jobs = kma_jobs(session, limiter, args.list, args.since, args.until)
+        parse = parse_kma
+    run(args.name, jobs, parse, store, session, limiter, args.workers, args.processes)
+
+
+if __name__ == '__main__':
+    main()
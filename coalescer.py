@@ -0,0 +1,167 @@
+import collections
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger('coalescer')
+
+
+class StalePublish(Exception):
+    def __init__(self, key):
+        super().__init__(f"같은 지진의 새로운 발표가 들어와서 이전 발행 작업을 중단합니다 : {key}")
+
+
+class PublishToken:
+    """
+    발행 작업 하나를 나타내는 토큰. 같은 지진의 새로운 발표가 들어오면 stale 상태가 됨
+    """
+
+    def __init__(self, coalescer, key, generation):
+        self.coalescer = coalescer
+        self.key = key
+        self.generation = generation
+
+    @property
+    def is_stale(self) -> bool:
+        return self.coalescer.generation(self.key) != self.generation
+
+    def check(self):
+        """
+        발행 단계 사이에 호출해서 오래된 작업이면 중단
+
+        :raises StalePublish: 같은 지진의 새로운 발표가 들어온 경우
+        """
+        if self.is_stale:
+            raise StalePublish(self.key)
+
+    def push(self, func, *args, **kwargs) -> bool:
+        """
+        알림을 보냄. 같은 지진의 알림은 push_window 안에 한 번만 보내고 나머지는 마지막 것만 모아서 보냄
+        (모아서 보낼 때는 보낼때까지 기다리므로 돌아온 뒤에 알림 단계를 완료로 기록해도 됨)
+
+        :return: 이 알림을 보냈는지 여부 (False면 같은 지진의 새 알림이 대신 보냄)
+        """
+        return self.coalescer.push(self, func, *args, **kwargs)
+
+
+class EventCoalescer:
+    """
+    지진별로 발행 작업을 합치는 클래스
+
+    발행 작업은 발행 대기열의 작업자 스레드에서 처리하고, 같은 지진의 새 발표를 처리하기 시작하면
+    진행중인 이전 작업은 다음 단계에서 중단함. 같은 지진의 알림은 push_window 안에 한 번만 보냄
+
+    모아서 보내는 알림은 발행 작업이 보낼때까지 기다리므로, 보내기 전에 프로그램이 죽으면
+    발행 대기열에서 다시 처리해서 알림이 사라지지 않음
+    """
+
+    def __init__(self, name, push_window):
+        """
+        :param name: 크롤러 이름 (kma, jma)
+        :param push_window: 같은 지진의 알림을 모으는 시간(초)
+        """
+        self.name = name
+        self.push_window = push_window
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)  # 발표 번호 (지진과 상관없이 늘어나므로 기록을 지운 뒤에도 겹치지 않음)
+        self._generations = {}  # 지진 key: 마지막 발표 번호 (진행중인 작업이나 대기중인 알림이 있는 지진만)
+        self._active = collections.Counter()  # 지진 key: 진행중인 발행 작업 수
+        self._last_push = {}  # 지진 key: 마지막으로 알림을 보낸 시각
+        self._pending_push = {}  # 지진 key: 대기중인 알림을 깨우는 Event
+        self._flushing = False  # True면 알림을 모으지 않고 바로 보냄 (다시 실행하거나 종료하기 전)
+
+    def generation(self, key):
+        with self._lock:
+            return self._generations.get(key)
+
+    def begin(self, key) -> PublishToken:
+        """
+        발행 작업을 시작하면서 토큰을 만듦. 같은 지진의 진행중인 작업은 stale 상태가 됨
+
+        :param key: 같은 지진인지 구분하는 값
+        """
+        with self._lock:
+            generation = next(self._counter)
+            self._generations[key] = generation
+            self._active[key] += 1
+            return PublishToken(self, key, generation)
+
+    def retain(self, token) -> bool:
+        """
+        발행 작업이 끝난 뒤에도 토큰을 계속 사용할 때 호출 (ex. 번역을 다시 발행하는 작업). 다 쓰면 end를 호출해야 함
+
+        :return: 토큰이 아직 최신인지 여부 (False면 end를 호출하지 않아도 됨)
+        """
+        with self._lock:
+            if self._generations.get(token.key) != token.generation:
+                return False
+            self._active[token.key] += 1
+            return True
+
+    def end(self, token):
+        """
+        발행 작업이 끝나면 호출. 진행중인 작업과 대기중인 알림이 없는 지진의 기록은 지움
+        """
+        with self._lock:
+            self._active[token.key] -= 1
+            self._prune(token.key)
+
+    def _prune(self, key):
+        if self._active[key] <= 0 and key not in self._pending_push:
+            self._active.pop(key, None)
+            self._generations.pop(key, None)
+
+    def push(self, token, func, *args, **kwargs) -> bool:
+        """
+        알림을 보냄. 마지막 알림으로부터 push_window가 지나지 않았으면 지날때까지 기다렸다가 보내고,
+        그 사이에 같은 지진의 새 알림이 들어오면 보내지 않고 돌아옴 (새 알림이 대신 보냄)
+
+        :return: 이 알림을 보냈는지 여부
+        :raises Exception: 알림을 보내지 못한 경우 (발행 작업을 다시 시도해서 보냄)
+        """
+        with self._lock:
+            previous = self._pending_push.pop(token.key, None)
+            if previous is not None:
+                previous.set()
+
+            now = time.monotonic()
+            last = self._last_push.get(token.key)
+            if self._flushing or last is None or now - last >= self.push_window:
+                self._last_push[token.key] = now
+                wake = None
+            else:
+                # 마지막 알림으로부터 push_window가 지난 뒤에 가장 최신 알림만 보냄
+                delay = last + self.push_window - now
+                wake = threading.Event()
+                self._pending_push[token.key] = wake
+            self._expire_push(now)
+
+        if wake is not None:
+            logger.info(f'<{self.name}> 같은 지진의 알림을 {delay:.1f}초 뒤에 모아서 보냄 : {token.key}')
+            wake.wait(delay)
+            with self._lock:
+                if self._pending_push.get(token.key) is not wake:
+                    logger.info(f'<{self.name}> 같은 지진의 새 알림이 대신 보냄 : {token.key}')
+                    return False
+                del self._pending_push[token.key]
+                if self._generations.get(token.key) != token.generation:
+                    return False
+                self._last_push[token.key] = time.monotonic()
+        func(*args, **kwargs)
+        return True
+
+    def flush(self):
+        """
+        기다리고 있는 알림을 바로 보내고 이후의 알림도 모으지 않음 (다시 실행하거나 종료하기 전에 호출)
+        """
+        with self._lock:
+            self._flushing = True
+            for wake in self._pending_push.values():
+                wake.set()
+
+    def _expire_push(self, now):
+        # 오래된 지진의 기록은 정리
+        for key in [k for k, t in self._last_push.items() if now - t > self.push_window * 10]:
+            if key not in self._pending_push:
+                del self._last_push[key]
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger('config_watcher')
+
+
+class InvalidConfig(Exception):
+    def __init__(self, path, reason):
+        super().__init__(f"설정 파일이 올바르지 않아 이전 설정을 유지합니다 : {path} ({reason})")
+
+
+def load_json(path):
+    with open(path, 'rb') as f:
+        return json.load(f)
+
+
+class WatchedFile:
+    """
+    감시하는 파일 하나의 정보
+    """
+
+    def __init__(self, path, load, apply):
+        """
+        :param path: 파일 경로
+        :param load: 파일을 읽어서 검증하고 새 값을 돌려주는 함수 (올바르지 않으면 예외 발생)
+        :param apply: 새 값을 적용하는 함수 (참조만 바꿔서 한 번에 교체해야 함)
+        """
+        self.path = path
+        self.load = load
+        self.apply = apply
+        self.signature = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """
+        파일이 바뀌었으면 다시 읽어서 적용
+
+        :return: 새 값을 적용했는지 여부
+        """
+        signature = self._stat()
+        if signature is None or signature == self.signature:
+            return False
+        # 검증에 실패해도 같은 내용을 계속 다시 읽지 않도록 먼저 기록
+        self.signature = signature
+        try:
+            value = self.load(self.path)
+        except Exception as e:
+            logger.warning(f'{self.path} 다시 불러오기 실패. 이전 설정 유지 : {e}')
+            return False
+        self.apply(value)
+        logger.info(f'{self.path} 다시 불러오기 성공')
+        return True
+
+
+class ConfigWatcher:
+    """
+    설정 파일과 규칙 파일의 수정 시각을 백그라운드 스레드에서 확인해서 바뀌면 다시 불러오는 클래스
+
+    파일을 읽고 검증하는 일은 백그라운드 스레드에서 하고, 크롤링 사이클에서는 바뀐 참조만 보게 됨
+    """
+
+    def __init__(self, interval):
+        """
+        :param interval: 파일을 확인하는 간격(초), 0 이하이면 확인하지 않음
+        """
+        self.interval = interval
+        self.files = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, path, load, apply):
+        """
+        감시할 파일 등록
+
+        :param path: 파일 경로
+        :param load: 파일을 읽어서 검증하고 새 값을 돌려주는 함수 (올바르지 않으면 예외 발생)
+        :param apply: 새 값을 적용하는 함수
+        """
+        self.files.append(WatchedFile(path, load, apply))
+
+    def check(self):
+        """
+        등록된 파일을 모두 확인
+
+        :return: 다시 불러온 파일 경로 리스트
+        """
+        return [f.path for f in self.files if f.check()]
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='config_watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('설정 파일 확인 실패')
@@ -0,0 +1,55 @@
+"""
+발행 경로의 각 호스트에 대해 새 연결로 보낸 첫 요청과 유지된 연결로 보낸 요청의 지연 시간을 비교하는 스크립트
+
+새 연결은 DNS 조회, TCP, TLS 연결 시간을 포함하므로 둘의 차이가 connection_keeper로 줄어드는 시간임
+
+사용법 : python connection_benchmark.py [반복 횟수]
+"""
+import statistics
+import sys
+import time
+
+import requests
+
+import connection_keeper
+import informations as i
+
+targets = {
+    'weather.go.kr': i.kma_base_url,
+    'data.jma.go.jp': i.jma_xml_url,
+    's3': 'https://jijinalimi.s3.amazonaws.com',
+    'fcm': 'https://fcm.googleapis.com',
+    'translate': 'https://translate.googleapis.com',
+}
+
+
+def measure(session, url):
+    """
+    HEAD 요청 하나의 소요 시간 (응답 코드는 확인하지 않음)
+    """
+    start = time.monotonic()
+    session.head(url, timeout=connection_keeper.PROBE_TIMEOUT, allow_redirects=False)
+    return time.monotonic() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, url in targets.items():
+        cold = []
+        warm = []
+        try:
+            for _ in range(count):
+                # 새 세션은 연결이 없으므로 첫 요청이 연결을 만듦
+                session = connection_keeper.create_session()
+                cold.append(measure(session, url))
+                warm.append(measure(session, url))
+                session.close()
+        except requests.exceptions.RequestException as e:
+            print(f'<{name}> 측정 실패 : {e}')
+            continue
+        print(f'<{name}> 첫 요청 중앙값 : 새 연결 {statistics.median(cold) * 1000:.1f}ms, '
+              f'유지된 연결 {statistics.median(warm) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
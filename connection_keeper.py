@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger('connection_keeper')
+
+# 연결 확인 요청의 제한 시간(초)
+PROBE_TIMEOUT = 5
+
+
+def create_session(pool_size=4) -> requests.Session:
+    """
+    keep-alive 연결을 재사용하는 세션을 만듦
+
+    같은 호스트의 요청(목록, 상세, 헤지 요청)이 연결을 나눠 쓰므로 DNS 조회, TCP, TLS 연결은 처음 한 번만 함
+
+    :param pool_size: 호스트별로 유지할 최대 연결 수
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def http_probe(session, url):
+    """
+    세션의 연결을 유지하기 위한 가벼운 HEAD 요청을 만드는 함수
+
+    :param session: 연결을 유지할 세션
+    :param url: 요청할 주소
+    :return: 인수 없이 호출하는 함수
+    """
+    def probe():
+        session.head(url, timeout=PROBE_TIMEOUT, allow_redirects=False)
+    return probe
+
+
+class ConnectionKeeper:
+    """
+    쉬는 동안에도 발행 경로의 연결(기상청, S3, Firebase, 번역)이 끊기지 않도록 주기적으로 가벼운 요청을 보내는 클래스
+
+    처음 시작할 때 모든 확인 요청을 바로 한 번 보내므로 번역, FCM 클라이언트의 인증과 연결도 미리 만들어짐
+    """
+
+    def __init__(self, name, interval):
+        """
+        :param name: 크롤러 이름 (kma, jma)
+        :param interval: 확인 요청을 보내는 간격(초), 0 이하이면 시작할 때 한 번만 보냄
+        """
+        self.name = name
+        self.interval = interval
+        self._probes = []  # (대상 이름, 함수)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, target, func):
+        """
+        확인 요청 등록
+
+        :param target: 대상 이름 (메트릭, 로그용)
+        :param func: 인수 없이 호출하는 함수. 예외가 발생하면 실패로 기록
+        """
+        self._probes.append((target, func))
+
+    def probe_all(self):
+        """
+        등록된 확인 요청을 모두 한 번씩 보냄
+
+        :return: {대상 이름: 소요 시간(초), 실패하면 None}
+        """
+        result = {}
+        for target, func in self._probes:
+            start = time.monotonic()
+            try:
+                func()
+            except Exception as e:
+                # 연결 유지용 요청이므로 경고 메일은 보내지 않음
+                metrics.KEEPALIVE_PROBES.inc(target=target, result='failure')
+                logger.info(f'<{self.name}> 연결 확인 실패 : {target} ({e})')
+                result[target] = None
+            else:
+                elapsed = time.monotonic() - start
+                metrics.KEEPALIVE_PROBES.inc(target=target, result='success')
+                metrics.KEEPALIVE_PROBE_SECONDS.observe(elapsed, target=target)
+                result[target] = elapsed
+        return result
+
+    def _run(self):
+        first = self.probe_all()
+        logger.info(f'<{self.name}> 연결 미리 만들기 완료 : '
+                    + ', '.join(f'{t} {"실패" if s is None else f"{s:.3f}초"}' for t, s in first.items()))
+        if self.interval <= 0:
+            return
+        while not self._stop.wait(self.interval):
+            self.probe_all()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}_connection_keeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -1,11 +1,30 @@
+import atexit
+import contextlib
+import copy
+import gzip
+import json
 import logging.handlers
-import traceback
+import os
+import queue
+import shutil
+import time
 import requests
 import informations as i
 
 from datetime import datetime
 from setting_management import MailgunSetting
 
+# 로그 레코드에 extra로 넘기면 JSON 로그에 같이 기록되는 필드
+STRUCTURED_FIELDS = ['event_id', 'stage', 'duration']
+
+# 로거 이름: 백그라운드에서 로그를 처리하는 QueueListener
+listeners = {}
+
+# 기록을 기다리는 로그 레코드의 최대 수 (넘으면 새 레코드를 버림)
+LOG_QUEUE_SIZE = 10000
+# 에러 메일 요청의 제한 시간(초) (메일 전송이 늦어지면 파일 로그도 밀리기 때문)
+MAIL_TIMEOUT = 10
+
 
 class MailgunLogHandler(logging.handlers.HTTPHandler):
     def __init__(self, subject: str, setting: MailgunSetting):
@@ -14,18 +33,166 @@ class MailgunLogHandler(logging.handlers.HTTPHandler):
         self.setting = setting
 
     def emit(self, record) -> None:
-        text = f'[{record.asctime}] {record.levelname}: {record.message}\n'
-        if record.exc_info is not None:
-            text += traceback.format_exc()
+        # 백그라운드 스레드에서 호출되므로 예외 정보는 레코드에 저장된 것을 사용
+        # 메일 전송이 실패해도 QueueListener 스레드가 죽지 않도록 예외는 handleError로 넘김
+        try:
+            text = self.format(record) + '\n'
+
+            res = requests.post(i.mg_request_url.format(self.setting.domain),
+                                auth=('api', self.setting.mg_api_key),
+                                data={
+                                    'from': self.setting.sender,
+                                    'to': self.setting.recipient,
+                                    'subject': self.subject,
+                                    'text': text
+                                },
+                                timeout=MAIL_TIMEOUT)
+
+            print(f'[{datetime.now()}] 에러 이메일 전송. {res.status_code} : {res.reason}')
+        except Exception:
+            self.handleError(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    로그를 한 줄짜리 JSON으로 변환하는 포매터
+    """
+
+    def format(self, record) -> str:
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    크기가 넘으면 이전 로그 파일을 gzip으로 압축해서 보관하는 핸들러 (ex. kma.log.1.gz)
+    """
+
+    def __init__(self, filename, max_bytes, backup_count):
+        super().__init__(filename=filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf8')
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    로그 레코드를 큐에 넣기만 하는 핸들러 (파일 쓰기, 메일 전송은 백그라운드 스레드에서 처리)
+    """
+
+    dropped = 0  # 큐가 가득 차서 버린 로그 레코드 수
+
+    def prepare(self, record):
+        # 같은 프로세스 안의 큐이므로 구조화된 필드는 그대로 두고 메시지와 예외 정보만 미리 문자열로 만듦
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # 큐가 가득 차면 로그를 기다리지 않고 버림 (폴링 스레드가 막히거나 메모리가 계속 늘지 않도록)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # 종료할 때는 큐가 가득 차 있어도 남은 로그를 기록한 뒤에 멈추도록 기다림
+        self.queue.put(self._sentinel)
+
+
+def init_logger(name, log_full_path, mail_subject, mailgun: MailgunSetting, max_bytes, backup_count,
+                extra_loggers=()):
+    """
+    로거를 초기화. 모든 로그는 큐를 거쳐서 백그라운드 스레드에서 파일(JSON), 콘솔, 메일로 기록됨
+
+    :param name: 로거 이름
+    :param log_full_path: 로그 파일 경로
+    :param mail_subject: 경고 메일 제목
+    :param mailgun: 메일건 설정
+    :param max_bytes: 로그 파일 최대 크기
+    :param backup_count: 압축해서 보관할 이전 로그 파일 수
+    :param extra_loggers: 같은 파일에 기록할 다른 로거 이름
+    :return: 로거
+    """
+    fmtter = logging.Formatter(fmt=u'[%(asctime)s] %(levelname)s: %(message)s',
+                               datefmt='%Y-%m-%d %H:%M:%S')
+
+    log_hdlr = CompressedRotatingFileHandler(log_full_path, max_bytes, backup_count)  # 파일 저장 로그
+    log_hdlr.setFormatter(JsonFormatter())
+    log_hdlr.setLevel(logging.INFO)
+
+    stream_hdlr = logging.StreamHandler()
+    stream_hdlr.setFormatter(fmtter)  # 콘솔 출력 로그
+    stream_hdlr.setLevel(logging.ERROR)
+
+    mail_hdlr = MailgunLogHandler(mail_subject, mailgun)
+    mail_hdlr.setLevel(logging.WARNING)
+    mail_hdlr.setFormatter(fmtter)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    listener = LogQueueListener(log_queue, log_hdlr, stream_hdlr, mail_hdlr, respect_handler_level=True)
+    listener.start()
+    if len(listeners) == 0:
+        atexit.register(stop_logging)
+    listeners[name] = listener
+
+    queue_hdlr = LogQueueHandler(log_queue)
+    logger = logging.getLogger(name)
+    for logger_name in (name,) + tuple(extra_loggers):
+        each = logging.getLogger(logger_name)
+        each.setLevel(logging.DEBUG)
+        each.addHandler(queue_hdlr)
+    return logger
+
+
+def stop_logging():
+    """
+    큐에 남은 로그를 모두 기록하고 백그라운드 스레드를 종료
+    """
+    while len(listeners) > 0:
+        _, listener = listeners.popitem()
+        listener.stop()
 
-        res = requests.post(i.mg_request_url.format(self.setting.domain),
-                            auth=('api', self.setting.mg_api_key),
-                            data={
-                                'from': self.setting.sender,
-                                'to': self.setting.recipient,
-                                'subject': self.subject,
-                                'text': text
-                            })
 
-        print(f'[{datetime.now()}] 에러 이메일 전송. {res.status_code} : {res.reason}')
+@contextlib.contextmanager
+def log_stage(logger, stage, event_id=None):
+    """
+    단계의 소요 시간을 구조화된 필드와 함께 기록
 
+    :param logger: 로거
+    :param stage: 단계 이름 (ex. save, notify)
+    :param event_id: 지진 id
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = round(time.monotonic() - start, 3)
+        logger.info(f'{stage} 단계 종료. 소요시간 : {duration}',
+                    extra={'event_id': event_id, 'stage': stage, 'duration': duration})
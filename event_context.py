@@ -0,0 +1,64 @@
+import logging
+
+
+class EventLogger(logging.LoggerAdapter):
+    """
+    로그에 지진 id를 같이 기록하는 로거 (동시에 처리하는 지진의 로그를 구분하기 위함)
+    """
+
+    def process(self, msg, kwargs):
+        # log_stage처럼 extra를 넘긴 경우에도 지진 id를 유지
+        kwargs['extra'] = dict(self.extra, **kwargs.get('extra', {}))
+        return f'[{self.extra["event_id"]}] {msg}', kwargs
+
+
+class EventContext:
+    """
+    지진 하나를 발행하는 동안 필요한 값을 묶어서 파싱, 번역, 저장, 알림 단계로 넘기는 클래스
+
+    발행 작업마다 새로 만들기 때문에 여러 지진(한국, 일본 기상청 발표 포함)을 동시에 처리해도 서로의 데이터가 섞이지 않음
+    """
+
+    def __init__(self, name, uid, state, setting, logger, token=None):
+        """
+        :param name: 크롤러 이름 (kma, jma)
+        :param uid: 발행할 데이터의 id
+        :param state: 발행 단계를 기록할 StateStore
+        :param setting: 이 발행 작업에서 사용할 설정 (도중에 설정 파일이 바뀌어도 같은 값을 사용)
+        :param logger: 크롤러의 로거
+        :param token: 같은 지진의 새 발표가 들어오면 중단하기 위한 PublishToken
+        """
+        self.name = name
+        self.uid = uid
+        self.state = state
+        self.setting = setting
+        self.logger = EventLogger(logger, {'event_id': uid})
+        self.token = token
+        self.push_data = {'country': name}  # 언어별로 번역된 알림 데이터
+
+    def check(self):
+        """
+        발행 단계 사이에 호출해서 오래된 작업이면 중단
+
+        :raises StalePublish: 같은 지진의 새로운 발표가 들어온 경우
+        """
+        if self.token is not None:
+            self.token.check()
+
+    def begin(self, **extra):
+        self.state.begin_publish(self.uid, **extra)
+
+    def is_step_done(self, step):
+        return self.state.is_step_done(self.uid, step)
+
+    def step_result(self, step):
+        return self.state.step_result(self.uid, step)
+
+    def mark_step(self, step, result=None):
+        self.state.mark_step(self.uid, step, result)
+
+    def finish(self, **last_ids):
+        self.state.finish_publish(self.uid, **last_ids)
+
+    def __repr__(self):
+        return f'<EventContext {self.name} {self.uid}>'
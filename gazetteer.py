@@ -0,0 +1,176 @@
+import config_watcher
+
+gazetteer_path = 'rules/gazetteer.json'
+
+# 번역할 언어 (번역 API의 언어 코드)
+languages = ['en', 'ja', 'zh-cn', 'zh-tw']
+
+# 여러 단어로 된 지명을 번역한 뒤에 이어 붙이는 문자 (ex. 포항시 북구 -> Pohang-si Buk-gu, 浦項市北区)
+separators = {'en': ' ', 'ja': '', 'zh-cn': '', 'zh-tw': ''}
+
+
+class _Node:
+    __slots__ = ('edges', 'value')
+
+    def __init__(self):
+        self.edges = {}  # 첫 글자: (간선 문자열, 자식 노드)
+        self.value = None
+
+
+class RadixTrie:
+    """
+    공통 접두사를 한 간선으로 합친 trie (자식이 하나뿐인 노드를 만들지 않아서 글자 단위 trie보다 노드 수가 적음)
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.size = 0
+
+    def insert(self, key: str, value):
+        node = self.root
+        while True:
+            if len(key) == 0:
+                if node.value is None:
+                    self.size += 1
+                node.value = value
+                return
+            edge = node.edges.get(key[0])
+            if edge is None:
+                child = _Node()
+                child.value = value
+                node.edges[key[0]] = (key, child)
+                self.size += 1
+                return
+            label, child = edge
+            common = 0
+            while common < len(label) and common < len(key) and label[common] == key[common]:
+                common += 1
+            if common < len(label):
+                # 간선을 공통 접두사에서 나눔
+                middle = _Node()
+                middle.edges[label[common]] = (label[common:], child)
+                node.edges[key[0]] = (label[:common], middle)
+                child = middle
+            node = child
+            key = key[common:]
+
+    def get(self, key: str):
+        end, value = self.longest_prefix(key)
+        return value if end == len(key) else None
+
+    def prefixes(self, text: str, start=0):
+        """
+        text[start:]의 접두사 중에 trie에 있는 key를 짧은 것부터 찾음
+
+        :return: (key가 끝나는 위치, 값) generator
+        """
+        node = self.root
+        pos = start
+        while True:
+            if node.value is not None and pos > start:
+                yield pos, node.value
+            if pos >= len(text):
+                return
+            edge = node.edges.get(text[pos])
+            if edge is None:
+                return
+            label, child = edge
+            if not text.startswith(label, pos):
+                return
+            node = child
+            pos += len(label)
+
+    def longest_prefix(self, text: str, start=0):
+        """
+        :return: (가장 긴 key가 끝나는 위치, 값) (없으면 (start, None))
+        """
+        result = (start, None)
+        for result in self.prefixes(text, start):
+            pass
+        return result
+
+
+class Gazetteer:
+    """
+    미리 번역된 지명(시/도, 시/군/구, 섬, 북한 지역)과 16방위를 trie에 넣고, 번역 API 없이 번역하는 클래스
+    """
+
+    def __init__(self, entries: dict):
+        """
+        :param entries: {한글 지명: {언어: 번역}}. 같은 이름이 여러 곳에 있으면 '넓은 지역 지명' 형식의 key를 사용 (ex. 경남 고성군)
+        """
+        self.trie = RadixTrie()
+        for word, translated in entries.items():
+            self.trie.insert(word, translated)
+
+    def __len__(self):
+        return self.trie.size
+
+    def __contains__(self, word):
+        return self.trie.get(word) is not None
+
+    def _match(self, text, pos):
+        """
+        pos에서 시작해서 단어 경계(띄어쓰기나 문자열 끝)에서 끝나는 가장 긴 지명을 찾음
+        """
+        result = None
+        for end, value in self.trie.prefixes(text, pos):
+            if end == len(text) or text[end] == ' ':
+                result = (end, value)
+        return result
+
+    def translate(self, text: str, dest: str, context: str = None, fallback=None):
+        """
+        지명을 번역. 띄어쓰기로 나뉜 단어는 각각 가장 긴 지명부터 찾아서 이어 붙임
+
+        :param text: 지명 (ex. 경주시, 포항시 북구, 남남서쪽)
+        :param dest: 번역할 언어 (en, ja, zh-cn, zh-tw)
+        :param context: 같은 이름의 지명을 구분하기 위한 넓은 지역 이름 (ex. 경남)
+        :param fallback: 지명 사전에 없는 단어를 바꾸는 함수 (ex. romanize.romanize_place)
+        :return: 번역된 지명 (fallback이 None이고 모르는 단어가 하나라도 있으면 None)
+        """
+        text = text.strip()
+        if len(text) == 0:
+            return None
+        words = []
+        pos = 0
+        if context is not None:
+            # 넓은 지역과 합친 key가 있으면 먼저 사용 (ex. 경남 고성군 -> 固城郡)
+            prefix = f'{context} '
+            found = self._match(prefix + text, 0)
+            if found is not None and found[0] > len(prefix):
+                words.append(found[1][dest])
+                pos = found[0] - len(prefix)
+        while pos < len(text):
+            if text[pos] == ' ':
+                pos += 1
+                continue
+            found = self._match(text, pos)
+            if found is None:
+                if fallback is None:
+                    return None
+                end = text.find(' ', pos)
+                end = len(text) if end == -1 else end
+                words.append(fallback(text[pos:end]))
+                pos = end
+                continue
+            pos, translated = found
+            words.append(translated[dest])
+        return separators[dest].join(words)
+
+    @staticmethod
+    def load(*paths):
+        """
+        지명 파일들을 읽고 검증해서 하나의 Gazetteer로 만듦 (뒤의 파일이 같은 지명을 덮어씀)
+
+        :raises InvalidConfig: 번역할 언어 중에 빠진 번역이 있는 경우
+        """
+        entries = {}
+        for path in paths:
+            data = config_watcher.load_json(path)
+            for word, translated in data.items():
+                for language in languages:
+                    if not isinstance(translated, dict) or not isinstance(translated.get(language), str):
+                        raise config_watcher.InvalidConfig(path, f'{word}의 {language} 번역이 없음')
+            entries.update(data)
+        return Gazetteer(entries)
@@ -0,0 +1,148 @@
+import json
+import math
+
+region_json_path = 'rules/regions.json'
+
+EARTH_RADIUS = 6371.0  # km
+
+COUNTRY_KR = 'kr'
+COUNTRY_JP = 'jp'
+
+# 16방위 (북쪽부터 시계방향)
+directions = ['북', '북북동', '북동', '동북동', '동', '동남동', '남동', '남남동',
+              '남', '남남서', '남서', '서남서', '서', '서북서', '북서', '북북서']
+
+regions = []
+trees = {}
+
+
+class NotInitializeGeocoder(Exception):
+    def __init__(self):
+        super().__init__("지역 색인이 초기화 되지 않았습니다. init_geocoder() 함수를 호출 필요")
+
+
+class GeoRegion:
+    """
+    좌표에서 가장 가까운 지역 정보를 저장하는 클래스
+    """
+
+    def __init__(self, name, wide, country, code, direction, distance):
+        self.name = name  # 시/군/구 또는 현 이름
+        self.wide = wide  # 광역 지역 이름 (일본은 현 이름과 같음)
+        self.country = country  # kr, jp
+        self.code = code  # 지역 코드 (한국: codes.json의 코드 * 1000 + 일련번호, 일본: 81000 + 도도부현 코드)
+        self.direction = direction  # 지역 중심에서 좌표가 있는 방향 (ex. 남남서쪽)
+        self.distance = distance  # 지역 중심에서 좌표까지의 거리(km)
+
+    def __repr__(self):
+        return str(vars(self))
+
+
+def _to_xyz(latitude, longitude):
+    """
+    위도, 경도를 단위 구 위의 3차원 좌표로 변환 (직선 거리가 대원 거리와 같은 순서를 가짐)
+    """
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+def _build_tree(indexes, depth=0):
+    """
+    지역 index 리스트로 KD-tree를 만듦
+
+    :return: (지역 index, 분할 축, 왼쪽 노드, 오른쪽 노드) 또는 None
+    """
+    if len(indexes) == 0:
+        return None
+    axis = depth % 3
+    indexes = sorted(indexes, key=lambda idx: regions[idx]['xyz'][axis])
+    median = len(indexes) // 2
+    return (indexes[median],
+            axis,
+            _build_tree(indexes[:median], depth + 1),
+            _build_tree(indexes[median + 1:], depth + 1))
+
+
+def _nearest(node, point, best):
+    if node is None:
+        return best
+    idx, axis, left, right = node
+    xyz = regions[idx]['xyz']
+    dist = sum((a - b) ** 2 for a, b in zip(xyz, point))
+    if best is None or dist < best[1]:
+        best = (idx, dist)
+
+    diff = point[axis] - xyz[axis]
+    near, far = (left, right) if diff < 0 else (right, left)
+    best = _nearest(near, point, best)
+    if diff ** 2 < best[1]:
+        best = _nearest(far, point, best)
+    return best
+
+
+def init_geocoder():
+    """
+    지역 중심점을 불러와 국가별 KD-tree를 만듦
+    """
+    global regions
+    global trees
+
+    with open(region_json_path, 'rb') as f:
+        regions = json.load(f)
+    for region in regions:
+        region['xyz'] = _to_xyz(region['latitude'], region['longitude'])
+
+    trees = {
+        None: _build_tree(list(range(len(regions)))),
+        COUNTRY_KR: _build_tree([idx for idx, r in enumerate(regions) if r['country'] == COUNTRY_KR]),
+        COUNTRY_JP: _build_tree([idx for idx, r in enumerate(regions) if r['country'] == COUNTRY_JP])
+    }
+
+
+def distance_and_bearing(from_lat, from_lon, to_lat, to_lon):
+    """
+    두 좌표 사이의 대원 거리와 방위각
+
+    :return: (거리(km), 방위각(도, 북쪽 0도 시계방향))
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (from_lat, from_lon, to_lat, to_lon))
+    d_lon = lon2 - lon1
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(d_lon / 2) ** 2
+    distance = 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+    y = math.sin(d_lon) * math.cos(lat2)
+    x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(d_lon)
+    bearing = (math.degrees(math.atan2(y, x)) + 360) % 360
+    return distance, bearing
+
+
+def bearing_to_direction(bearing):
+    """
+    방위각을 16방위 이름으로 변환 (ex. 202.5 -> 남남서쪽)
+    """
+    return directions[int((bearing + 11.25) // 22.5) % 16] + '쪽'
+
+
+def reverse(latitude, longitude, country=None):
+    """
+    좌표에서 가장 가까운 지역을 찾음
+
+    :param latitude: 위도
+    :param longitude: 경도
+    :param country: 찾을 국가 (kr, jp, None이면 전체)
+    :return: 가장 가까운 지역 정보
+    :rtype: GeoRegion
+    :raises NotInitializeGeocoder: init_geocoder() 함수가 호출되지 않은 경우
+    """
+    if len(trees) == 0:
+        raise NotInitializeGeocoder()
+
+    idx, _ = _nearest(trees[country], _to_xyz(latitude, longitude), None)
+    region = regions[idx]
+    distance, bearing = distance_and_bearing(region['latitude'], region['longitude'], latitude, longitude)
+    return GeoRegion(region['name'],
+                     region['wide'],
+                     region['country'],
+                     region['code'],
+                     bearing_to_direction(bearing),
+                     int(round(distance)))
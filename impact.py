@@ -0,0 +1,162 @@
+import json
+import math
+import os
+import threading
+
+import startup
+from setting_management import GlobalSetting
+
+# numpy는 처음 영향을 추정할 때 불러옴 (시작하자마자 크롤링을 시작하기 위해)
+np = startup.lazy_import('numpy')
+
+centroid_json_path = 'rules/korea_centroids.json'
+centroid_npy_file_name = 'korea_centroids.npy'
+
+EARTH_RADIUS = 6371.0  # km
+
+# 진앙지가 이 거리(km) 안에 있으면 한반도 근교 지진으로 봄
+NEAR_DISTANCE = 100.0
+
+# 공학적 기반(Vs=600m/s)에서 지표면으로의 최대속도 증폭률 (AVS30 = 400m/s 가정)
+SURFACE_AMPLIFICATION = 10 ** (1.83 - 0.66 * math.log10(400.0))
+
+centroid_names = []
+centroid_grid = None  # [[위도(rad), 경도(rad), cos(위도)], ...]
+centroid_npy_path = None  # 처음 추정할 때 불러올 격자 파일 경로
+_grid_lock = threading.Lock()
+
+
+class NotInitializeImpact(Exception):
+    def __init__(self):
+        super().__init__("인구 중심점 격자가 초기화 되지 않았습니다. init_impact() 함수를 호출 필요")
+
+
+class ImpactEstimate:
+    """
+    한반도에 미치는 영향 추정 결과를 저장하는 클래스
+    """
+
+    def __init__(self, notify, near, max_intensity, nearest_distance, regions):
+        self.notify = notify  # 알림을 보낼지 여부
+        self.near = near  # 진앙지가 한반도 근교인지 여부
+        self.max_intensity = max_intensity  # 추정 최대 진도 (계측 진도)
+        self.nearest_distance = nearest_distance  # 가장 가까운 인구 중심점까지의 진앙 거리(km)
+        self.regions = regions  # 인구 중심점별 추정 계측 진도
+
+    def __repr__(self):
+        return str(vars(self))
+
+
+def _build_grid_cache(npy_path):
+    """
+    인구 중심점 JSON을 격자 배열로 변환해서 .npy 파일로 저장
+
+    :param npy_path: 저장할 .npy 파일 경로
+    """
+    with open(centroid_json_path, 'rb') as f:
+        centroids = json.load(f)
+    lat = np.radians([c['latitude'] for c in centroids])
+    lon = np.radians([c['longitude'] for c in centroids])
+    grid = np.stack([lat, lon, np.cos(lat)], axis=1).astype(np.float64)
+
+    tmp_path = npy_path + '.tmp.npy'
+    np.save(tmp_path, grid)
+    os.replace(tmp_path, npy_path)
+
+
+def init_impact(setting: GlobalSetting):
+    """
+    인구 중심점 격자 파일 경로를 정함. 격자는 처음 영향을 추정할 때 불러옴 (_load_grid)
+
+    :param setting: 셋팅 클래스
+    """
+    global centroid_npy_path
+    global centroid_grid
+
+    os.makedirs(setting.data_path, exist_ok=True)
+    with _grid_lock:
+        centroid_npy_path = os.path.join(setting.data_path, centroid_npy_file_name)
+        centroid_grid = None
+
+
+def _load_grid():
+    """
+    인구 중심점 격자를 메모리 맵으로 불러옴. JSON이 바뀌었으면 .npy 파일을 다시 만듦
+
+    :raises NotInitializeImpact: init_impact() 함수가 호출되지 않은 경우
+    """
+    global centroid_names
+    global centroid_grid
+
+    with _grid_lock:
+        if centroid_grid is not None:
+            return centroid_grid
+        if centroid_npy_path is None:
+            raise NotInitializeImpact()
+        npy_path = centroid_npy_path
+        if not os.path.exists(npy_path) or os.path.getmtime(npy_path) < os.path.getmtime(centroid_json_path):
+            _build_grid_cache(npy_path)
+
+        with open(centroid_json_path, 'rb') as f:
+            centroids = json.load(f)
+        centroid_names = [c['name'] for c in centroids]
+        centroid_grid = np.load(npy_path, mmap_mode='r')
+        return centroid_grid
+
+
+def estimate_intensity(latitude, longitude, depth, magnitude):
+    """
+    인구 중심점별 계측 진도를 추정
+    (Si & Midorikawa(1999)의 최대속도 감쇠식과 Midorikawa 외(1999)의 계측진도 환산식 사용)
+
+    :param latitude: 진앙 위도
+    :param longitude: 진앙 경도
+    :param depth: 진원 깊이(km)
+    :param magnitude: 규모
+    :return: (인구 중심점별 계측 진도 배열, 진앙 거리 배열(km))
+    :raises NotInitializeImpact: init_impact() 함수가 호출되지 않은 경우
+    """
+    grid = _load_grid()
+
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    grid_lat = grid[:, 0]
+    grid_lon = grid[:, 1]
+    grid_cos = grid[:, 2]
+
+    # 진앙 거리 (haversine)
+    a = np.sin((grid_lat - lat) / 2) ** 2 + np.cos(lat) * grid_cos * np.sin((grid_lon - lon) / 2) ** 2
+    epicentral = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+    # 진원 거리
+    depth = min(abs(depth), 300.0)
+    x = np.sqrt(epicentral ** 2 + depth ** 2)
+
+    log_pgv = (0.58 * magnitude + 0.0038 * depth - 1.29
+               - np.log10(x + 0.0028 * 10 ** (0.5 * magnitude)) - 0.002 * x)
+    pgv = SURFACE_AMPLIFICATION * 10 ** log_pgv
+    intensity = np.clip(2.68 + 1.72 * np.log10(pgv), 0.0, 7.0)
+    return intensity, epicentral
+
+
+def estimate(latitude, longitude, depth, magnitude, threshold):
+    """
+    지진이 한반도에 영향을 주는지 추정
+
+    :param latitude: 진앙 위도
+    :param longitude: 진앙 경도
+    :param depth: 진원 깊이(km)
+    :param magnitude: 규모
+    :param threshold: 알림을 보낼 최소 계측 진도
+    :return: 영향 추정 결과
+    :rtype: ImpactEstimate
+    """
+    intensity, epicentral = estimate_intensity(latitude, longitude, depth, magnitude)
+    max_intensity = float(intensity.max())
+    nearest_distance = float(epicentral.min())
+    regions = {name: round(float(value), 1) for name, value in zip(centroid_names, intensity)}
+    return ImpactEstimate(max_intensity >= threshold,
+                          nearest_distance <= NEAR_DISTANCE,
+                          round(max_intensity, 1),
+                          round(nearest_distance, 1),
+                          regions)
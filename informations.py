@@ -10,6 +10,7 @@ kma_detail_url = 'https://www.weather.go.kr/w/wnuri-eqk-vol/eqk/report.do'
 # TEST
 # jma_xml_url = 'http://www.data.jma.go.jp/developer/xml/feed/eqvol_l.xml'
 jma_xml_url = 'http://www.data.jma.go.jp/developer/xml/feed/eqvol.xml'
+jma_xml_long_url = 'http://www.data.jma.go.jp/developer/xml/feed/eqvol_l.xml'
 jma_url = 'https://www.jma.go.jp/jp/quake/'
 jma_quake_sindo_index = 'https://www.jma.go.jp/jp/quake/quake_sindo_index.html'
 jma_quake_singen_index = 'https://www.jma.go.jp/jp/quake/quake_singen_index.html'
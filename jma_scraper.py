@@ -9,22 +9,39 @@ import ast
 import copy
 import datetime
 import json
-import logging.handlers
 import math
 import os
 import socket
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 import requests
-from PIL import Image
-from bs4 import BeautifulSoup
 
 import aws_s3
+import coalescer
+import config_watcher
+import connection_keeper
+import custom_logging_handler
+import event_context
+import geocoder
+import impact
 import informations as i
+import leader_election
+import memory
+import metrics
 import notification
+import outbox
+import profiler
+import startup
+import upstream
+from sequence import SequenceTracker
 from setting_management import GlobalSetting
-from custom_logging_handler import MailgunLogHandler
+from state_store import StateStore
+
+# 무거운 모듈은 처음 사용할 때 불러옴 (시작하자마자 크롤링을 시작하기 위해)
+Image = startup.lazy_import('PIL.Image')
+bs4 = startup.lazy_import('bs4')
 
 # 일본 기상청 API 에서 관심있는 타이틀 정보
 eqk_info_list = [
@@ -39,6 +56,28 @@ ids = ''
 # 일본 기상청에서 불러온 이전 지도 이미지 url 값
 jma_img_url = ''
 
+# 통보 종류별 지진 지도 인덱스 페이지
+img_index_list = [
+    i.jma_quake_sindo_index,
+    i.jma_quake_singen_index,
+    i.jma_quake_singendo_index
+]
+
+# 지도 이미지 주소를 상세 XML과 동시에 불러오기 위한 스레드 풀
+img_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='jma_img')
+
+# 지진 id별 지도 이미지 주소를 불러오는 작업 (future, 마감 시각)
+img_futures = {}
+
+# 끝난 지도 이미지 주소 작업을 발행 작업이 가져갈 때까지 마감 시각 이후로 보관하는 시간(초)
+IMG_RESULT_RETENTION = 600
+
+jma_session: requests.Session
+box: outbox.Outbox
+workers: outbox.OutboxWorkers
+jma_feed: upstream.Endpoint
+jma_detail: upstream.Endpoint
+
 
 class NotSupportedData(Exception):
     def __init__(self):
@@ -55,17 +94,35 @@ class FileDownloadFail(Exception):
         super().__init__('파일 다운로드가 실패하였습니다')
 
 
-def is_affect_korea(data: dict) -> (bool, int):
+def is_affect_korea(data: dict, ctx: event_context.EventContext) -> (bool, int):
     """
     이 지진이 한국에 영향을 끼치는지 확인
 
     :param data: 일본 기상청 지진 정보
+    :param ctx: 발행 작업 컨텍스트
     :return: 영향을 주는지 여부
     """
     # 진원지가 한반도일경우 알림 0번
     hypocenter = data.get('hypocenter')
     if hypocenter is not None and hypocenter == '朝鮮半島南部':
         return True, 0
+
+    # 진원 정보가 있으면 한반도 인구 중심점의 진도를 추정해서 판단
+    coordinate = data.get('coordinate')
+    magnitude = data.get('magnitude')
+    if coordinate is not None and magnitude is not None and not math.isnan(magnitude):
+        # 깊이는 미터 단위
+        estimate = impact.estimate(coordinate['latitude'], coordinate['longitude'], abs(coordinate['depth']) / 1000,
+                                   magnitude, ctx.setting.jma_setting.impact_threshold)
+        ctx.logger.info(f'한반도 영향 추정 결과 : {estimate}')
+        if estimate.notify:
+            # 진원 진도 정보는 진앙지가 한반도 근교면 알림 1, 그 외에 한반도에서 진도가 느껴질 수 있으면 알림 2
+            # 진도 속보, 진원 정보만 있는 발표는 대마도 관측 진도로 판단할 때와 같이 알림 3
+            if data.get('notify_type') != 2:
+                return True, 3
+            return True, 1 if estimate.near else 2
+
+    # 진원 정보가 없거나 추정 진도가 낮으면 대마도 관측 진도로 판단
     local_max_int = data.get('local_name_and_max_int')
     if local_max_int is not None and "長崎県対馬" in local_max_int.keys():
         tsusima_maxint = local_max_int.get("長崎県対馬")
@@ -85,41 +142,50 @@ def is_affect_korea(data: dict) -> (bool, int):
         return False, -1
 
 
-def _save_data_s3(data):
+def _save_data_s3(data, ctx: event_context.EventContext, publication=None):
     """
     s3에 지진 데이터를 저장하는 함수
 
     :param data: 지진데이터
-    :return: 저장 성공 여부
+    :param ctx: 발행 작업 컨텍스트
+    :param publication: 버전 키와 예전 경로에 저장할 발행 (None이면 예전 경로에 바로 저장)
     :raises NotSupportedData: data 파라메터가 EqkDataJma를 상속받는 클래스가 아니면 발생
+    :raises Exception: S3 저장에 실패하면 발생 (저장 단계를 완료로 기록하지 않고 발행 대기열에서 다시 시도)
     """
-    logger.info('데이터 저장 시작')
+    ctx.logger.info('데이터 저장 시작')
     if not isinstance(data, EqkDataJma):
         raise NotSupportedData()
 
     dict_data = {'jijin_data': data.to_dict()}
     file_name = 'data_jma_sindo_{0}.json' if isinstance(data, EqkSindoData) else 'data_jma_singen_{0}.json'
+    body = json.dumps(dict_data)
+    file_names = [file_name.format(language) for language in ['ko', 'ja', 'en', 'zh_Hans', 'zh_Hant']]
     try:
-        for language in ['ko', 'ja', 'en', 'zh_Hans', 'zh_Hant']:
-            aws_s3.save_s3(json.dumps(dict_data),
-                           aws_s3.JSON_PATH.format(file_name.format(language)),
-                           aws_s3.JSON_CONTENT)
-    except Exception as e:
-        logger.warning('데이터 저장 실패')
-        return False
+        if publication is not None:
+            # 일본 데이터는 번역하지 않아서 모든 언어의 내용이 같으므로 버전 키에는 한 번만 저장
+            publication.put(file_names[0], body, aliases=file_names[1:])
+        for name in file_names:
+            if publication is None:
+                aws_s3.save_s3(body, aws_s3.JSON_PATH.format(name), aws_s3.JSON_CONTENT)
+            else:
+                # 예전 경로의 파일은 manifest와 같이 갱신 (늦게 끝난 이전 지진이 최신 지진을 덮어쓰지 않도록)
+                publication.put_legacy(name, body)
+    except Exception:
+        ctx.logger.warning('데이터 저장 실패')
+        raise
 
-    logger.info('데이터 저장 성공')
-    return True
+    ctx.logger.info('데이터 저장 성공')
 
 
-def _save_image_s3(data):
+def _save_image_s3(data, ctx: event_context.EventContext):
     """
     s3에 지진 지도 이미지를 저장하는 함수
 
     :param data: 지진 데이터
-    :return: 저장 성고 여부
+    :param ctx: 발행 작업 컨텍스트
     :raises NotSupportedData: data 파라메터가 EqkDataJma를 상속받는 클래스가 아니면 발생
     :raises EmptyData: data파라메터의 img_url이나 img_name멤버가 비어있으면 발생
+    :raises Exception: S3 저장에 실패하면 발생 (저장 단계를 완료로 기록하지 않고 발행 대기열에서 다시 시도)
     """
     if not isinstance(data, EqkDataJma):
         raise NotSupportedData()
@@ -142,48 +208,53 @@ def _save_image_s3(data):
     try:
         img = Image.open(filename)
     except IOError:
-        logger.warning('이미지 리사이징 실패')
+        ctx.logger.warning('이미지 리사이징 실패')
     else:
+        # 리사이징에 실패하면 원본 이미지를 그대로 저장 (다시 시도해도 같은 결과이므로)
         try:
             img_resize = img.resize(img_size, Image.ANTIALIAS)
             img_resize.save(filename, optimize=True)
+            img_resize.close()
         except IOError:
-            logger.warning('이미지 리사이징 실패')
-            return False
+            ctx.logger.warning('이미지 리사이징 실패')
         except KeyError:
-            logger.warning('이미지 리사이징 실패')
-            return False
+            ctx.logger.warning('이미지 리사이징 실패')
+        finally:
+            img.close()
 
     try:
         with open(filename, 'rb') as f:
             aws_s3.save_s3(f, aws_s3.IMAGE_PATH.format(filename), aws_s3.IMAGE_PNG_CONTENT)
-    except Exception as e:
-        logger.warning('이미지 저장 실패')
-        return False
+    except Exception:
+        ctx.logger.warning('이미지 저장 실패')
+        raise
     else:
-        logger.info('이미지 리사이징 성공')
+        ctx.logger.info('이미지 저장 성공')
 
     # Delete file from server.
     os.remove(filename)
-    return True
 
 
 class EqkDataJma:
     def __init__(self, uuid, notify_type, notify_type_text):
         self.country = notification.COUNTRY_JMA
         self.id = uuid
+        self.event_id = uuid  # 같은 지진의 발표끼리 같은 값 (XML의 EventID)
         self.notify_type = notify_type  # 통보 종류
         self.notify_type_text = notify_type_text  # 통보 종류 이름
         self.img_url = ''
         self.img_name = ''
+        self.sequence = None  # 지진 계열 정보 {'id': 계열 id, 'mainshock': 본진 id, 'count': 계열의 지진 수}
 
     def to_dict(self):
         return dict(map(lambda item: (item[0], ast.literal_eval(repr(item[1]))), vars(self).items()))
 
-    def save(self, img_save=True):
-        _save_data_s3(self)
+    def save(self, ctx: event_context.EventContext, img_save=True, publication=None):
         if img_save:
-            _save_image_s3(self)
+            resolve_image(self, ctx)
+        _save_data_s3(self, ctx, publication)
+        if img_save and self.img_url != '':
+            _save_image_s3(self, ctx)
 
 
 class EqkSindoData(EqkDataJma):
@@ -203,7 +274,7 @@ class EqkSindoData(EqkDataJma):
         return dict(map(lambda item: (item[0], ast.literal_eval(repr(item[1]))), vars(self).items()))
 
     @staticmethod
-    def create(xml_data, uuid, notify_type, notify_type_text, img_load=True):
+    def create(xml_data, uuid, notify_type, notify_type_text):
         logger.info('진도에 관한 데이터 생성 시작')
         rv = EqkSindoData(uuid, notify_type, notify_type_text)
 
@@ -236,14 +307,6 @@ class EqkSindoData(EqkDataJma):
         else:
             rv.local_name_and_max_int = location_max_int
 
-        if img_load:
-            img_url, img_name = img_parsing(i.jma_quake_sindo_index)
-            if img_url == '':
-                logger.warning('진도에 관한 데이터 생성 실패')
-                return False, None
-            rv.img_url = img_url
-            rv.img_name = img_name
-
         logger.info('진도에 관한 데이터 생성 성공')
         return True, rv
 
@@ -259,6 +322,7 @@ class EqkSingenData(EqkDataJma):
         self.hypocenter = None
         self.coordinate = None
         self.magnitude = None
+        self.region_code = None  # 진앙에서 가장 가까운 지역 코드 (KMA 데이터와 같은 코드 체계)
 
     def __repr__(self):
         return str(vars(self))
@@ -267,7 +331,7 @@ class EqkSingenData(EqkDataJma):
         return dict(map(lambda item: (item[0], ast.literal_eval(repr(item[1]))), vars(self).items()))
 
     @staticmethod
-    def create(xml_data, uuid, notify_type, notify_type_text, img_load=True):
+    def create(xml_data, uuid, notify_type, notify_type_text):
         logger.info('진원에 관한 데이터 생성 시작')
         rv = EqkSingenData(uuid, notify_type, notify_type_text)
 
@@ -332,14 +396,7 @@ class EqkSingenData(EqkDataJma):
                     word += c
             loc_n, loc_e, depth = coord_info
             rv.coordinate = EqkCoordinate(float(loc_n), float(loc_e), float(depth))
-
-        if img_load:
-            img_url, img_name = img_parsing(i.jma_quake_singen_index)
-            if img_url == '':
-                logger.warning('진원에 관한 데이터 생성 실패')
-                return False, None
-            rv.img_url = img_url
-            rv.img_name = img_name
+            rv.region_code = geocoder.reverse(rv.coordinate.latitude, rv.coordinate.longitude).code
 
         logger.info('진원에 관한 데이터 생성 성공')
         return True, rv
@@ -358,13 +415,11 @@ class EqkSingendoData(EqkDataJma):
         return str(vars(self))
 
     def to_dict(self):
-        singendo = copy.deepcopy(vars(self))
+        # 하위 데이터는 각자 to_dict로 변환하므로 복사하지 않음
+        singendo = copy.deepcopy({k: v for k, v in vars(self).items() if k not in ['sindo_data', 'singen_data']})
         sindo = self.sindo_data.to_dict()
         singen = self.singen_data.to_dict()
 
-        del singendo['sindo_data']
-        del singendo['singen_data']
-
         for key, value in sindo.items():
             if key not in singendo.keys():
                 singendo[key] = value
@@ -375,86 +430,180 @@ class EqkSingendoData(EqkDataJma):
 
         return singendo
 
-    def save(self, img_save=True):
-        self.singen_data.save(img_save=False)
-        self.sindo_data.save(img_save=False)
-        _save_image_s3(self)
+    def save(self, ctx: event_context.EventContext, img_save=True, publication=None):
+        if img_save:
+            resolve_image(self, ctx)
+        self.singen_data.save(ctx, img_save=False, publication=publication)
+        self.sindo_data.save(ctx, img_save=False, publication=publication)
+        if img_save and self.img_url != '':
+            _save_image_s3(self, ctx)
 
     @staticmethod
     def create(xml_data, uuid, notify_type, notify_type_text):
         logger.info('진원 진도에 관한 데이터 생성 시작')
         rv = EqkSingendoData(uuid, notify_type, notify_type_text)
 
-        success, data = EqkSindoData.create(xml_data, uuid, notify_type, notify_type_text, False)
+        success, data = EqkSindoData.create(xml_data, uuid, notify_type, notify_type_text)
         if success:
             rv.sindo_data = data
         else:
             return False, None
 
-        success, data = EqkSingenData.create(xml_data, uuid, notify_type, notify_type_text, False)
+        success, data = EqkSingenData.create(xml_data, uuid, notify_type, notify_type_text)
         if success:
             rv.singen_data = data
         else:
             return False, None
 
-        img_url, img_name = img_parsing(i.jma_quake_singendo_index)
-        if img_url == '':
-            logger.warning('진원 진도에 관한 데이터 생성 실패')
-            return False, None
-
-        rv.img_url = img_url
-        rv.img_name = img_name
-        rv.sindo_data.img_url = img_url
-        rv.sindo_data.img_name = img_name
-        rv.singen_data.img_url = img_url
-        rv.singen_data.img_name = img_name
         logger.info('진원 진도에 관한 데이터 생성 성공')
         return True, rv
 
 
-def img_parsing(jma_url, jma_access_max_count=10):
+def img_parsing(jma_url, jma_access_max_count=10, deadline=None):
     """
     일본 기상청에서 지진 지도 불러오기
 
     :param jma_url: 일본 기상청 url
     :param jma_access_max_count: 지도를 불러오기위해 시도해보는 횟수
+    :param deadline: 이 시각(time.monotonic 기준)이 지나면 포기 (None이면 제한 없음)
     :return: (이미지 url, 파일 이름)
     """
+    def remain_time():
+        return 10 if deadline is None else min(10, deadline - time.monotonic())
+
     logger.info('이미지 불러오기 시작')
     try:
-        jma_html = requests.get(jma_url)
+        jma_html = requests.get(jma_url, timeout=max(0.1, remain_time()))
+        metrics.UPSTREAM_RESPONSES.inc(upstream='jma_map_list', status=jma_html.status_code)
         jma_html.raise_for_status()
         jma_html.encoding = 'utf8'
-        jma_bs = BeautifulSoup(jma_html.text, 'html.parser')
+        jma_bs = bs4.BeautifulSoup(jma_html.text, 'html.parser')
         temp_url = jma_bs.select_one('div.infotable a')['href']
+        memory.release(jma_bs)
         url = i.jma_url + temp_url[2:]
         count = 0
         while count < jma_access_max_count:
+            if remain_time() <= 0:
+                logger.warning('이미지를 불러오는 제한 시간 초과')
+                return '', ''
             try:
-                req = requests.get(url=url, timeout=10)
+                req = requests.get(url=url, timeout=remain_time())
+                metrics.UPSTREAM_RESPONSES.inc(upstream='jma_map', status=req.status_code)
                 req.encoding = 'utf8'
                 req.raise_for_status()
             except requests.exceptions.Timeout as e:
+                metrics.UPSTREAM_RESPONSES.inc(upstream='jma_map', status='timeout')
                 logger.warning('이미지를 불러오는데 시간이 너무 오래 걸림')
-                time.sleep(2 ** count)
+                time.sleep(max(0, min(2 ** count, remain_time())))
                 count += 1
                 continue
             except socket.timeout as e:
                 logger.warning('이미지를 불러오는데 시간이 너무 오래 걸림')
-                time.sleep(2 ** count)
+                time.sleep(max(0, min(2 ** count, remain_time())))
                 count += 1
                 continue
             except requests.exceptions.HTTPError as e:
                 logger.warning('이미지를 불러오기 실패')
                 return '', ''
             else:
-                bs = BeautifulSoup(req.text, 'html.parser')
+                bs = bs4.BeautifulSoup(req.text, 'html.parser')
                 img_url = bs.find('img', attrs={'usemap': '#quakemap'})['src']
+                memory.release(bs)
                 img_url = i.jma_url + img_url[2:]
                 return img_url, 'jma_eq_' + img_url.split('/')[-1]
     except:
         logger.warning('이미지 불러오기 실패')
         return '', ''
+    logger.warning('이미지 불러오기 실패')
+    return '', ''
+
+
+def request_image(uid, notify_type, timeout):
+    """
+    지도 이미지 주소를 백그라운드에서 불러오기 시작
+
+    :param uid: 지진 id
+    :param notify_type: 통보 종류 (eqk_info_list의 인덱스)
+    :param timeout: 이미지 주소를 불러오는 제한 시간(초)
+    :return: (future, 마감 시각)
+    """
+    deadline = time.monotonic() + timeout
+    pending = (img_executor.submit(img_parsing, img_index_list[notify_type], deadline=deadline), deadline)
+    img_futures[uid] = pending
+    return pending
+
+
+def drop_image(uid):
+    """
+    더 이상 기다리지 않을 지도 이미지 주소 작업을 취소하고 지움
+    """
+    pending = img_futures.pop(uid, None)
+    if pending is not None:
+        pending[0].cancel()
+
+
+def expire_images():
+    """
+    마감 시각이 지난 지도 이미지 주소 작업을 지움 (저장하지 않는 지진의 작업이 계속 쌓이지 않도록 사이클마다 호출)
+    끝난 작업은 발행 대기열이 밀려 있을 수 있으므로 IMG_RESULT_RETENTION 동안 더 보관하고,
+    그 뒤에 발행하는 지진은 resolve_image에서 다시 불러옴
+    """
+    now = time.monotonic()
+    expired = [uid for uid, (future, deadline) in list(img_futures.items())
+               if deadline + (IMG_RESULT_RETENTION if future.done() else 0) < now]
+    for uid in expired:
+        drop_image(uid)
+
+
+def _set_image(data, img_url, img_name):
+    data.img_url = img_url
+    data.img_name = img_name
+    if isinstance(data, EqkSingendoData):
+        for sub_data in (data.sindo_data, data.singen_data):
+            sub_data.img_url = img_url
+            sub_data.img_name = img_name
+
+
+def resolve_image(data, ctx: event_context.EventContext, wait=True):
+    """
+    동시에 불러오고 있던 지도 이미지 주소를 마감 시각까지 기다려서 data에 채워 넣음
+
+    발행 대기열에는 이미지 주소를 불러오기 전의 데이터가 저장되므로 불러온 주소는 발행 단계 기록(image)에 남기고,
+    다시 시도하거나 재시작해서 불러오는 작업이 없으면 기록된 주소를 사용하거나 다시 불러옴
+
+    :param data: 지진 데이터
+    :param ctx: 발행 작업 컨텍스트
+    :param wait: False면 이미 끝난 경우에만 채워 넣고 기다리지 않음
+    :return: 이미지 주소를 불러왔는지 여부
+    """
+    if data.img_url != '':
+        return True
+    pending = img_futures.get(data.id)
+    if pending is None:
+        image = ctx.step_result('image')
+        if image is not None:
+            _set_image(data, image['img_url'], image['img_name'])
+            return True
+        pending = request_image(data.id, data.notify_type, ctx.setting.jma_setting.img_deadline)
+
+    future, deadline = pending
+    if not wait and not future.done():
+        return False
+    img_futures.pop(data.id, None)
+    try:
+        img_url, img_name = future.result(timeout=max(0, deadline - time.monotonic()))
+    except TimeoutError:
+        future.cancel()
+        ctx.logger.warning('지도 이미지 주소를 제한 시간 안에 불러오지 못함. 이미지 없이 저장')
+        return False
+
+    if img_url == '':
+        ctx.logger.warning('지도 이미지 주소를 불러오지 못함. 이미지 없이 저장')
+        return False
+
+    _set_image(data, img_url, img_name)
+    ctx.mark_step('image', {'img_url': img_url, 'img_name': img_name})
+    return True
 
 
 class EqkCoordinate:
@@ -488,17 +637,57 @@ def create_eqk_singendo_data(xml_data, uuid, notify_type, notify_type_text):
 
 def create_eqk_data_support(entry, notify_type):
     uuid = entry.id.text
-    notify_type = notify_type
-    notify_type_text = eqk_info_list[notify_type]
-    xml = requests.get(entry.link.attrs['href'])
+
+    # 지도 이미지 주소는 상세 XML과 동시에 불러오고, 파싱과 알림은 이미지를 기다리지 않음
+    request_image(uuid, notify_type, setting.jma_setting.img_deadline)
+
+    try:
+        xml = jma_detail.get(entry.link.attrs['href'])
+        xml.raise_for_status()
+    except upstream.CircuitOpen as e:
+        # 막기 시작할 때 upstream에서 경고를 남기므로 여기서는 경고하지 않음
+        logger.info(f'상세 XML 불러오기 건너뜀 : {e}')
+        drop_image(uuid)
+        return False, None
+    except requests.exceptions.RequestException as e:
+        # 다음 사이클에 같은 entry를 다시 불러옴
+        logger.warning(f'상세 XML 불러오기 실패 : {e}')
+        drop_image(uuid)
+        return False, None
     xml.encoding = 'utf-8'
-    xml_p = BeautifulSoup(xml.text, 'lxml-xml')
+    success, data = parse_eqk_xml(xml.text, uuid, notify_type)
+
+    if not success:
+        drop_image(uuid)
+    return success, data
+
+
+def parse_eqk_xml(text, uuid, notify_type):
+    """
+    상세 XML을 파싱해서 지진 데이터를 만듦 (이력 백필에서도 사용)
+
+    :param text: 상세 XML
+    :param uuid: 피드 entry의 id
+    :param notify_type: 통보 종류 (eqk_info_list의 인덱스)
+    :return: 성공 여부, 지진 데이터
+    """
+    notify_type_text = eqk_info_list[notify_type]
+    xml_p = bs4.BeautifulSoup(text, 'lxml-xml')
+    event_id = xml_p.select_one('Head > EventID')
     if notify_type == 0:
-        return create_eqk_sindo_data(xml_p, uuid, notify_type, notify_type_text)
+        success, data = create_eqk_sindo_data(xml_p, uuid, notify_type, notify_type_text)
     elif notify_type == 1:
-        return create_eqk_singen_data(xml_p, uuid, notify_type, notify_type_text)
-    elif notify_type == 2:
-        return create_eqk_singendo_data(xml_p, uuid, notify_type, notify_type_text)
+        success, data = create_eqk_singen_data(xml_p, uuid, notify_type, notify_type_text)
+    else:
+        success, data = create_eqk_singendo_data(xml_p, uuid, notify_type, notify_type_text)
+    if event_id is not None:
+        event_id = event_id.text
+    # 필요한 값은 문자열로 뽑아냈으므로 트리는 바로 해제
+    memory.release(xml_p)
+
+    if success and event_id is not None:
+        data.event_id = event_id
+    return success, data
 
 
 def create_eqk_data(entry, nt_tp):
@@ -513,23 +702,173 @@ def create_eqk_data(entry, nt_tp):
     return create_eqk_data_support(entry, nt_tp)
 
 
-def data_save_notify(data):
+def tag_sequence(data):
+    """
+    지진 이력에서 같은 계열(본진, 여진)을 찾아서 계열 정보를 붙임 (진원 정보가 있는 데이터만)
+
+    :param data: 일본 기상청으로부터 불러온 데이터
+    """
+    singen = data.singen_data if isinstance(data, EqkSingendoData) else data
+    if not isinstance(singen, EqkSingenData) or math.isnan(singen.magnitude):
+        return
+    data.sequence = sequence_tracker.add(data.id, singen.datetime, singen.coordinate.latitude,
+                                         singen.coordinate.longitude, singen.magnitude)
+    logger.info(f"지진 계열 정보 : {data.sequence}")
+
+
+def event_key(data):
+    """
+    震度速報, 震源に関する情報, 震源・震度に関する情報처럼 같은 지진에 대한 발표를 구분하는 값
+    """
+    return f'{notification.COUNTRY_JMA}:{data.event_id}'
+
+
+def data_save_notify(token, data):
     """
     일본 기상청으로부터 불러온 데이터를 가지고 한국에 영향을 주는 지진인지 판단한 후에
     영향을 주는 지진이면 알림을 보냄과 동시에 S3에 데이터를 저장
     
+    :param token: 발행 작업 토큰 (같은 지진의 새 발표가 들어오면 단계 사이에서 중단됨)
     :param data: 일본 기상청으로부터 불러온 데이터
     """
-    affected, num_notify = is_affect_korea(data.to_dict())
+    # 설정과 로거는 이 지진의 컨텍스트에서 가져오므로 여러 지진을 동시에 처리할 수 있음
+    ctx = event_context.EventContext(notification.COUNTRY_JMA, data.id, state, setting, logger, token)
+    # 도중에 프로그램이 죽으면 재시작시 발행 대기열에서 다시 꺼내서 끝난 단계는 건너뛰고 이어서 진행
+    ctx.begin()
+    affected, num_notify = is_affect_korea(data.to_dict(), ctx)
     if affected:
-        logger.info("한국에 영향을 주는 지진을 불러옴. 저장 및 알림 시작")
-        notification.push_notify(data.to_dict(), num_notify)
-        data.save()
+        ctx.logger.info("한국에 영향을 주는 지진을 불러옴. 저장 및 알림 시작")
+        # 알림은 지도 이미지를 기다리지 않음 (이미 불러왔으면 같이 보냄)
+        resolve_image(data, ctx, wait=False)
+        # 재시작 전에 이미 끝난 단계는 건너뜀
+        # 같은 지진의 알림은 모아서 보냄
+        if not ctx.is_step_done('notify'):
+            with custom_logging_handler.log_stage(ctx.logger, 'notify', data.event_id):
+                token.push(notification.push_notify, data.to_dict(), num_notify)
+            ctx.mark_step('notify')
+        ctx.check()
+        if not ctx.is_step_done('save'):
+            with custom_logging_handler.log_stage(ctx.logger, 'save', data.event_id):
+                # 모든 파일을 저장한 뒤에 언어별 데이터를 묶은 파일을 저장하고 마지막으로 manifest 갱신
+                # 발표 시각으로 발행 순서를 비교 (진원 진도 데이터는 하위 데이터의 발표 시각을 사용)
+                publication = aws_s3.Publication(notification.COUNTRY_JMA, data.id, data.to_dict()['datetime_ann'])
+                data.save(ctx, publication=publication)
+                # 일본 데이터는 번역하지 않으므로 모든 필드가 공통 필드로 묶임
+                publication.put_bundle(dict.fromkeys(notification.support_language, data.to_dict()))
+                if not publication.commit():
+                    ctx.logger.info("더 최근에 발표된 지진이 이미 발행되어 manifest와 예전 경로의 파일은 갱신하지 않음")
+            ctx.mark_step('save')
     else:
-        logger.info("한국에 영향을 주지 않는 지진을 불러옴. 저장 및 알림 없음")
+        ctx.logger.info("한국에 영향을 주지 않는 지진을 불러옴. 저장 및 알림 없음")
+        drop_image(data.id)
+
+    ctx.finish(ids=data.id)
+
+
+def publish_key(uid):
+    """
+    발행 대기열에서 같은 발표를 구분하는 값 (idempotency key)
+    """
+    return f'{notification.COUNTRY_JMA}:{uid}'
+
+
+def enqueue_publish(data):
+    """
+    새 지진을 발행 대기열에 넣음 (같은 발표는 한 번만 들어감)
+    """
+    box.append(publish_key(data.id), event_key(data), data)
+    workers.notify()
 
-    with open(setting.jma_setting.full_path, 'w') as f:
-        f.write(data.id)
+
+def discard_publish(idempotency_key):
+    """
+    발행 대기열에서 끝난 작업(완료, 교체, 포기)의 발행 단계 기록을 지움
+    (남겨두면 재시작하거나 리더를 넘겨받을 때마다 다시 확인해야 하고 상태 파일이 계속 커짐)
+    """
+    state.discard_publish(idempotency_key.split(':', 1)[1])
+
+
+def hold_publish(data):
+    """
+    대기 인스턴스에서 발행하지 않은 지진을 발행 대기 상태로 기록 (리더를 넘겨받으면 resume_publish에서 발행)
+    """
+    # 리더를 넘겨받아서 발행할 때는 지도 이미지 주소를 다시 불러옴
+    drop_image(data.id)
+    state.hold_publish(data.id, outbox.dumps(data), ids=data.id)
+
+
+def prune_held(leader_alive_until):
+    """
+    대기 인스턴스일 때 기록한 지진 중에 살아있던 리더가 이미 불러왔을 지진의 기록을 지움
+    (리더가 살아있던 시각보다 폴링 주기 이상 먼저 불러온 지진은 리더도 불러와서 발행 대기열에 넣었다고 봄)
+
+    :param leader_alive_until: 다른 인스턴스가 리더로 살아있던 것이 확실한 마지막 시각 (없으면 None)
+    """
+    cutoff = None if leader_alive_until is None else leader_alive_until - setting.jma_setting.sleep_time
+    for publish in state.pending_publishes():
+        held = publish['extra'].get('held')
+        if held is None:
+            continue
+        status = box.status(publish_key(publish['uid']))
+        if status in (outbox.PENDING, outbox.RUNNING):
+            continue
+        # 발행 대기열에서 이미 끝났거나 리더가 살아있을 때 불러온 지진
+        if status is not None or (cutoff is not None and held < cutoff):
+            state.discard_publish(publish['uid'])
+
+
+def resume_publish():
+    """
+    처음 시작했거나 리더를 넘겨받았을 때 발행 단계 기록을 발행 대기열과 맞춤
+
+    대기 인스턴스일 때 기록만 해둔 지진은 발행 대기열에 넣고 (이전 리더가 이미 넣었으면 idempotency key로 걸러짐),
+    진행중이던 작업은 발행 대기열에 저장된 지진 데이터로 다시 처리하므로(Outbox.recover) 상세 XML을 다시 불러오지 않고,
+    발행 대기열에서 이미 끝났거나 지워진 작업의 기록은 지움
+
+    :return: 이어서 진행할 작업이 있는지 여부
+    """
+    resumed = False
+    for publish in state.pending_publishes():
+        status = box.status(publish_key(publish['uid']))
+        if status in (outbox.PENDING, outbox.RUNNING):
+            logger.info(f"끝나지 않은 발행 작업 이어서 진행 : {publish['uid']}")
+            resumed = True
+        elif status is None and 'event' in publish['extra']:
+            # 리더가 발행하기 전에 죽어서 대기 인스턴스일 때 기록만 해둔 지진
+            logger.info(f"대기 인스턴스일 때 기록한 지진 발행 : {publish['uid']}")
+            enqueue_publish(*outbox.loads(publish['extra']['event']))
+            resumed = True
+        else:
+            logger.info(f"발행 대기열에 없는 발행 작업 기록 삭제 : {publish['uid']}")
+            state.discard_publish(publish['uid'])
+    if resumed:
+        workers.notify()
+    return resumed
+
+
+def checkpoint():
+    """
+    다시 실행하기 전에 진행중인 발행 작업을 기다리고 상태를 저장
+    """
+    # 모아서 보내려고 기다리는 알림은 바로 보냄 (알림을 보내야 발행 작업이 끝남)
+    publisher.flush()
+    workers.join(timeout=setting.jma_setting.sleep_time * 6)
+    state.save()
+    sequence_tracker.save()
+
+
+def apply_setting(new_setting: GlobalSetting):
+    """
+    다시 불러온 설정을 적용 (재시작해야 적용되는 설정이 바뀌었으면 경고만 남김)
+    """
+    global setting
+    changed = setting.restart_required(new_setting)
+    if len(changed) > 0:
+        logger.warning(f'재시작해야 적용되는 설정이 바뀜 : {changed}')
+    setting = new_setting
+    notification.global_setting = new_setting
+    aws_s3.g_setting = new_setting
+    publisher.push_window = new_setting.push_window
 
 
 def crawling_start(sleep: float):
@@ -539,46 +878,105 @@ def crawling_start(sleep: float):
     :param sleep: 몇초에 한번씩 크롤링 할것인가
     """
     global ids
-    restarted = os.path.exists(setting.jma_setting.full_path)
+    global workers
+    restarted = ids != ''
     if not restarted:
         print(f'[{datetime.datetime.now()}] <JMA> 처음으로 프로그램 실행')
     else:
         print(f'[{datetime.datetime.now()}] <JMA> 프로그램 재실행')
 
+    # 이중화 구성시 리더만 저장 및 알림을 수행하고, 대기 인스턴스는 폴링과 파싱만 계속함
+    elector = leader_election.create_elector(setting.leader, 'jma', sleep)
+    elector.start()
+    was_leader = False
+
+    # 발행 대기열의 작업은 리더만 꺼내서 처리
+    workers = outbox.OutboxWorkers('jma', box, publisher, data_save_notify, setting.outbox.workers,
+                                   setting.outbox.max_attempts, setting.outbox.max_backoff,
+                                   is_active=lambda: elector.is_leader)
+
+    # 느린 사이클 프로파일링과 SIGUSR1을 받으면 스레드 스택, 상태 저장
+    cycle_profiler = profiler.CycleProfiler('jma', setting.profile.output_path, setting.profile.slow_cycle,
+                                            setting.profile.enabled)
+    profiler.install_dump_signal('jma', setting.profile.output_path, lambda: {
+        'ids': ids,
+        'pending_publish': state.pending_publishes(),
+        'pending_jobs': box.pending_keys(),
+        'pending_images': list(img_futures.keys()),
+        'is_leader': elector.is_leader
+    })
+
+    # 시작할 때 만든 객체는 GC 검사 대상에서 제외
+    memory.freeze()
+    memory_guard = memory.MemoryGuard(setting.memory_limit_mb)
+
     dt = sleep - 0.1
     while True:
+        # 메모리 사용량이 제한을 넘으면 상태를 저장하고 다시 실행
+        if memory_guard.after_cycle():
+            memory.reexec(checkpoint)
+        # 설정 파일을 다시 불러오면 바뀐 간격이 다음 사이클부터 적용됨
+        sleep = setting.jma_setting.sleep_time
         t = math.fmod(dt, sleep)
         time.sleep(sleep - t)
         logger.info("지진 데이터를 불러오는 사이클 시작")
+        startup.mark_first_poll('jma')
         start_time = time.time()
-        # 기상청에서 xml데이터 가져오기
-        xml = requests.get(i.jma_xml_url)
-        xml.encoding = 'utf-8'
-        # xml 파싱
-        bs = BeautifulSoup(xml.text, 'lxml-xml')
-        # 관심 있는 데이터만 필터링
-        entrys = bs.find_all('entry')
-        entrys = list(filter(lambda entry: entry.title.text in eqk_info_list, entrys))
+        expire_images()
+        cycle_profiler.start()
+        event_id = None
+        # 처음 시작했거나 리더를 넘겨받았으면 끝나지 않은 발행 작업을 이어서 진행
+        if elector.is_leader and not was_leader:
+            prune_held(elector.leader_alive_until)
+            resume_publish()
+        was_leader = elector.is_leader
+        # 기상청에서 xml데이터 가져오기 (바뀌지 않았으면 304)
+        try:
+            xml = jma_feed.get(i.jma_xml_url, headers=state.get_validators(i.jma_xml_url))
+            xml.raise_for_status()
+            xml.encoding = 'utf-8'
+        except upstream.CircuitOpen as e:
+            # 막기 시작할 때 upstream에서 경고를 남기므로 사이클마다 경고하지 않음
+            logger.info(f'지진 피드 불러오기 건너뜀 : {e}')
+            xml = None
+        except requests.exceptions.RequestException as e:
+            # 다음 사이클에 다시 시도 (연속으로 실패하면 서킷 브레이커가 요청 간격을 늘림)
+            logger.warning(f'지진 피드 불러오기 실패 : {e}')
+            xml = None
+        entrys = []
+        bs = None
+        if xml is not None and xml.status_code != 304:
+            state.set_validators(i.jma_xml_url, xml.headers)
+            # xml 파싱
+            bs = bs4.BeautifulSoup(xml.text, 'lxml-xml')
+            # 관심 있는 데이터만 필터링
+            entrys = bs.find_all('entry')
+            entrys = list(filter(lambda entry: entry.title.text in eqk_info_list, entrys))
+        # 피드를 불러오지 못했으면
+        if xml is None:
+            pass
+        # 피드가 바뀌지 않았으면
+        elif xml.status_code == 304:
+            logger.info("새로운 지진데이터가 없음")
         # 관심 있는 데이터가 한개라도 있으면
-        if len(entrys) > 0:
+        elif len(entrys) > 0:
             first = entrys[0]
             # 이전에 불러온 id와 비교해서 다르면
             if first.id.text != ids:
                 logger.info("새로운 지진을 불러들임")
+                event_id = first.id.text
                 success, data = create_eqk_data(first, eqk_info_list.index(first.title.text))
                 # 지진 데이터를 불러오는데 성공하면
                 if success:
-                    if restarted:
-                        logger.info("재시작 루틴")
-                        restarted = False
-                        with open(setting.jma_setting.full_path, 'r') as f:
-                            file_uid = f.readline()
-                        # 파일에 저장된 uid와 새로 불러온 uid가 같으면
-                        if first.id.text == file_uid:
-                            continue
                     ids = first.id.text
                     logger.info("새로운 지진을 불러들이는데 성공함")
-                    data_save_notify(data)
+                    tag_sequence(data)
+                    if elector.is_leader:
+                        enqueue_publish(data)
+                    else:
+                        logger.info("대기 인스턴스이므로 저장 및 알림 없이 발행 대기 상태로 기록")
+                        hold_publish(data)
+                        prune_held(elector.leader_alive_until)
                 # 지진 데이터를 불러오는데 실패하면
                 else:
                     logger.info("모종의 이유로 지진을 불러들이는데 실패함")
@@ -588,9 +986,15 @@ def crawling_start(sleep: float):
         # 관심 있는 데이터가 한개도 없으면
         else:
             logger.info("API에 지진과 관련된 데이터가 없음")
+        # 필요한 값은 모두 문자열로 뽑아냈으므로 피드 트리는 바로 해제
+        memory.release(bs)
         end_time = time.time()
         dt = end_time - start_time
-        logger.info(f"지진 데이터를 불러오는 사이클 종료. 소요시간 : {dt}")
+        logger.info(f"지진 데이터를 불러오는 사이클 종료. 소요시간 : {dt}", extra={'stage': 'poll', 'duration': round(dt, 3)})
+        metrics.POLL_SECONDS.observe(dt, stage='crawling_start')
+        if xml is not None:
+            metrics.mark_success()
+        cycle_profiler.stop(dt, event_id)
 
 
 if __name__ == "__main__":
@@ -607,34 +1011,72 @@ if __name__ == "__main__":
 
     # 로거 초기화
     os.makedirs(setting.log_path, exist_ok=True)
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
-    fmtter = logging.Formatter(fmt=u'[%(asctime)s] %(levelname)s: %(message)s',
-                               datefmt='%Y-%m-%d %H:%M:%S')
-
-    log_hdlr = logging.handlers.RotatingFileHandler(filename=setting.jma_setting.log_full_path,
-                                                    maxBytes=1024 * 1024, backupCount=1, encoding='utf8')  # 파일 저장 로그
-    log_hdlr.setFormatter(fmtter)
-    log_hdlr.setLevel(logging.INFO)
-    logger.addHandler(log_hdlr)
-
-    stream_hdlr = logging.StreamHandler()
-    stream_hdlr.setFormatter(fmtter)  # 콘솔 출력 로그
-    stream_hdlr.setLevel(logging.ERROR)
-    logger.addHandler(stream_hdlr)
-
-    mail_hdlr = MailgunLogHandler('일본 기상청 크롤러로부터 경고!!!', setting.mailgun)
-    mail_hdlr.setLevel(logging.WARNING)
-    mail_hdlr.setFormatter(fmtter)
-    logger.addHandler(mail_hdlr)
+    logger = custom_logging_handler.init_logger(__name__, setting.jma_setting.log_full_path,
+                                                '일본 기상청 크롤러로부터 경고!!!', setting.mailgun,
+                                                setting.log_max_bytes, setting.log_backup_count,
+                                                extra_loggers=('coalescer', 'config_watcher', 'leader_election',
+                                                               'memory', 'metrics', 'profiler', 'startup',
+                                                               'upstream', 'connection_keeper', 'outbox'))
 
     # 설정된 데이터를 저장할 디렉토리가 존재하지 않으면
     if not os.path.exists(setting.jma_setting.current_data_path):
         # 디렉토리 생성
         os.makedirs(setting.jma_setting.current_data_path)
 
+    # 이전 실행의 상태 불러오기
+    state = StateStore(setting.jma_setting.state_full_path)
+    ids = state.get_last_id('ids', '')
+    if ids == '' and os.path.exists(setting.jma_setting.full_path):
+        # 예전 버전의 id 파일에서 옮겨옴
+        with open(setting.jma_setting.full_path, 'r') as f:
+            ids = f.readline()
+        state.set_last_id('ids', ids)
+
+    # 한반도 영향 추정과 진앙 지역 색인을 위한 초기화 진행
+    impact.init_impact(setting)
+    geocoder.init_geocoder()
+
+    # 지진 계열 색인 불러오기
+    sequence_tracker = SequenceTracker(setting.sequence.full_path('jma'), 'jma', setting.sequence.cell_size,
+                                       setting.sequence.radius, setting.sequence.window)
+
+    # 발행 작업은 백그라운드에서 처리하고, 같은 지진의 새 발표가 들어오면 이전 작업을 중단함
+    publisher = coalescer.EventCoalescer('jma', setting.push_window)
+
+    # 메트릭과 상태 확인 서버 시작
+    # 새 지진은 SQLite 발행 대기열에 넣고 발행 작업자가 꺼내서 처리 (S3, 번역, FCM이 느리거나 실패해도 크롤링 주기는 그대로)
+    box = outbox.Outbox(setting.outbox.full_path('jma'), on_terminal=discard_publish)
+    recovered = box.recover()
+    if recovered > 0:
+        logger.info(f'이전 실행에서 끝나지 않은 발행 작업 {recovered}개를 다시 처리')
+    box.purge()
+    metrics.PUBLISH_BACKLOG.set_function(lambda: box.backlog)
+    metrics.start_server(setting.jma_setting.metrics_port, setting.health_max_age)
+
     # 푸쉬 알림을 위한 초기화 진행
     notification.notify_contents_init(setting)
     aws_s3.init_aws_s3(setting)
+    # 기상청 서버 요청 정책 (헤지 요청, 서킷 브레이커, 지연 시간 기록)
+    # 피드와 상세 XML은 같은 호스트이므로 keep-alive 연결을 나눠 씀
+    jma_session = connection_keeper.create_session()
+    jma_feed = upstream.create_endpoint(setting.upstream, 'jma_feed', jma_session)
+    jma_detail = upstream.create_endpoint(setting.upstream, 'jma_detail', jma_session)
+    if setting.warm_clients:
+        # 첫 크롤링을 기다리게 하지 않고 백그라운드에서 미리 불러옴
+        startup.warm_modules(bs4, Image, impact.np)
+
+    # 지진이 없는 동안에도 발행 경로의 연결이 끊기지 않도록 유지 (시작할 때 FCM 채널도 미리 만듦)
+    keeper = connection_keeper.ConnectionKeeper('jma', setting.keepalive_interval)
+    keeper.add('data.jma.go.jp', connection_keeper.http_probe(jma_session, i.jma_xml_url))
+    keeper.add('s3', aws_s3.probe)
+    keeper.add('fcm', notification.probe)
+    keeper.start()
+
+    # 설정 파일과 알림 내용 파일이 바뀌면 재시작 없이 다시 불러옴
+    watcher = config_watcher.ConfigWatcher(setting.reload_interval)
+    watcher.watch(setting.setting_path, GlobalSetting.load, apply_setting)
+    watcher.watch(notification.notify_contents_path, notification.load_notify_contents,
+                  notification.set_notify_contents)
+    watcher.start()
     # 크롤링 시작
     crawling_start(setting.jma_setting.sleep_time)
@@ -6,36 +6,67 @@
             Gomgom (dev@gomgom.net, https://www.gomgom.net)
 """
 import ast
+import copy
 import datetime
 import json
-import logging.handlers
 import math
 import os
 import re
 import socket
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
-from PIL import Image
-from bs4 import BeautifulSoup
-from google.cloud import translate
 from retrying import retry
 
 import aws_s3
+import coalescer
+import config_watcher
+import connection_keeper
+import custom_logging_handler
+import event_context
+import gazetteer
+import geocoder
 import informations as i
+import leader_election
+import memory
+import metrics
 import notification
-from custom_logging_handler import MailgunLogHandler
+import outbox
+import profiler
+import romanize
+import startup
+import upstream
+from sequence import SequenceTracker
 from setting_management import GlobalSetting
+from state_store import StateStore
+
+# 무거운 모듈은 처음 사용할 때 불러옴 (시작하자마자 크롤링을 시작하기 위해)
+Image = startup.lazy_import('PIL.Image')
+bs4 = startup.lazy_import('bs4')
+translate = startup.lazy_import('google.cloud.translate')
 
 # Initiate default values.
 prev_data = None
-pre_translated_data = None
+list_reachable = False  # 마지막 사이클에 지진 목록을 불러왔는지 여부 (상태 확인용)
+pre_translated_data_path = 'rules/translate.json'
+codes_path = 'rules/codes.json'
+# 미리 번역된 시/도 이름(translate.json)과 지명 사전(gazetteer.json)을 합친 trie
+place_names: gazetteer.Gazetteer = None
+
+# 제한 시간 안에 번역하지 못한 지진의 번역을 다시 발행하는 스레드 풀 (발행 작업을 막지 않기 위함)
+republish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kma_republish')
 
 EQK_TYPE_INFO = '3'
 EQK_TYPE_BREAKING_INFO = '14'
 
 code: dict
+kma_session: requests.Session
+box: outbox.Outbox
+workers: outbox.OutboxWorkers
+kma_list: upstream.Endpoint
+kma_detail: upstream.Endpoint
 
 # 로마 숫자 1-10
 rome_numeral_numbers = [u"\u2160", u"\u2161", u"\u2162", u"\u2163", u"\u2164", u"\u2165", u"\u2166", u"\u2167",
@@ -61,52 +92,127 @@ city = slice(1, -3)
 direction = slice(-3, -2)
 distance = slice(-2, -1)
 
-push_data = {'country': 'kma'}
+# 발행 단계 안의 작업 하나(이미지 다운로드, 번역, S3 저장 등)의 최대 시도 횟수
+# 모두 실패하면 발행 작업이 실패하고, 발행 대기열에서 다시 시도할 때 끝난 작업은 건너뜀
+STEP_MAX_ATTEMPTS = 5
+
+
+class KmaEventContext(event_context.EventContext):
+    """
+    한국 기상청 지진 하나의 발행 작업 컨텍스트 (번역에 사용할 단어와 번역 클라이언트 포함)
+    """
+
+    def __init__(self, uid, token=None, deadline=True):
+        """
+        :param deadline: 번역 API에 제한 시간을 둘지 여부 (다시 번역할 때는 False)
+        """
+        super().__init__(notification.COUNTRY_KMA, uid, state, setting, logger, token)
+        # 발행 도중에 규칙 파일을 다시 불러와도 이 지진은 처음 단어로 번역
+        self.place_names = place_names
+        self.client = client
+        self.parent = parent
+        self.translate_timeout = setting.kma_setting.translate_deadline if deadline else 0
+        self.translate_deadline = None  # 처음 번역 API를 호출할 때 정해지는 마감 시각
+        self.fallback_languages = set()  # 번역 API 대신 로마자 표기나 원문을 사용한 언어 (번역 API 언어 코드)
+
+    def translate_remaining(self):
+        """
+        번역 API 응답을 기다릴 수 있는 남은 시간(초). 제한 시간이 없으면 None
+        """
+        if self.translate_timeout <= 0:
+            return None
+        if self.translate_deadline is None:
+            self.translate_deadline = time.monotonic() + self.translate_timeout
+        return self.translate_deadline - time.monotonic()
 
 
-def _pre_translate(text, dest: str):
+def _pre_translate(text, dest: str, names: gazetteer.Gazetteer, context=None):
     """
     미리 번역된 지역명에서 번역본 찾아오기
 
     :param text: 지역명
     :param dest: 번역할 언어
-    :return: 미리 번역된 번역본이 있는지 여부, 번역된 언어
+    :param names: 미리 번역된 지명 사전
+    :param context: 같은 이름의 지명을 구분하기 위한 넓은 지역 이름
+    :return: 번역된 지역명 (지명 사전에 없으면 끝에 '_'를 붙여서 돌려줌)
     """
-    if isinstance(text, int):
+    if not isinstance(text, str):
         return text
 
-    if text in pre_translated_data:
-        return pre_translated_data[text][dest]
+    translated = names.translate(text, dest, context)
+    if translated is not None:
+        return translated
     else:
         return text+"_"
 
 
-def _translate_location_str(text: list, lan):
+def _fallback_word(lan):
+    """
+    번역 API 대신 사용할 단어 변환 함수 (영어는 로마자 표기, 일본어와 중국어는 한글 그대로)
+    """
+    if lan == 'en':
+        return romanize.romanize_place
+    return lambda word: word
+
+
+def probe_translate():
+    """
+    번역 클라이언트의 인증과 gRPC 채널을 미리 만들어 두기 위한 요청 (번역 요금이 들지 않음)
+    """
+    client.get().get_supported_languages(parent=parent)
+
+
+def _translate_location_str(text: list, lan, ctx: KmaEventContext, context=None):
     """
     DataTranslateFileSave 클래스에서 사용하는 도우미 함수\n
     text가 str이면 번역을 해서 리턴을 해주고\n
-    text가 str이 아니면 그대로 리턴
+    text가 str이 아니면 그대로 리턴\n
+    지명 사전에 있는 지명과 방위는 바로 번역하고 나머지만 번역 API로 번역
 
     :param text: value
     :type text: Any
     :param lan: 번역할 목적 언어
     :type lan: str
+    :param ctx: 발행 작업 컨텍스트
+    :param context: 같은 이름의 지명을 구분하기 위한 넓은 지역 이름 (ex. 경남)
     """
-    result = [_pre_translate(translated, lan) for translated in text]
+    result = [_pre_translate(translated, lan, ctx.place_names, context) for translated in text]
     temp_result = [x.rstrip('_') for x in result if isinstance(x, str) and x[-1] == '_']
+    metrics.TRANSLATE_REQUESTS.inc(len(result) - len(temp_result), source='cache')
     if len(temp_result) > 0:
-        response = client.translate_text(
-            parent=parent,
-            contents=temp_result,
-            mime_type="text/plain",  # mime types: text/plain, text/html
-            source_language_code="ko",
-            target_language_code=lan,
-        )
+        translated = None
+        remaining = ctx.translate_remaining()
+        if remaining is None or remaining > 0:
+            metrics.TRANSLATE_REQUESTS.inc(len(temp_result), source='api')
+            metrics.TRANSLATE_API_CALLS.inc()
+            # 제한 시간이 없으면 번역 클라이언트의 기본 제한 시간을 사용
+            timeout = {} if remaining is None else {'timeout': remaining}
+            try:
+                response = ctx.client.get().translate_text(
+                    parent=ctx.parent,
+                    contents=temp_result,
+                    mime_type="text/plain",  # mime types: text/plain, text/html
+                    source_language_code="ko",
+                    target_language_code=lan,
+                    **timeout
+                )
+                translated = [t.translated_text for t in response.translations]
+            except Exception as e:
+                # 제한 시간이 없으면 발행 단계에서 다시 시도
+                if remaining is None:
+                    raise
+                ctx.logger.warning(f"번역 API가 제한 시간 안에 응답하지 않음. 언어 : {lan}, {type(e).__name__}: {e}")
+
+        if translated is None:
+            # 제한 시간이 지나면 지명 사전과 로마자 표기로 바로 발행하고, 번역은 나중에 다시 발행
+            metrics.TRANSLATE_FALLBACKS.inc(len(temp_result), language=lan)
+            ctx.fallback_languages.add(lan)
+            translated = [ctx.place_names.translate(t, lan, context, _fallback_word(lan)) or t for t in temp_result]
 
         j = 0
         for idx, txt in enumerate(result):
             if isinstance(txt, str) and txt[-1] == '_':
-                result[idx] = response.translations[j].translated_text
+                result[idx] = translated[j]
                 j += 1
 
     return result
@@ -122,13 +228,14 @@ class EqkLocationKma:
     지진 위치를 저장하는 클래스
     """
 
-    def __init__(self, wide, city, direction, distance, depth):
+    def __init__(self, wide, city, direction, distance, depth, region_code):
         self.wide = wide
         self.city = city
         self.direction = direction
         self.distance = int(re.search(r'\d*', distance).group())
         self.depth = depth
         self.code = code[self.wide]
+        self.region_code = region_code  # 좌표로 찾은 시/군/구 지역 코드 (좌표가 없으면 0)
 
     def __repr__(self):
         return str(vars(self))
@@ -160,12 +267,17 @@ class EqkDataKma:
         self.datetime = datetime.strftime('%Y-%m-%d %H:%M:%S')  # 진앙시
         self.datetime_ann = datetime_ann.strftime('%Y-%m-%d %H:%M:%S')  # 발표시각
         split_str = location.split()
+        # 좌표가 있으면 가장 가까운 시/군/구의 지역 코드를 같이 저장 (JMA 데이터와 같은 코드 체계)
+        region_code = 0
+        if coord.latitude != 0.0 or coord.longitude != 0.0:
+            region_code = geocoder.reverse(coord.latitude, coord.longitude, geocoder.COUNTRY_KR).code
         self.location = EqkLocationKma(
             ' '.join(split_str[wide_or_north]),
             ' '.join(split_str[city]),
             ' '.join(split_str[direction]),
             ' '.join(split_str[distance]),
-            depth
+            depth,
+            region_code
         )
         self.coord = coord
         self.magnitude = magnitude  # 규모
@@ -175,6 +287,7 @@ class EqkDataKma:
         self.img_url = img_url  # 이미지 url
         self.region_intensity = region_intensity
         self.note = note
+        self.sequence = None  # 지진 계열 정보 {'id': 계열 id, 'mainshock': 본진 uid, 'count': 계열의 지진 수}
 
     def __eq__(self, other):
         if other is None:
@@ -206,97 +319,166 @@ class EqkBaseData:
         self.title_text = title_text
         self.tm_fc_text = tm_fc_text
 
+    @staticmethod
+    def create(item: dict):
+        """
+        기상청 지진 목록(list.do)의 항목 하나로부터 기초 데이터를 만듦
+        """
+        return EqkBaseData(item['tp'],          # 통보 종류 코드
+                           item['kind'],        # 통보 종류 한글
+                           item['tmFc'],        # 발표 시각
+                           item['tmSeq'],       # 일련번호
+                           item['data'],        # 데이터
+                           item['tpText'],      # 뭐지? 전부 비어있음
+                           item['titleText'],   # 타이틀 텍스트
+                           item['tmFcText'])    # 발표시간 텍스트
+
 
 class DataSaver:
     """
     지진 데이터를 저장하는 베이스 클래스
     """
 
-    def __init__(self, data):
+    # 발행 단계 이름 (StateStore에 완료 여부를 기록할때 사용)
+    step = None
+
+    def __init__(self, data, ctx: KmaEventContext):
         self.data = {'jijin_data': data.to_dict()}
+        self.ctx = ctx  # 발행 작업 컨텍스트
 
     def save(self):
         raise NotImplementedError("이 함수는 서브클래스에서 정의될 필요가 있습니다.")
 
+    def result(self):
+        """
+        :return: 재시작시에 다시 사용할 저장 결과
+        """
+        return None
 
-class S3ImageSaverKma(DataSaver):
-    """
-    지진 이미지를 S3에 저장하게 하는 클래스
-    """
+    def restore(self, result):
+        """
+        재시작 전에 이미 끝난 단계의 결과를 되살림
 
-    def __init__(self, data):
-        super().__init__(data)
-        self.error_count = 0
-
-    def _image_resizing(self):
-        img_sizes = [(450, 444), (550, 471)]
-        for i in range(2):
-            filename = self.data['jijin_data']['img_name'][i]
-            url = self.data['jijin_data']['img_url'][i]
-            img_size = img_sizes[i]
-            # Download earthquake image from KMA
-            with open(filename, 'wb') as f:
-                try:
-                    response = requests.get(url)
-                    response.raise_for_status()
-                except requests.exceptions.HTTPError as e:
-                    logger.warning(" 이미지 다운 로드 실패")
-                    raise
-                except Exception as e:
-                    logger.warning("이미지 다운 로드 실패")
-                    raise
-                else:
-                    total_size = int(response.headers.get('content-length')) if response.headers.get(
-                        'content-length') is not None else 1024
-                    f.write(response.content)
+        :param result: result() 함수가 돌려준 값
+        """
+        pass
 
-            # 이미지를 제대로 다운 받았는지 확인
+    def run_step(self, name, stage, func, *args, redo=False):
+        """
+        단계 안의 작업 하나를 실행하고 완료를 기록. 실패하면 그 작업만 STEP_MAX_ATTEMPTS번까지 다시 시도하고,
+        다시 발행할 때는 이미 끝난 작업을 건너뛰고 기록해둔 결과를 돌려줌
+
+        :param name: 단계 안에서 작업을 구분하는 이름 (ex. upload_0)
+        :param stage: 소요 시간을 기록할때 사용하는 작업 종류 (ex. upload)
+        :param func: 작업 함수. 돌려준 값은 다시 발행할 때 대신 사용되므로 JSON으로 변환 가능해야 함
+        :param redo: 이미 끝난 작업이라도 다시 실행할지 여부
+        :return: func가 돌려준 값
+        :raises Exception: 모든 시도가 실패한 경우 마지막 에러
+        """
+        key = f'{self.step}:{name}'
+        if not redo and self.ctx.is_step_done(key):
+            self.ctx.logger.info(f"이미 완료된 작업 건너뜀 : {key}")
+            return self.ctx.step_result(key)
+        for attempt in range(STEP_MAX_ATTEMPTS):
+            start = time.monotonic()
             try:
-                file_size = os.path.getsize(filename)
-                if file_size < total_size:  # 파일 다운로드 실패
-                    raise ImageFileDownloadFail()
-            except ImageFileDownloadFail as e:
-                logger.warning("이미지 다운로드 실패")
-                raise
+                ret = func(*args)
+            except Exception as e:
+                metrics.PUBLISH_STEP_SECONDS.observe(time.monotonic() - start, stage=stage, result='error')
+                if attempt == STEP_MAX_ATTEMPTS - 1:
+                    self.ctx.logger.warning(f"작업 실패, 최대 시도 횟수를 넘음 : {key} ({e!r})")
+                    raise
+                metrics.PUBLISH_STEP_RETRIES.inc(stage=stage)
+                self.ctx.logger.warning(f"작업 실패 : {key}. 시도 횟수 : {attempt + 1} ({e!r})")
+                time.sleep(upstream.backoff(attempt, self.ctx.setting.upstream.max_backoff))
+            else:
+                metrics.PUBLISH_STEP_SECONDS.observe(time.monotonic() - start, stage=stage, result='success')
+                self.ctx.mark_step(key, ret)
+                return ret
+
+
+class S3ImageSaverKma(DataSaver):
+    """
+    지진 이미지를 S3에 저장하게 하는 클래스
 
-            logger.info("이미지 다운로드 성공")
-            # 이미지 사이즈 변경 최적화
+    이미지마다 다운로드, 리사이징, S3 저장을 따로 기록하므로 두 번째 이미지의 저장이 실패해도 그 작업만 다시 진행함
+    """
+    step = 'image'
+    img_sizes = [(450, 444), (550, 471)]
+
+    def _download(self, idx):
+        filename = self.data['jijin_data']['img_name'][idx]
+        url = self.data['jijin_data']['img_url'][idx]
+        # Download earthquake image from KMA
+        with open(filename, 'wb') as f:
             try:
-                logger.info("이미지 리사이징")
-                img = Image.open(filename)
-                img_resize = img.resize(img_size, Image.ANTIALIAS)
-                img_resize.save(filename, optimize=True)
+                response = kma_session.get(url, timeout=self.ctx.setting.upstream.timeout)
+                metrics.UPSTREAM_RESPONSES.inc(upstream='kma_image', status=response.status_code)
+                response.raise_for_status()
             except Exception as e:
-                logger.warning("이미지 리사이징 실패")
+                self.ctx.logger.warning("이미지 다운 로드 실패")
                 raise
-            logger.info("이미지 리사이징 성공")
+            else:
+                total_size = int(response.headers.get('content-length')) if response.headers.get(
+                    'content-length') is not None else 1024
+                f.write(response.content)
+
+        # 이미지를 제대로 다운 받았는지 확인
+        file_size = os.path.getsize(filename)
+        if file_size < total_size:  # 파일 다운로드 실패
+            self.ctx.logger.warning("이미지 다운로드 실패")
+            raise ImageFileDownloadFail()
+        self.ctx.logger.info("이미지 다운로드 성공")
+
+    def _resize(self, idx):
+        filename = self.data['jijin_data']['img_name'][idx]
+        # 이미지 사이즈 변경 최적화
+        try:
+            self.ctx.logger.info("이미지 리사이징")
+            with Image.open(filename) as img:
+                img_resize = img.resize(self.img_sizes[idx], Image.ANTIALIAS)
+            img_resize.save(filename, optimize=True)
+            img_resize.close()
+        except Exception as e:
+            self.ctx.logger.warning("이미지 리사이징 실패")
+            raise
+        self.ctx.logger.info("이미지 리사이징 성공")
 
-    @retry(wait_fixed=1000)
-    def save(self):
-        logger.info("지진 이미지 저장 시작")
+    def _upload(self, idx):
+        filename = self.data['jijin_data']['img_name'][idx]
+        # S3에 저장
+        with open(filename, 'rb') as file:
+            aws_s3.save_s3(file, aws_s3.IMAGE_PATH.format(filename), aws_s3.IMAGE_PNG_CONTENT)
+        self.ctx.logger.info("이미지 S3에 저장 성공")
 
-        self._image_resizing()
+    def save(self):
+        self.ctx.logger.info("지진 이미지 저장 시작")
 
         for idx in range(2):
+            if self.ctx.is_step_done(f'{self.step}:upload_{idx}'):
+                continue
             filename = self.data['jijin_data']['img_name'][idx]
-            # S3에 저장
-            try:
-                with open(filename, 'rb') as file:
-                    aws_s3.save_s3(file, aws_s3.IMAGE_PATH.format(filename), aws_s3.IMAGE_PNG_CONTENT)
-            except Exception as e:
-                self.error_count += 1
-                logger.exception(f"이미지 S3에 저장 실패. {self.error_count}")
-                raise
-            else:
-                logger.info("이미지 S3에 저장 성공")
+            # 재시작 전에 받아둔 파일이 없으면 다운로드부터 다시 진행
+            redo = not os.path.exists(filename)
+            self.run_step(f'download_{idx}', 'download', self._download, idx, redo=redo)
+            self.run_step(f'resize_{idx}', 'resize', self._resize, idx, redo=redo)
+            self.run_step(f'upload_{idx}', 'upload', self._upload, idx)
 
             # Delete file from server.
-            os.remove(filename)
+            if os.path.exists(filename):
+                os.remove(filename)
 
 
 class DataTranslateFileSaver(DataSaver):
-    def __init__(self, data: EqkDataKma, language: str):
-        super().__init__(data)
+    """
+    지진 데이터를 번역해서 S3에 저장하는 클래스
+
+    번역 결과를 기록해두므로 S3 저장이 실패해도 번역 API를 다시 호출하지 않음
+    """
+
+    def __init__(self, data: EqkDataKma, ctx: KmaEventContext, language: str,
+                 publication: aws_s3.Publication = None):
+        super().__init__(data, ctx)
         if language not in ['ko', 'en', 'ja', 'zh_Hans', 'zh_Hant']:
             raise Exception("번역할수 없는 언어입니다.")
         if language in ['ko', 'en', 'ja']:
@@ -306,45 +488,71 @@ class DataTranslateFileSaver(DataSaver):
         elif language == 'zh_Hant':
             self.language = 'zh-tw'
         self.ori_language = language
+        self.step = f'translate_{language}'
         self.file_name = f'data_kma_{language}.json'
-        self.error_count = 0
+        self.publication = publication  # 버전 키와 예전 경로에 저장할 발행 (None이면 예전 경로에 바로 저장)
+        self.translated = None  # 번역된 지진 데이터
+        self.fallback = False  # 번역 API 대신 로마자 표기나 원문을 사용했는지 여부
+
+    def result(self):
+        return {'jijin_data': self.translated, 'fallback': self.fallback}
+
+    def restore(self, result):
+        self.translated = result['jijin_data']
+        self.fallback = result['fallback']
+        self.ctx.push_data[self.ori_language] = self.translated
+        if self.fallback:
+            self.ctx.fallback_languages.add(self.language)
+        if self.publication is not None:
+            self.publication.record(self.file_name)
+            self.publication.put_legacy(self.file_name, json.dumps({'jijin_data': self.translated}))
 
     def _translate_data(self):
         """
-        데이터를 번역
+        데이터를 번역. 원본 데이터는 바꾸지 않음
+
+        :return: {'jijin_data': 번역된 지진 데이터, 'fallback': 번역 API 대신 로마자 표기나 원문을 사용했는지 여부}
         """
-        logger.info(f"데이터 번역시작. 언어 : {self.language}")
+        self.ctx.logger.info(f"데이터 번역시작. 언어 : {self.language}")
+        jijin_data = copy.deepcopy(self.data['jijin_data'])
         if self.language != 'ko':
             # 지진 발생지역을 각 언어로 번역
-            self.data['jijin_data']['location'] = {k: v for k, v in zip(self.data['jijin_data']['location'].keys(), _translate_location_str(self.data['jijin_data']['location'].values(), self.language))}
+            jijin_data['location'] = {k: v for k, v in zip(jijin_data['location'].keys(), _translate_location_str(jijin_data['location'].values(), self.language, self.ctx, jijin_data['location'].get('wide')))}
 
             # 각 시/도 명을 번역
-            self.data['jijin_data']['region_intensity'] = {k: v for k, v in zip(_translate_location_str(self.data['jijin_data']['region_intensity'].keys(), self.language), self.data['jijin_data']['region_intensity'].values())}
+            jijin_data['region_intensity'] = {k: v for k, v in zip(_translate_location_str(jijin_data['region_intensity'].keys(), self.language, self.ctx), jijin_data['region_intensity'].values())}
 
             # 참고 사항
-            self.data['jijin_data']['note'] = _translate_location_str([self.data['jijin_data']['note']], self.language)[0]
+            jijin_data['note'] = _translate_location_str([jijin_data['note']], self.language, self.ctx)[0]
 
             # 중국어인 경우 방향에서 '方'자를 지움
             if self.language.find('zh') != -1:
-                self.data['jijin_data']['location']['direction'] = self.data['jijin_data']['location'][
-                    'direction'].replace('方', '')
+                jijin_data['location']['direction'] = jijin_data['location']['direction'].replace('方', '')
+
+        self.ctx.logger.info(f"데이터 번역종료. 언어 : {self.language}")
+        return {'jijin_data': jijin_data, 'fallback': self.language in self.ctx.fallback_languages}
 
-        push_data[self.ori_language] = self.data['jijin_data']
-        logger.info(f"데이터 번역종료. 언어 : {self.language}")
+    def _upload(self, body):
+        aws_s3.save_s3(body, aws_s3.JSON_PATH.format(self.file_name), aws_s3.JSON_CONTENT)
 
-    @retry(wait_fixed=1000)
     def save(self):
-        self._translate_data()
+        translated = self.run_step('translate', 'translate', self._translate_data)
+        self.translated = translated['jijin_data']
+        self.fallback = translated['fallback']
+        if self.fallback:
+            self.ctx.fallback_languages.add(self.language)
+        self.ctx.push_data[self.ori_language] = self.translated
         # S3에 저장
-        logger.info("번역된 데이터 S3에 저장 시작")
-        try:
-            aws_s3.save_s3(json.dumps(self.data), aws_s3.JSON_PATH.format(self.file_name), aws_s3.JSON_CONTENT)
-        except Exception as e:
-            self.error_count += 1
-            logger.warning(f"S3에 파일 저장 실패. 파일 이름 : {self.file_name}. 시도 횟수 : {self.error_count}")
-            raise e
+        self.ctx.logger.info("번역된 데이터 S3에 저장 시작")
+        body = json.dumps({'jijin_data': self.translated})
+        if self.publication is None:
+            self.run_step('upload', 'upload', self._upload, body)
         else:
-            logger.info("번역된 데이터 S3에 저장 성공")
+            self.run_step('upload_versioned', 'upload', self.publication.put, self.file_name, body)
+            self.publication.record(self.file_name)
+            # 예전 경로의 파일은 manifest와 같이 갱신 (늦게 끝난 이전 지진이 최신 지진을 덮어쓰지 않도록)
+            self.publication.put_legacy(self.file_name, body)
+        self.ctx.logger.info("번역된 데이터 S3에 저장 성공")
 
 
 class DataSaverListSaver(DataSaver):
@@ -352,8 +560,8 @@ class DataSaverListSaver(DataSaver):
     지진 데이터를 저장하는 Saver클래스의 리스트를 받아 그 클래스의 save 함수를 호출해주는 클래스
     """
 
-    def __init__(self, data, *savers):
-        super().__init__(data)
+    def __init__(self, data, ctx: KmaEventContext, *savers):
+        super().__init__(data, ctx)
         check = True
         for s in savers:
             check &= issubclass(type(s), DataSaver)
@@ -363,7 +571,15 @@ class DataSaverListSaver(DataSaver):
 
     def save(self):
         for s in self.savers:
+            self.ctx.check()
+            # 재시작 전에 이미 끝난 단계는 건너뜀
+            if s.step is not None and self.ctx.is_step_done(s.step):
+                self.ctx.logger.info(f"이미 완료된 단계 건너뜀 : {s.step}")
+                s.restore(self.ctx.step_result(s.step))
+                continue
             s.save()
+            if s.step is not None:
+                self.ctx.mark_step(s.step, s.result())
 
 
 @retry(wait_fixed=1000)
@@ -375,29 +591,42 @@ def create_base_data():
     """
     logger.info("기초 데이터 불러오기 시작")
     global prev_data
+    global list_reachable
     error_count = 0
     while True:
         try:
-            response = requests.get(url=i.kma_list_url, timeout=10)
+            response = kma_list.get(i.kma_list_url, headers=state.get_validators(i.kma_list_url))
             response.encoding = 'utf8'
             response.raise_for_status()
+        # 연속된 실패로 요청을 막고 있으면 이번 사이클은 건너뛰고 다음 사이클에 다시 시도
+        # (막기 시작할 때 upstream에서 경고를 남기므로 사이클마다 경고하지 않음)
+        except upstream.CircuitOpen as e:
+            logger.info(str(e))
+            list_reachable = False
+            return False, None
         # 기상청에서 시간안에 응답이 없으면
-        except (requests.exceptions.Timeout, socket.timeout) as e:
-            time.sleep(min(120, 2 ** error_count))
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, socket.timeout) as e:
+            time.sleep(upstream.backoff(error_count, setting.upstream.max_backoff))
             error_count += 1
             if error_count > 2:
-                logger.warning(f'상세데이터 파싱 중 알수 없는 이유로 파싱 실패. 시도횟수 : {error_count}')
+                logger.warning(f'기초 데이터 불러오기 실패. 시도횟수 : {error_count}')
             continue
         except requests.exceptions.HTTPError as e:
             logger.exception("기초 데이터 불러오기 실패, 프로그램 종료됨")
             exit(1)
         else:
+            list_reachable = True
+            # 목록이 바뀌지 않았으면 다시 파싱할 필요 없음
+            if response.status_code == 304:
+                logger.info("새로운 지진 데이터 없음")
+                return False, None
             try:
                 data = response.json()
             except ValueError:
                 logger.exception("기초 데이터를 불러왔으나 JSON 형식이 아님, 프로그램 종료됨")
                 exit(1)
             else:
+                state.set_validators(i.kma_list_url, response.headers)
                 if len(data) == 0:
                     return False, None
                 filter_data = [d for d in data if d['tp'] == EQK_TYPE_INFO or d['tp'] == EQK_TYPE_BREAKING_INFO]
@@ -407,14 +636,7 @@ def create_base_data():
                 logger.info(f"이전 Data : {prev_data}, 최근 Data : {data['data']}")
                 if data['data'] != prev_data:
                     prev_data = data['data']
-                    ret = EqkBaseData(data['tp'],         # 통보 종류 코드
-                                      data['kind'],       # 통보 종류 한글
-                                      data['tmFc'],       # 발표 시각
-                                      data['tmSeq'],      # 일련번호
-                                      data['data'],       # 데이터
-                                      data['tpText'],     # 뭐지? 전부 비어있음
-                                      data['titleText'],  # 타이틀 텍스트
-                                      data['tmFcText'])   # 발표시간 텍스트
+                    ret = EqkBaseData.create(data)
                     logger.info("기초 데이터 불러오기 성공")
                     return True, ret
                 else:
@@ -426,28 +648,44 @@ def create_data():
     """
     기상청 상세 정보 페이지로부터 실제 사용할 데이터를 뽑는 함수
     
-    :retrun: 새로운 정보를 불러오기 성공여부(True, False), 새로운 정보 데이터 클래스(없으면 None)
-    :rtype: (bool, EqkKmaData)
+    :retrun: 새로운 정보를 불러오기 성공여부(True, False), 새로운 정보 데이터 클래스(없으면 None), 기초 데이터
+    :rtype: (bool, EqkKmaData, EqkBaseData)
     """
-    success, base_data = create_base_data()
+    with metrics.POLL_SECONDS.time(stage='create_base_data'):
+        success, base_data = create_base_data()
 
     if not success:
         logger.info("데이터 생성 실패")
-        return False, None
+        return False, None, None
+
+    return True, create_detail_data(base_data), base_data
+
+
+def create_detail_data(base_data: EqkBaseData):
+    """
+    기초 데이터를 가지고 상세 정보 페이지를 불러와 파싱하는 함수
 
+    :param base_data: 기초 데이터
+    :return: 새로운 정보 데이터 클래스
+    :rtype: EqkDataKma
+    """
     error_count = 0
 
     while True:
         try:
             detail_url_param = {'eqk': base_data.data}
-            response = requests.get(i.kma_detail_url, params=detail_url_param, timeout=10)
+            response = kma_detail.get(i.kma_detail_url, params=detail_url_param)
             response.encoding = 'utf8'
             response.raise_for_status()
-        except (requests.exceptions.Timeout, socket.timeout) as e:
-            time.sleep(min(120, 2 ** error_count))
+        except (upstream.CircuitOpen, requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                socket.timeout) as e:
+            # 서킷 브레이커가 열려 있어도 기초 데이터는 이미 바뀌었으므로 상세 데이터는 받을때까지 기다림
+            time.sleep(upstream.backoff(error_count, setting.upstream.max_backoff))
             error_count += 1
-            if error_count > 2:
-                logger.warning(f'상세데이터 파싱 중 알수 없는 이유로 파싱 실패. 시도횟수 : {error_count}')
+            if isinstance(e, upstream.CircuitOpen):
+                logger.info(f'상세 데이터 요청을 막고 있어서 기다림. 시도횟수 : {error_count}')
+            elif error_count > 2:
+                logger.warning(f'상세 데이터 불러오기 실패. 시도횟수 : {error_count} ({e})')
             continue
         except requests.exceptions.HTTPError as e:
             logger.exception("HTTP에러로 상세 데이터 불러오기 실패. 프로그램 종료")
@@ -456,146 +694,379 @@ def create_data():
             logger.exception("알수 없는 이유로 상세 데이터 불러오기 실패, 프로그램 종료")
             exit(1)
         else:
-            logger.info("상세 데이터 파싱 시작")
             try:
-                # 지진 발표 시각
-                kma_datetime_ann = datetime.datetime.strptime(base_data.tm_fc, '%Y%m%d%H%M')
-                bs_detail_page = BeautifulSoup(response.text, 'html.parser')
-
-                # 시도별 진도 데이터를 뽑아옴
-                table = bs_detail_page.select_one('table.table-col.eqk-city-ins-table > tbody')
-                city_max_int = {r.th.text: rome_numeral_numbers.index(r.td.img['alt'])+1 for r in table.find_all('tr')}
-
-                # 지진 정보 테이블
-                table = bs_detail_page.select_one('div.over-scroll.cont-box-eqk > table > tbody')
-                regex = re.compile(r'[\r\t]|\xa0')
-                eqk_info = {regex.sub('', r.th.text.strip()): regex.sub('', r.td.text.strip())
-                            for r in table.find_all('tr')}
-
-                # 테이블 키 종류(?) 뭐라 해야되지
-                search_datetime = ''
-                search_magnitude = ''
-                search_max_int = ''
-                search_location_coord = ''
-                search_remain = ''
-                depth = 0
-
-                # 지진 정보
-                if base_data.tp == EQK_TYPE_INFO:
-                    search_datetime = eqk_datetime
-                    search_magnitude = eqk_magnitude
-                    search_max_int = eqk_max_int
-                    search_location_coord = eqk_location_coord
-                    search_remain = eqk_remain
-                    try:
-                        depth = int(re.match(r'\d+\.?\d*', table.find('td', text=re.compile(r'\d+\.?\d* km$')).text).group())
-                    except (ValueError, AttributeError):
-                        depth = 0
-
-                # 지진 속보
-                elif base_data.tp == EQK_TYPE_BREAKING_INFO:
-                    search_datetime = eqk_breaking_datetime
-                    search_magnitude = eqk_breaking_magnitude
-                    search_max_int = eqk_breaking_max_int
-                    search_location_coord = eqk_breaking_location_coord
-                    search_remain = eqk_breaking_remain
-                    depth = 0
-
-                # 지진 발생 시각
-                kma_datetime = datetime.datetime.strptime(eqk_info[search_datetime], '%Y년 %m월 %d일 %H시 %M분 %S초')
-
-                # 지진 최대 진도
-                pattern = u'[{}]'.format(''.join(rome_numeral_numbers))
-                regex = re.compile(pattern, re.UNICODE)
-                kma_max_int = rome_numeral_numbers.index(regex.search(eqk_info[search_max_int]).group()) + 1
-
-                # 고유번호 (진앙시 + 발표일련번호) ex) 201001010008
-                uid = kma_datetime.strftime('%Y%m%d') + base_data.tm_seq.rjust(4, '0')
-                regex = re.compile(r'\d*\.\d*')
-                result = regex.findall(eqk_info[search_location_coord])
-
-                # 지진 규모
-                try:
-                    kma_magnitude = float(re.findall(r'\d*\.\d*', eqk_info[search_magnitude])[0])
-                except (ValueError, Exception):
-                    kma_magnitude = 0
-
-                # 위도/경도
-                try:
-                    latitude = float(result[0])
-                    longitude = float(result[1])
-                except (ValueError, Exception):
-                    latitude = 0.0
-                    longitude = 0.0
-
-                # 지진 발생 위치
-                regex = re.compile(r'[가-힝\d\w\s]*(?!\()')
-                eqk_location = regex.search(eqk_info[search_location_coord]).group().strip()
-
-                # 지진 발생 위치 이미지 url
-                img_url = [i.kma_base_url + url['src'].split(';')[0]
-                           for url in bs_detail_page.find_all('img', {'src': re.compile(r'\.*repositary\.*')})]
-                img_name = [url.split('/')[-1] for url in img_url]
-                coord = EqkCoordKma(longitude, latitude)
-
-                # 지진 참고 사항
-                note = eqk_info[search_remain]
-                logger.info("상세 데이터 파싱 성공")
-                return True, EqkDataKma(uid,
-                                        kma_datetime,
-                                        kma_datetime_ann,
-                                        eqk_location,
-                                        coord,
-                                        kma_magnitude,
-                                        kma_max_int,
-                                        img_name,
-                                        base_data.tp,
-                                        img_url,
-                                        city_max_int,
-                                        note,
-                                        depth)
+                return parse_detail_page(response.text, base_data)
             except Exception:
-                time.sleep(min(120, 2 ** error_count))
+                time.sleep(upstream.backoff(error_count, setting.upstream.max_backoff))
                 if error_count > 2:
                     logger.warning(f'상세데이터 파싱 중 알수 없는 이유로 파싱 실패. 시도횟수 : {error_count}')
                 error_count += 1
                 continue
 
 
-def success_crawling_kma(data: EqkDataKma):
+def parse_detail_page(html: str, base_data: EqkBaseData):
+    """
+    상세 정보 페이지를 파싱해서 지진 데이터를 만드는 함수 (이력 백필에서도 사용)
+
+    :param html: 상세 정보 페이지
+    :param base_data: 기초 데이터
+    :return: 새로운 정보 데이터 클래스
+    :rtype: EqkDataKma
+    :raises Exception: 페이지 형식이 예상과 다른 경우
+    """
+    logger.info("상세 데이터 파싱 시작")
+    bs_detail_page = None
+    try:
+        # 지진 발표 시각
+        kma_datetime_ann = datetime.datetime.strptime(base_data.tm_fc, '%Y%m%d%H%M')
+        bs_detail_page = bs4.BeautifulSoup(html, 'html.parser')
+
+        # 시도별 진도 데이터를 뽑아옴
+        table = bs_detail_page.select_one('table.table-col.eqk-city-ins-table > tbody')
+        city_max_int = {r.th.text: rome_numeral_numbers.index(r.td.img['alt'])+1 for r in table.find_all('tr')}
+
+        # 지진 정보 테이블
+        table = bs_detail_page.select_one('div.over-scroll.cont-box-eqk > table > tbody')
+        regex = re.compile(r'[\r\t]|\xa0')
+        eqk_info = {regex.sub('', r.th.text.strip()): regex.sub('', r.td.text.strip())
+                    for r in table.find_all('tr')}
+
+        # 테이블 키 종류(?) 뭐라 해야되지
+        search_datetime = ''
+        search_magnitude = ''
+        search_max_int = ''
+        search_location_coord = ''
+        search_remain = ''
+        depth = 0
+
+        # 지진 정보
+        if base_data.tp == EQK_TYPE_INFO:
+            search_datetime = eqk_datetime
+            search_magnitude = eqk_magnitude
+            search_max_int = eqk_max_int
+            search_location_coord = eqk_location_coord
+            search_remain = eqk_remain
+            try:
+                depth = int(re.match(r'\d+\.?\d*', table.find('td', text=re.compile(r'\d+\.?\d* km$')).text).group())
+            except (ValueError, AttributeError):
+                depth = 0
+
+        # 지진 속보
+        elif base_data.tp == EQK_TYPE_BREAKING_INFO:
+            search_datetime = eqk_breaking_datetime
+            search_magnitude = eqk_breaking_magnitude
+            search_max_int = eqk_breaking_max_int
+            search_location_coord = eqk_breaking_location_coord
+            search_remain = eqk_breaking_remain
+            depth = 0
+
+        # 지진 발생 시각
+        kma_datetime = datetime.datetime.strptime(eqk_info[search_datetime], '%Y년 %m월 %d일 %H시 %M분 %S초')
+
+        # 지진 최대 진도
+        pattern = u'[{}]'.format(''.join(rome_numeral_numbers))
+        regex = re.compile(pattern, re.UNICODE)
+        kma_max_int = rome_numeral_numbers.index(regex.search(eqk_info[search_max_int]).group()) + 1
+
+        # 고유번호 (진앙시 + 발표일련번호) ex) 201001010008
+        uid = kma_datetime.strftime('%Y%m%d') + base_data.tm_seq.rjust(4, '0')
+        regex = re.compile(r'\d*\.\d*')
+        result = regex.findall(eqk_info[search_location_coord])
+
+        # 지진 규모
+        try:
+            kma_magnitude = float(re.findall(r'\d*\.\d*', eqk_info[search_magnitude])[0])
+        except (ValueError, Exception):
+            kma_magnitude = 0
+
+        # 위도/경도
+        try:
+            latitude = float(result[0])
+            longitude = float(result[1])
+        except (ValueError, Exception):
+            latitude = 0.0
+            longitude = 0.0
+
+        # 지진 발생 위치
+        regex = re.compile(r'[가-힝\d\w\s]*(?!\()')
+        eqk_location = regex.search(eqk_info[search_location_coord]).group().strip()
+
+        # 지진 발생 위치 이미지 url
+        img_url = [i.kma_base_url + url['src'].split(';')[0]
+                   for url in bs_detail_page.find_all('img', {'src': re.compile(r'\.*repositary\.*')})]
+        img_name = [url.split('/')[-1] for url in img_url]
+        coord = EqkCoordKma(longitude, latitude)
+
+        # 지진 참고 사항
+        note = eqk_info[search_remain]
+        logger.info("상세 데이터 파싱 성공")
+        return EqkDataKma(uid,
+                          kma_datetime,
+                          kma_datetime_ann,
+                          eqk_location,
+                          coord,
+                          kma_magnitude,
+                          kma_max_int,
+                          img_name,
+                          base_data.tp,
+                          img_url,
+                          city_max_int,
+                          note,
+                          depth)
+    finally:
+        # 파싱 결과는 문자열로 뽑아냈으므로 트리는 바로 해제
+        memory.release(bs_detail_page)
+
+
+def tag_sequence(data: EqkDataKma):
+    """
+    지진 이력에서 같은 계열(본진, 여진)을 찾아서 계열 정보를 붙임
+
+    :param data: 한국 기상청으로부터의 지진 정보
+    """
+    if data.coord.latitude == 0.0 and data.coord.longitude == 0.0:
+        return
+    data.sequence = sequence_tracker.add(data.uid, data.datetime, data.coord.latitude, data.coord.longitude,
+                                         data.magnitude)
+    logger.info(f"지진 계열 정보 : {data.sequence}")
+
+
+def event_key(data: EqkDataKma):
+    """
+    속보와 정보처럼 같은 지진에 대한 발표를 구분하는 값 (발생 시각 분 단위)
+    """
+    return f'{notification.COUNTRY_KMA}:{data.datetime[:16]}'
+
+
+def success_crawling_kma(token: coalescer.PublishToken, data: EqkDataKma, base_data: EqkBaseData):
     """
     한국 기상청으로부터 크롤링해온 데이터를 처리하는 함수
 
+    :param token: 발행 작업 토큰 (같은 지진의 새 발표가 들어오면 단계 사이에서 중단됨)
     :param data: 한국 기상청으로부터의 지진 정보
+    :param base_data: 지진 정보를 만든 기초 데이터
     :return:
     """
 
-    logger.info("새로운 데이터 저장 시작")
-    logger.info("새로운 데이터의 uid 파일에 저장")
-    # 새 데이터의 uid를 파일에 저장
-    with open(setting.kma_setting.full_path, 'w') as f:
-        f.write(data.uid)
-    logger.info("새로운 데이터 S3에 저장")
-    # S3에 번역된 데이터와 이미지를 저장
-    saver = DataSaverListSaver(data, S3ImageSaverKma(data),
-                               DataTranslateFileSaver(data, 'ko'),
-                               DataTranslateFileSaver(data, 'en'),
-                               DataTranslateFileSaver(data, 'ja'),
-                               DataTranslateFileSaver(data, 'zh_Hans'),
-                               DataTranslateFileSaver(data, 'zh_Hant')
+    # 알림 데이터와 설정, 번역 단어는 이 지진의 컨텍스트에만 담기므로 여러 지진을 동시에 처리할 수 있음
+    ctx = KmaEventContext(data.uid, token)
+    ctx.logger.info("새로운 데이터 저장 시작")
+    tag_sequence(data)
+    ctx.logger.info("새로운 데이터의 발행 시작 상태 저장")
+    # 도중에 프로그램이 죽으면 재시작시 발행 대기열에서 다시 꺼내서 끝난 단계는 건너뛰고 이어서 진행
+    ctx.begin()
+    ctx.logger.info("새로운 데이터 S3에 저장")
+    # S3에 번역된 데이터와 이미지를 저장 (번역된 데이터는 uid로 만든 버전 키에도 압축해서 저장)
+    publication = aws_s3.Publication(notification.COUNTRY_KMA, data.uid, data.datetime_ann)
+    saver = DataSaverListSaver(data, ctx, S3ImageSaverKma(data, ctx),
+                               DataTranslateFileSaver(data, ctx, 'ko', publication),
+                               DataTranslateFileSaver(data, ctx, 'en', publication),
+                               DataTranslateFileSaver(data, ctx, 'ja', publication),
+                               DataTranslateFileSaver(data, ctx, 'zh_Hans', publication),
+                               DataTranslateFileSaver(data, ctx, 'zh_Hant', publication)
                                )
-    saver.save()
-    logger.info("새로운 데이터 S3에 저장 종료")
-    logger.info("새로운 데이터 알림 보내기 시작")
-    # 푸쉬 알림 보내기
-    notification.push_notify(push_data)
-    logger.info("새로운 데이터 알림 보내기 종료")
+    with custom_logging_handler.log_stage(ctx.logger, 'save', data.uid):
+        saver.save()
+        # 모든 언어를 하나로 묶은 파일을 저장하고 마지막으로 manifest 갱신
+        publication.put_bundle({k: v for k, v in ctx.push_data.items() if k in notification.support_language})
+        if not publication.commit():
+            ctx.logger.info("더 최근에 발표된 지진이 이미 발행되어 manifest와 예전 경로의 파일은 갱신하지 않음")
+    ctx.logger.info("새로운 데이터 S3에 저장 종료")
+    ctx.logger.info("새로운 데이터 알림 보내기 시작")
+    # 푸쉬 알림 보내기 (같은 지진의 알림은 모아서 보냄)
+    ctx.check()
+    if not ctx.is_step_done('notify'):
+        with custom_logging_handler.log_stage(ctx.logger, 'notify', data.uid):
+            token.push(notification.push_notify, copy.deepcopy(ctx.push_data))
+        ctx.mark_step('notify')
+    ctx.logger.info("새로운 데이터 알림 보내기 종료")
+    # 새 데이터의 uid와 기초 데이터를 원자적으로 저장
+    ctx.finish(prev_data=base_data.data, uid=data.uid)
+    # 발행 작업이 끝난 뒤에도 같은 지진의 새 발표를 알 수 있도록 토큰을 유지
+    if len(ctx.fallback_languages) > 0 and publisher.retain(token):
+        ctx.logger.info(f"제한 시간 안에 번역하지 못한 언어를 다시 번역해서 발행 예정 : {sorted(ctx.fallback_languages)}")
+        republish_executor.submit(republish_translation, token, data, copy.deepcopy(ctx.push_data),
+                                  set(ctx.fallback_languages))
+
+
+def republish_translation(token: coalescer.PublishToken, data: EqkDataKma, push_data: dict, languages: set):
+    """
+    제한 시간 없이 다시 번역해서 S3의 데이터와 manifest를 갱신 (알림은 다시 보내지 않음)
+
+    :param token: 처음 발행 작업의 토큰 (같은 지진의 새 발표가 들어오면 다시 발행하지 않음, retain으로 유지한 토큰)
+    :param data: 한국 기상청으로부터의 지진 정보
+    :param push_data: 처음 발행한 언어별 지진 데이터
+    :param languages: 다시 번역할 언어 (번역 API 언어 코드)
+    """
+    # 발행 단계를 기록하지 않도록 처음 발행과 다른 id를 사용하고, 버전 키는 바뀌지 않으므로 새 버전으로 저장
+    # 그 사이에 다른 지진이 발행되었으면 처음 발행과 같은 발표 시각으로 비교해서 commit에서 걸러짐
+    uid = f'{data.uid}-retranslated'
+    ctx = KmaEventContext(uid, deadline=False)
+    ctx.push_data = push_data
+    publication = aws_s3.Publication(notification.COUNTRY_KMA, uid, data.datetime_ann)
+    try:
+        for language in ['en', 'ja', 'zh_Hans', 'zh_Hant']:
+            saver = DataTranslateFileSaver(data, ctx, language, publication)
+            if saver.language not in languages:
+                continue
+            if token.is_stale:
+                ctx.logger.info("같은 지진의 새로운 발표가 있어서 번역을 다시 발행하지 않음")
+                return
+            saver.save()
+        publication.put_bundle({k: v for k, v in ctx.push_data.items() if k in notification.support_language})
+        if token.is_stale:
+            ctx.logger.info("같은 지진의 새로운 발표가 있어서 번역을 다시 발행하지 않음")
+            return
+        if not publication.commit():
+            ctx.logger.info("더 최근에 발표된 지진이 이미 발행되어 번역을 다시 발행하지 않음")
+            return
+        ctx.logger.info(f"다시 번역한 데이터 발행 완료 : {sorted(languages)}")
+    except Exception:
+        ctx.logger.exception("다시 번역한 데이터 발행 실패")
+    finally:
+        publisher.end(token)
+
+
+def publish_key(uid):
+    """
+    발행 대기열에서 같은 발표를 구분하는 값 (idempotency key)
+    """
+    return f'{notification.COUNTRY_KMA}:{uid}'
+
+
+def enqueue_publish(data: EqkDataKma, base_data: EqkBaseData):
+    """
+    새 지진을 발행 대기열에 넣음 (같은 발표는 한 번만 들어감)
+    """
+    box.append(publish_key(data.uid), event_key(data), data, base_data)
+    workers.notify()
+
+
+def discard_publish(idempotency_key):
+    """
+    발행 대기열에서 끝난 작업(완료, 교체, 포기)의 발행 단계 기록을 지움
+    (남겨두면 재시작하거나 리더를 넘겨받을 때마다 다시 확인해야 하고 상태 파일이 계속 커짐)
+    """
+    state.discard_publish(idempotency_key.split(':', 1)[1])
+
+
+def hold_publish(data: EqkDataKma, base_data: EqkBaseData):
+    """
+    대기 인스턴스에서 발행하지 않은 지진을 발행 대기 상태로 기록 (리더를 넘겨받으면 resume_publish에서 발행)
+    """
+    state.hold_publish(data.uid, outbox.dumps(data, base_data), prev_data=base_data.data, uid=data.uid)
+
+
+def prune_held(leader_alive_until):
+    """
+    대기 인스턴스일 때 기록한 지진 중에 살아있던 리더가 이미 불러왔을 지진의 기록을 지움
+    (리더가 살아있던 시각보다 폴링 주기 이상 먼저 불러온 지진은 리더도 불러와서 발행 대기열에 넣었다고 봄)
+
+    :param leader_alive_until: 다른 인스턴스가 리더로 살아있던 것이 확실한 마지막 시각 (없으면 None)
+    """
+    cutoff = None if leader_alive_until is None else leader_alive_until - setting.kma_setting.sleep_time
+    for publish in state.pending_publishes():
+        held = publish['extra'].get('held')
+        if held is None:
+            continue
+        status = box.status(publish_key(publish['uid']))
+        if status in (outbox.PENDING, outbox.RUNNING):
+            continue
+        # 발행 대기열에서 이미 끝났거나 리더가 살아있을 때 불러온 지진
+        if status is not None or (cutoff is not None and held < cutoff):
+            state.discard_publish(publish['uid'])
+
+
+def resume_publish():
+    """
+    처음 시작했거나 리더를 넘겨받았을 때 발행 단계 기록을 발행 대기열과 맞춤
+
+    대기 인스턴스일 때 기록만 해둔 지진은 발행 대기열에 넣고 (이전 리더가 이미 넣었으면 idempotency key로 걸러짐),
+    진행중이던 작업은 발행 대기열에 저장된 지진 데이터로 다시 처리하므로(Outbox.recover) 상세 페이지를 다시 불러오지 않고,
+    발행 대기열에서 이미 끝났거나 지워진 작업의 기록은 지움
+
+    :return: 이어서 진행할 작업이 있는지 여부
+    """
+    resumed = False
+    for publish in state.pending_publishes():
+        status = box.status(publish_key(publish['uid']))
+        if status in (outbox.PENDING, outbox.RUNNING):
+            logger.info(f"끝나지 않은 발행 작업 이어서 진행 : {publish['uid']}")
+            resumed = True
+        elif status is None and 'event' in publish['extra']:
+            # 리더가 발행하기 전에 죽어서 대기 인스턴스일 때 기록만 해둔 지진
+            logger.info(f"대기 인스턴스일 때 기록한 지진 발행 : {publish['uid']}")
+            enqueue_publish(*outbox.loads(publish['extra']['event']))
+            resumed = True
+        else:
+            logger.info(f"발행 대기열에 없는 발행 작업 기록 삭제 : {publish['uid']}")
+            state.discard_publish(publish['uid'])
+    if resumed:
+        workers.notify()
+    return resumed
+
+
+def load_place_names(path=None):
+    """
+    미리 번역된 단어 파일과 지명 사전을 읽고 검증해서 trie를 만듦 (둘 중 하나가 바뀌어도 둘 다 다시 읽음)
+
+    :param path: 바뀐 파일 경로 (사용하지 않음)
+    :raises InvalidConfig: 번역할 언어 중에 빠진 번역이 있는 경우
+    """
+    return gazetteer.Gazetteer.load(pre_translated_data_path, gazetteer.gazetteer_path)
+
+
+def set_place_names(data):
+    global place_names
+    place_names = data
+
+
+def load_codes(path):
+    """
+    지역 코드 파일을 읽고 검증
+
+    :raises InvalidConfig: 지역 코드가 정수가 아닌 경우
+    """
+    data = config_watcher.load_json(path)
+    for wide, region_code in data.items():
+        if not isinstance(region_code, int):
+            raise config_watcher.InvalidConfig(path, f'{wide}의 지역 코드가 정수가 아님')
+    return data
+
+
+def set_codes(data):
+    global code
+    code = data
+
+
+def checkpoint():
+    """
+    다시 실행하기 전에 진행중인 발행 작업을 기다리고 상태를 저장
+    """
+    # 모아서 보내려고 기다리는 알림은 바로 보냄 (알림을 보내야 발행 작업이 끝남)
+    publisher.flush()
+    workers.join(timeout=setting.kma_setting.sleep_time * 6)
+    state.save()
+    sequence_tracker.save()
+
+
+def apply_setting(new_setting: GlobalSetting):
+    """
+    다시 불러온 설정을 적용 (재시작해야 적용되는 설정이 바뀌었으면 경고만 남김)
+    """
+    global setting
+    changed = setting.restart_required(new_setting)
+    if len(changed) > 0:
+        logger.warning(f'재시작해야 적용되는 설정이 바뀜 : {changed}')
+    setting = new_setting
+    notification.global_setting = new_setting
+    aws_s3.g_setting = new_setting
+    publisher.push_window = new_setting.push_window
 
 
 if __name__ == "__main__":
-    # 미리 번역된 단어들 불러오기
-    with open('rules/translate.json', 'rb') as f:
-        pre_translated_data = json.load(f)
+    # 미리 번역된 단어와 지명 사전 불러오기
+    place_names = load_place_names()
 
     # setting 불러오기
     setting = GlobalSetting.create()
@@ -603,42 +1074,53 @@ if __name__ == "__main__":
     if setting.kma_setting.sleep_time <= 0:
         sys.exit("Time value is zero or under zero.")
 
+    # 이전 실행의 상태 불러오기
+    state = StateStore(setting.kma_setting.state_full_path)
+    prev_data = state.get_last_id('prev_data')
+    if state.get_last_id('uid') is None and os.path.exists(setting.kma_setting.full_path):
+        # 예전 버전의 uid 파일에서 옮겨옴
+        with open(setting.kma_setting.full_path, 'r') as uid_file:
+            state.set_last_id('uid', uid_file.readline())
+
     # 각총 초기화
     aws_s3.init_aws_s3(setting)
     notification.notify_contents_init(setting)
-    client = translate.TranslationServiceClient.from_service_account_json(setting.gcloud_secret_key)
-    parent = client.location_path("jijin-alimi", "global")
+    client = startup.Deferred('translate', lambda: translate.TranslationServiceClient.from_service_account_json(
+        setting.gcloud_secret_key))
+    parent = "projects/jijin-alimi/locations/global"
+    if setting.warm_clients:
+        # 첫 크롤링을 기다리게 하지 않고 백그라운드에서 미리 불러옴
+        client.warm()
+        startup.warm_modules(Image, bs4)
+
+    code = load_codes(codes_path)
 
-    with open('rules/codes.json', 'rb') as f:
-        code = json.load(f)
+    # 기상청 서버 요청 정책 (헤지 요청, 서킷 브레이커, 지연 시간 기록)
+    # 목록, 상세, 이미지 요청은 같은 호스트이므로 keep-alive 연결을 나눠 씀
+    kma_session = connection_keeper.create_session()
+    kma_list = upstream.create_endpoint(setting.upstream, 'kma_list', kma_session)
+    kma_detail = upstream.create_endpoint(setting.upstream, 'kma_detail', kma_session)
+
+    # 좌표로 지역을 찾기 위한 색인 초기화
+    geocoder.init_geocoder()
+
+    # 지진 계열 색인 불러오기
+    sequence_tracker = SequenceTracker(setting.sequence.full_path('kma'), 'kma', setting.sequence.cell_size,
+                                       setting.sequence.radius, setting.sequence.window)
 
     # 로거 초기화
     os.makedirs(setting.log_path, exist_ok=True)
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
-    fmtter = logging.Formatter(fmt=u'[%(asctime)s] %(levelname)s: %(message)s',
-                               datefmt='%Y-%m-%d %H:%M:%S')
-
-    log_hdlr = logging.handlers.RotatingFileHandler(filename=setting.kma_setting.log_full_path,
-                                                    maxBytes=1024*1024, backupCount=1, encoding='utf8')  # 파일 저장 로그
-    log_hdlr.setFormatter(fmtter)
-    log_hdlr.setLevel(logging.INFO)
-    logger.addHandler(log_hdlr)
-
-    stream_hdlr = logging.StreamHandler()
-    stream_hdlr.setFormatter(fmtter)  # 콘솔 출력 로그
-    stream_hdlr.setLevel(logging.ERROR)
-    logger.addHandler(stream_hdlr)
-
-    mail_hdlr = MailgunLogHandler('한국 기상청 크롤러로부터 경고!!!!', setting.mailgun)
-    mail_hdlr.setLevel(logging.WARNING)
-    mail_hdlr.setFormatter(fmtter)
-    logger.addHandler(mail_hdlr)
+    logger = custom_logging_handler.init_logger(__name__, setting.kma_setting.log_full_path,
+                                                '한국 기상청 크롤러로부터 경고!!!!', setting.mailgun,
+                                                setting.log_max_bytes, setting.log_backup_count,
+                                                extra_loggers=('coalescer', 'config_watcher', 'leader_election',
+                                                               'memory', 'metrics', 'profiler', 'startup',
+                                                               'upstream', 'connection_keeper', 'outbox'))
 
     # Print current setting value.
     print(f"KMA Scraper Service is running... Time value is {setting.kma_setting.sleep_time} second(s).")
-    # 프로그램이 처음으로 실행됬는가? 파일이 없으면 처음 실행/ 있으면 재실행됨
-    restarted = os.path.exists(setting.kma_setting.full_path)
+    # 프로그램이 처음으로 실행됬는가? 저장된 uid가 없으면 처음 실행/ 있으면 재실행됨
+    restarted = state.get_last_id('uid') is not None
     if not restarted:
         print(f"[{datetime.datetime.now()}] <KMA> 프로그램 처음 실행")
         logger.info('프로그램 처음 실행')
@@ -649,27 +1131,103 @@ if __name__ == "__main__":
     if not os.path.exists(setting.kma_setting.current_data_path):
         os.makedirs(setting.kma_setting.current_data_path)
 
+    # 이중화 구성시 리더만 저장 및 알림을 수행하고, 대기 인스턴스는 폴링과 파싱만 계속함
+    elector = leader_election.create_elector(setting.leader, 'kma', setting.kma_setting.sleep_time)
+    elector.start()
+    was_leader = False
+
+    # 발행 작업은 백그라운드에서 처리하고, 같은 지진의 새 발표가 들어오면 이전 작업을 중단함
+    publisher = coalescer.EventCoalescer('kma', setting.push_window)
+
+    # 메트릭과 상태 확인 서버 시작
+    # 새 지진은 SQLite 발행 대기열에 넣고 발행 작업자가 꺼내서 처리 (S3, 번역, FCM이 느리거나 실패해도 크롤링 주기는 그대로)
+    box = outbox.Outbox(setting.outbox.full_path('kma'), on_terminal=discard_publish)
+    recovered = box.recover()
+    if recovered > 0:
+        logger.info(f'이전 실행에서 끝나지 않은 발행 작업 {recovered}개를 다시 처리')
+    box.purge()
+    workers = outbox.OutboxWorkers('kma', box, publisher, success_crawling_kma, setting.outbox.workers,
+                                   setting.outbox.max_attempts, setting.outbox.max_backoff,
+                                   is_active=lambda: elector.is_leader)
+    metrics.PUBLISH_BACKLOG.set_function(lambda: box.backlog)
+    metrics.start_server(setting.kma_setting.metrics_port, setting.health_max_age)
+
+    # 지진이 없는 동안에도 발행 경로의 연결이 끊기지 않도록 유지 (시작할 때 번역, FCM 채널도 미리 만듦)
+    keeper = connection_keeper.ConnectionKeeper('kma', setting.keepalive_interval)
+    keeper.add('weather.go.kr', connection_keeper.http_probe(kma_session, i.kma_base_url))
+    keeper.add('s3', aws_s3.probe)
+    keeper.add('fcm', notification.probe)
+    keeper.add('translate', probe_translate)
+    keeper.start()
+
+    # 설정 파일과 규칙 파일이 바뀌면 재시작 없이 다시 불러옴
+    watcher = config_watcher.ConfigWatcher(setting.reload_interval)
+    watcher.watch(setting.setting_path, GlobalSetting.load, apply_setting)
+    watcher.watch(notification.notify_contents_path, notification.load_notify_contents,
+                  notification.set_notify_contents)
+    watcher.watch(pre_translated_data_path, load_place_names, set_place_names)
+    watcher.watch(gazetteer.gazetteer_path, load_place_names, set_place_names)
+    watcher.watch(codes_path, load_codes, set_codes)
+    watcher.start()
+
+    # 느린 사이클 프로파일링과 SIGUSR1을 받으면 스레드 스택, 상태 저장
+    cycle_profiler = profiler.CycleProfiler('kma', setting.profile.output_path, setting.profile.slow_cycle,
+                                            setting.profile.enabled)
+    profiler.install_dump_signal('kma', setting.profile.output_path, lambda: {
+        'prev_data': prev_data,
+        'pending_publish': state.pending_publishes(),
+        'pending_jobs': box.pending_keys(),
+        'is_leader': elector.is_leader
+    })
+
+    # 시작할 때 만든 객체는 GC 검사 대상에서 제외
+    memory.freeze()
+    memory_guard = memory.MemoryGuard(setting.memory_limit_mb)
+
     dt = setting.kma_setting.sleep_time - 0.1
     while True:
+        # 메모리 사용량이 제한을 넘으면 상태를 저장하고 다시 실행
+        if memory_guard.after_cycle():
+            memory.reexec(checkpoint)
         t = math.fmod(dt, setting.kma_setting.sleep_time)
         time.sleep(setting.kma_setting.sleep_time - t)
         logger.info("크롤링 시작")
+        startup.mark_first_poll('kma')
         start_time = time.time()
-        success, cur_data = create_data()
+        cycle_profiler.start()
+        # 처음 시작했거나 리더를 넘겨받았으면 끝나지 않은 발행 작업을 이어서 진행
+        if elector.is_leader and not was_leader:
+            prune_held(elector.leader_alive_until)
+            resume_publish()
+        was_leader = elector.is_leader
+        success, cur_data, cur_base_data = create_data()
         if success:
             if restarted:
                 logger.info("재시작 루틴")
                 restarted = False
-                with open(setting.kma_setting.full_path, 'r') as uid_file:
-                    prev_uid = uid_file.readline()
-                    if prev_uid == cur_data.uid:
-                        logger.info("재시작 새로운 데이터 없음 다음 단계로")
-                        end_time = time.time()
-                        dt = end_time - start_time
-                        logger.info(f"크롤링 종료. 걸린시간 : {dt}")
-                        continue
+                if state.get_last_id('uid') == cur_data.uid:
+                    logger.info("재시작 새로운 데이터 없음 다음 단계로")
+                    state.set_last_id('prev_data', cur_base_data.data)
+                    end_time = time.time()
+                    dt = end_time - start_time
+                    logger.info(f"크롤링 종료. 걸린시간 : {dt}", extra={'stage': 'poll', 'duration': round(dt, 3)})
+                    metrics.POLL_SECONDS.observe(dt, stage='cycle')
+                    metrics.mark_success()
+                    cycle_profiler.stop(dt, cur_data.uid)
+                    continue
             logger.info("새로운 데이터 불러오기 성공")
-            success_crawling_kma(cur_data)
+            if elector.is_leader:
+                enqueue_publish(cur_data, cur_base_data)
+            else:
+                logger.info("대기 인스턴스이므로 저장 및 알림 없이 발행 대기 상태로 기록")
+                tag_sequence(cur_data)
+                hold_publish(cur_data, cur_base_data)
+                prune_held(elector.leader_alive_until)
         end_time = time.time()
         dt = end_time - start_time
-        logger.info(f"크롤링 종료. 걸린시간 : {dt}")
+        logger.info(f"크롤링 종료. 걸린시간 : {dt}", extra={'stage': 'poll', 'duration': round(dt, 3)})
+        metrics.POLL_SECONDS.observe(dt, stage='cycle')
+        # 지진 목록을 불러왔을 때만 정상 (서킷 브레이커로 막혀 있으면 /healthz가 비정상으로 응답)
+        if list_reachable:
+            metrics.mark_success()
+        cycle_profiler.stop(dt, cur_data.uid if success else None)
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger('leader_election')
+
+
+class NotSupportLeaseBackend(Exception):
+    def __init__(self, name):
+        super().__init__(f"지원 되지 않는 리스 백엔드입니다 : {name}")
+
+
+class LeaseBackend:
+    """
+    리더 리스를 저장하는 백엔드의 기본 클래스
+    """
+
+    def try_acquire(self, owner: str, ttl: float) -> bool:
+        """
+        리스를 얻거나 이미 가지고 있으면 연장
+
+        :param owner: 리스를 얻으려는 인스턴스 이름
+        :param ttl: 리스 유효 시간(초)
+        :return: 리스를 가지고 있는지 여부
+        """
+        raise NotImplementedError("이 함수는 서브클래스에서 정의될 필요가 있습니다.")
+
+    def release(self, owner: str):
+        """
+        가지고 있는 리스를 반납
+
+        :param owner: 리스를 가지고 있는 인스턴스 이름
+        """
+        raise NotImplementedError("이 함수는 서브클래스에서 정의될 필요가 있습니다.")
+
+
+class FileLeaseBackend(LeaseBackend):
+    """
+    로컬 파일과 flock을 이용한 리스 백엔드 (테스트용, 같은 파일시스템을 공유하는 인스턴스끼리만 동작)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _update(self, func):
+        import fcntl
+
+        with open(self.path, 'a+', encoding='utf8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    lease = json.loads(content) if content else None
+                except ValueError:
+                    lease = None
+                result, new_lease = func(lease)
+                if new_lease is not lease:
+                    f.seek(0)
+                    f.truncate()
+                    if new_lease is not None:
+                        json.dump(new_lease, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def try_acquire(self, owner: str, ttl: float) -> bool:
+        def acquire(lease):
+            now = time.time()
+            if lease is None or lease.get('owner') == owner or lease.get('expires', 0) < now:
+                return True, {'owner': owner, 'expires': now + ttl}
+            return False, lease
+
+        return self._update(acquire)
+
+    def release(self, owner: str):
+        def release(lease):
+            if lease is not None and lease.get('owner') == owner:
+                return None, None
+            return None, lease
+
+        self._update(release)
+
+
+lease_backends = {
+    'file': FileLeaseBackend
+}
+
+
+class LeaderElector:
+    """
+    리스를 주기적으로 갱신해서 리더인지 판단하는 클래스
+
+    리더가 죽어서 리스가 만료되면 대기중인 인스턴스가 다음 갱신 주기(폴링 주기 이하)에 리더를 넘겨받음
+    """
+
+    def __init__(self, backend: LeaseBackend, name: str, ttl: float, interval: float):
+        self.backend = backend
+        self.name = name
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.ttl = ttl
+        self.interval = interval
+        self._expires = 0.0
+        self._other_seen = None  # 다른 인스턴스가 리스를 가지고 있는 것을 마지막으로 본 시각
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._expires
+
+    @property
+    def leader_alive_until(self):
+        """
+        다른 인스턴스가 리더로 살아있던 것이 확실한 마지막 시각 (time.time 기준, 본 적이 없으면 None)
+
+        리스를 가지고 있는 것을 본 시각에서 리스 유효 시간을 뺀 시각 이후에 리더가 리스를 갱신했기 때문
+        """
+        if self._other_seen is None:
+            return None
+        return self._other_seen - self.ttl
+
+    def renew(self):
+        """
+        리스를 얻거나 연장
+        """
+        was_leader = self.is_leader
+        started = time.monotonic()
+        try:
+            acquired = self.backend.try_acquire(self.owner, self.ttl)
+            if not acquired:
+                self._other_seen = time.time()
+        except Exception:
+            logger.exception(f'<{self.name}> 리스 갱신 실패')
+            acquired = False
+
+        if acquired:
+            # 백엔드 호출 시작 시각 기준으로 만료 시각을 잡아서 다른 인스턴스보다 먼저 만료되게 함
+            self._expires = started + self.ttl
+        else:
+            self._expires = 0.0
+
+        if acquired and not was_leader:
+            logger.warning(f'<{self.name}> 리더가 됨 : {self.owner}')
+        elif not acquired and was_leader:
+            logger.warning(f'<{self.name}> 리더를 잃음 : {self.owner}')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.renew()
+
+    def start(self):
+        """
+        첫 리스 획득을 시도한 뒤 백그라운드에서 주기적으로 갱신
+        """
+        self.renew()
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}_lease', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.is_leader:
+            self.backend.release(self.owner)
+        self._expires = 0.0
+
+
+class SingleInstanceElector:
+    """
+    리더 선출을 사용하지 않을 때 쓰는 클래스. 항상 리더
+    """
+
+    is_leader = True
+    leader_alive_until = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def create_elector(leader_setting, name: str, poll_interval: float):
+    """
+    설정에 맞는 리더 선출기를 만듦
+
+    :param leader_setting: LeaderSetting 클래스
+    :param name: 크롤러 이름 (kma, jma)
+    :param poll_interval: 크롤러의 폴링 주기(초)
+    :raises NotSupportLeaseBackend: 설정된 백엔드가 없는 경우
+    """
+    if not leader_setting.enabled:
+        return SingleInstanceElector()
+
+    backend_class = lease_backends.get(leader_setting.backend)
+    if backend_class is None:
+        raise NotSupportLeaseBackend(leader_setting.backend)
+    backend = backend_class(leader_setting.lease_full_path(name))
+    # 리스 만료 후 폴링 주기 안에 넘겨받을 수 있도록 갱신 주기는 폴링 주기 이하로 함
+    interval = min(poll_interval, leader_setting.ttl / 3)
+    return LeaderElector(backend, name, leader_setting.ttl, interval)
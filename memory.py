@@ -0,0 +1,91 @@
+import gc
+import logging
+import os
+import sys
+import tracemalloc
+
+import metrics
+
+logger = logging.getLogger('memory')
+
+MB = 1024 * 1024
+
+
+def rss_bytes() -> int:
+    """
+    현재 프로세스의 RSS(bytes). /proc을 읽을 수 없으면 최대 RSS를 돌려줌
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS는 bytes, 리눅스는 KB 단위
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def release(soup):
+    """
+    BeautifulSoup 트리의 순환 참조를 끊어서 GC를 기다리지 않고 바로 해제되게 함
+    """
+    if soup is not None:
+        soup.decompose()
+
+
+def freeze():
+    """
+    시작할 때 만든 객체(설정, 규칙, 색인, 모듈)를 GC 검사 대상에서 빼서 GC 시간을 줄임
+    """
+    gc.collect()
+    gc.freeze()
+    logger.info(f'시작 객체 {gc.get_freeze_count()}개를 GC 대상에서 제외')
+
+
+class MemoryGuard:
+    """
+    사이클마다 메모리 사용량을 기록하고, RSS가 제한을 넘으면 알려주는 클래스
+    """
+
+    def __init__(self, limit_mb):
+        """
+        :param limit_mb: RSS 제한(MB), 0 이하이면 제한 없음
+        """
+        self.limit = limit_mb * MB if limit_mb > 0 else None
+        self.last_rss = rss_bytes()
+        self.last_traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+
+    def after_cycle(self) -> bool:
+        """
+        사이클이 끝날 때 호출해서 RSS와 tracemalloc 변화량을 메트릭으로 기록
+
+        :return: RSS가 제한을 넘었는지 여부
+        """
+        rss = rss_bytes()
+        metrics.RSS_BYTES.set(rss)
+        metrics.RSS_DELTA_BYTES.set(rss - self.last_rss)
+        self.last_rss = rss
+        if tracemalloc.is_tracing():
+            traced = tracemalloc.get_traced_memory()[0]
+            if self.last_traced is not None:
+                metrics.TRACED_DELTA_BYTES.set(traced - self.last_traced)
+            self.last_traced = traced
+        return self.limit is not None and rss > self.limit
+
+
+def reexec(checkpoint):
+    """
+    상태를 저장하고 같은 인수로 프로세스를 다시 실행 (PID는 유지됨)
+
+    :param checkpoint: 다시 실행하기 전에 상태를 저장하는 함수
+    """
+    logger.warning(f'RSS 제한 초과로 다시 실행 : {rss_bytes() // MB} MB')
+    try:
+        checkpoint()
+    except Exception:
+        logger.exception('다시 실행하기 전에 상태 저장 실패')
+    import custom_logging_handler
+    custom_logging_handler.stop_logging()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
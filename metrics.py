@@ -0,0 +1,230 @@
+import contextlib
+import http.server
+import logging
+import threading
+import time
+
+logger = logging.getLogger('metrics')
+
+# 지연 시간 히스토그램의 기본 구간(초)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 이름: 메트릭 (등록 순서대로 출력)
+registry = {}
+
+# 마지막으로 성공한 사이클 시각 (time.time())
+last_success = time.time()
+# 마지막 성공으로부터 이 시간(초)이 지나면 /healthz가 503을 돌려줌
+health_max_age = None
+
+server = None
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    text = ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + text + '}'
+
+
+class Metric:
+    """
+    Prometheus 텍스트 형식으로 출력되는 메트릭의 베이스 클래스
+    """
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # 라벨 값 튜플: 값
+        registry[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """
+        :return: [(이름, 라벨 문자열, 값), ...]
+        """
+        raise NotImplementedError("이 함수는 서브클래스에서 정의될 필요가 있습니다.")
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{labels} {value}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._functions = {}  # 라벨 값 튜플: 출력할 때 값을 계산하는 함수
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, func, **labels):
+        with self._lock:
+            self._functions[self._key(labels)] = func
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+            functions = list(self._functions.items())
+        items += [(key, func()) for key, func in functions]
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # 구간별 개수, 합계, 전체 개수
+                counts = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = counts
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][idx] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        with 블록의 소요 시간을 기록
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(c[0]), c[1], c[2])) for key, c in self._values.items()]
+        result = []
+        for key, (bucket_counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                result.append((f'{self.name}_bucket', _format_labels(self.labelnames, key, [('le', bound)]),
+                               bucket_count))
+            result.append((f'{self.name}_bucket', _format_labels(self.labelnames, key, [('le', '+Inf')]), count))
+            result.append((f'{self.name}_sum', _format_labels(self.labelnames, key), total))
+            result.append((f'{self.name}_count', _format_labels(self.labelnames, key), count))
+        return result
+
+
+POLL_SECONDS = Histogram('jijin_poll_seconds', '크롤링 사이클 소요 시간', ['stage'])
+UPSTREAM_RESPONSES = Counter('jijin_upstream_responses_total', '기상청 서버 응답 수 (status: HTTP 상태 코드 또는 timeout)',
+                             ['upstream', 'status'])
+UPSTREAM_LATENCY_QUANTILE = Gauge('jijin_upstream_latency_seconds', '최근 기상청 서버 응답의 지연 시간 백분위(초)',
+                                  ['upstream', 'quantile'])
+UPSTREAM_HEDGES = Counter('jijin_upstream_hedges_total', '응답이 늦어 같은 요청을 한 번 더 보낸 수', ['upstream'])
+UPSTREAM_CIRCUIT_OPEN = Gauge('jijin_upstream_circuit_open', '서킷 브레이커가 요청을 막고 있는지 여부 (1: open/half open)',
+                              ['upstream'])
+KEEPALIVE_PROBES = Counter('jijin_keepalive_probes_total', '연결 유지용 확인 요청 결과 수', ['target', 'result'])
+KEEPALIVE_PROBE_SECONDS = Histogram('jijin_keepalive_probe_seconds', '연결 유지용 확인 요청 소요 시간', ['target'])
+TRANSLATE_REQUESTS = Counter('jijin_translate_total', '번역한 문자열 수 (source: cache 미리 번역된 단어, api 번역 API)',
+                             ['source'])
+TRANSLATE_API_CALLS = Counter('jijin_translate_api_calls_total', '번역 API 호출 수')
+TRANSLATE_FALLBACKS = Counter('jijin_translate_fallback_total', '번역 API가 제한 시간 안에 응답하지 않아 로마자 표기나 원문을 사용한 '
+                              '문자열 수', ['language'])
+S3_PUT_SECONDS = Histogram('jijin_s3_put_seconds', 'S3 저장 소요 시간')
+FCM_SENDS = Counter('jijin_fcm_send_total', 'FCM 알림 전송 결과 수', ['topic', 'result'])
+PUBLISH_STEP_SECONDS = Histogram('jijin_publish_step_seconds', '발행 단계 안의 작업 하나의 소요 시간 (stage: download, resize, '
+                                 'translate, upload)', ['stage', 'result'])
+PUBLISH_STEP_RETRIES = Counter('jijin_publish_step_retries_total', '발행 단계 안에서 실패해서 다시 시도한 작업 수', ['stage'])
+PUBLISH_BACKLOG = Gauge('jijin_publish_backlog', '대기중인 발행 작업 수')
+RSS_BYTES = Gauge('jijin_rss_bytes', '프로세스 RSS(bytes)')
+RSS_DELTA_BYTES = Gauge('jijin_rss_delta_bytes', '마지막 사이클 동안의 RSS 변화량(bytes)')
+TRACED_DELTA_BYTES = Gauge('jijin_tracemalloc_delta_bytes', '마지막 사이클 동안의 tracemalloc 메모리 변화량(bytes)')
+LAST_SUCCESS_AGE = Gauge('jijin_seconds_since_last_success', '마지막으로 성공한 크롤링 사이클로부터 지난 시간(초)')
+LAST_SUCCESS_AGE.set_function(lambda: round(time.time() - last_success, 3))
+
+
+def mark_success():
+    """
+    크롤링 사이클이 성공했음을 기록
+    """
+    global last_success
+    last_success = time.time()
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in list(registry.values())) + '\n'
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, render(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif self.path == '/healthz':
+            age = time.time() - last_success
+            if health_max_age is not None and age > health_max_age:
+                self._reply(503, f'stale {age:.1f}s\n', 'text/plain; charset=utf-8')
+            else:
+                self._reply(200, f'ok {age:.1f}s\n', 'text/plain; charset=utf-8')
+        else:
+            self._reply(404, 'not found\n', 'text/plain; charset=utf-8')
+
+    def _reply(self, status, body, content_type):
+        body = body.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 수집기가 주기적으로 호출하므로 접속 로그는 남기지 않음
+        pass
+
+
+def start_server(port, max_age, host='127.0.0.1'):
+    """
+    /metrics와 /healthz를 제공하는 HTTP 서버를 백그라운드 스레드에서 시작
+
+    :param port: 포트 (0 이하이면 시작하지 않음)
+    :param max_age: 마지막 성공으로부터 이 시간(초)이 지나면 /healthz가 503을 돌려줌
+    :param host: 접속을 받을 주소 (기본은 로컬만)
+    :return: HTTP 서버 (시작하지 않으면 None)
+    """
+    global server
+    global health_max_age
+    global last_success
+    health_max_age = max_age
+    last_success = time.time()
+    if port is None or port <= 0:
+        return None
+    server = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics_server', daemon=True)
+    thread.start()
+    logger.info(f'메트릭 서버 시작 : http://{host}:{port}/metrics')
+    return server
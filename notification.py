@@ -6,33 +6,51 @@
             Gomgom (dev@gomgom.net, https://www.gomgom.net)
 """
 
+import collections
 import copy
 import json
-import logging.handlers
+import logging
 import os
 import re
+import threading
 
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import exceptions
-from firebase_admin import messaging
-
+import config_watcher
+import custom_logging_handler
+import metrics
+import payload_encoder
+import startup
 import translator
-from custom_logging_handler import MailgunLogHandler
 from setting_management import GlobalSetting
 
+firebase_admin = startup.lazy_import('firebase_admin')
+credentials = startup.lazy_import('firebase_admin.credentials')
+exceptions = startup.lazy_import('firebase_admin.exceptions')
+messaging = startup.lazy_import('firebase_admin.messaging')
+
 kma_topic = '토픽이름이 설정되지 않은 상태입니다.'  # 한국 기상청 토픽 이름
 jma_topic = '토픽이름이 설정되지 않은 상태입니다.'  # 일본 기상청 토픽 이름
 support_language = ['ko', 'ja', 'en', 'zh_Hans', 'zh_Hant']
 regex = re.compile(r'\*[\w\\.]*\*')
 
+notify_contents_path = 'rules/notification.json'
 notify_contents = None
 global_setting: GlobalSetting
 
 COUNTRY_KMA = 'kma'
 COUNTRY_JMA = 'jma'
 
+# 연결을 미리 만들기 위한 dry run 알림의 토픽 (실제로 보내지 않음)
+WARMUP_TOPIC = 'warmup'
+
+# 지진별로 기억해둘 마지막 알림 내용의 최대 개수
+MAX_LAST_PAYLOADS = 100
+
+# 지진 id: (버전, 마지막으로 보낸 전체 알림 내용)
+last_payloads = collections.OrderedDict()
+last_payloads_lock = threading.Lock()
+
 logger: logging.Logger
+firebase_app: startup.Deferred
 
 
 class NotInitializeNotifyContents(Exception):
@@ -45,6 +63,11 @@ class NotSupportCountry(Exception):
         super().__init__("지원 되지 않는 국가의 기상청. kma나 jma를 입력요망")
 
 
+class CannotFindTopic(Exception):
+    def __init__(self):
+        super().__init__("notification.json에서 kma 또는 jma 토픽을 찾지 못했습니다.")
+
+
 def notify_contents_init(setting: GlobalSetting):
     """
     알림을 보내기 위한 초기화 진행
@@ -52,65 +75,166 @@ def notify_contents_init(setting: GlobalSetting):
     :param setting: 셋팅 클래스
     :raises CannotFindTopic: notification.json에서 토픽과 관련된 데이터를 찾지 못한 경우
     """
-    global notify_contents
-    global kma_topic
-    global jma_topic
     global global_setting
     global logger
+    global firebase_app
 
-    with open('rules/notification.json', 'rb') as f:
-        notify_contents = json.load(f)
-        kma_topic = notify_contents['topics']['kma']
-        jma_topic = notify_contents['topics']['jma']
+    set_notify_contents(load_notify_contents(notify_contents_path))
 
     global_setting = setting
-    cred = credentials.Certificate(global_setting.firebase_secret_key)  # 비 공개 생성키 파일 이름
-    firebase_admin.initialize_app(cred)
+    # firebase_admin은 불러오는데 오래 걸리므로 처음 알림을 보낼 때 초기화하거나 백그라운드에서 미리 초기화
+    firebase_app = startup.Deferred('firebase', lambda: firebase_admin.initialize_app(
+        credentials.Certificate(global_setting.firebase_secret_key)))  # 비 공개 생성키 파일 이름
+    if global_setting.warm_clients:
+        firebase_app.warm()
 
     os.makedirs(global_setting.log_path, exist_ok=True)
-    logger = logging.getLogger('notification')
-    logger.setLevel(logging.DEBUG)
-    fmtter = logging.Formatter(fmt=u'[%(asctime)s] %(levelname)s: %(message)s',
-                               datefmt='%Y-%m-%d %H:%M:%S')
+    logger = custom_logging_handler.init_logger('notification',
+                                                os.path.join(global_setting.log_path, global_setting.notification_log_file),
+                                                '푸쉬 알림 경고!!!!', setting.mailgun,
+                                                setting.log_max_bytes, setting.log_backup_count)
+
+
+def load_notify_contents(path):
+    """
+    알림 내용 파일을 읽고 검증
+
+    :param path: 파일 경로
+    :return: 알림 내용
+    :raises CannotFindTopic: 토픽과 관련된 데이터를 찾지 못한 경우
+    :raises InvalidConfig: 알림 종류별로 언어마다 제목과 내용이 없는 경우
+    """
+    contents = config_watcher.load_json(path)
+    topics = contents.get('topics', {})
+    if not isinstance(topics.get(COUNTRY_KMA), str) or not isinstance(topics.get(COUNTRY_JMA), str):
+        raise CannotFindTopic()
+    for country in [COUNTRY_KMA, COUNTRY_JMA]:
+        cases = contents.get(country)
+        if not isinstance(cases, dict) or 'case_0' not in cases:
+            raise config_watcher.InvalidConfig(path, f'{country}의 알림 종류가 없음')
+        for case, content in cases.items():
+            for language in support_language:
+                if not isinstance(content.get(language), dict) or \
+                        'title' not in content[language] or 'message' not in content[language]:
+                    raise config_watcher.InvalidConfig(path, f'{country}.{case}.{language}의 제목 또는 내용이 없음')
+    return contents
+
+
+def set_notify_contents(contents):
+    """
+    알림 내용을 교체 (load_notify_contents로 검증된 값이어야 함)
+    """
+    global notify_contents
+    global kma_topic
+    global jma_topic
+    kma_topic = contents['topics'][COUNTRY_KMA]
+    jma_topic = contents['topics'][COUNTRY_JMA]
+    notify_contents = contents
 
-    log_hdlr = logging.handlers.RotatingFileHandler(filename=os.path.join(global_setting.log_path, global_setting.notification_log_file),
-                                                    maxBytes=1024 * 1024, backupCount=1, encoding='utf8')  # 파일 저장 로그
-    log_hdlr.setFormatter(fmtter)
-    log_hdlr.setLevel(logging.INFO)
-    logger.addHandler(log_hdlr)
 
-    stream_hdlr = logging.StreamHandler()
-    stream_hdlr.setFormatter(fmtter)  # 콘솔 출력 로그
-    stream_hdlr.setLevel(logging.ERROR)
-    logger.addHandler(stream_hdlr)
+def push_notify_kma(notify_content, quake_id=None):
+    send_message(notify_content, kma_topic, quake_id)
 
-    mail_hdlr = MailgunLogHandler('푸쉬 알림 경고!!!!', setting.mailgun)
-    mail_hdlr.setLevel(logging.WARNING)
-    mail_hdlr.setFormatter(fmtter)
-    logger.addHandler(mail_hdlr)
 
+def push_notify_jma(notify_content, quake_id=None):
+    send_message(notify_content, jma_topic, quake_id)
 
-def push_notify_kma(notify_content):
-    send_message(notify_content, kma_topic)
 
+def diff_contents(old: dict, new: dict) -> dict:
+    """
+    두 알림 내용에서 바뀐 필드만 뽑음 (지워진 필드는 None)
 
-def push_notify_jma(notify_content):
-    send_message(notify_content, jma_topic)
+    :param old: 이전 알림 내용
+    :param new: 새 알림 내용
+    :return: 바뀐 필드
+    """
+    delta = {}
+    for key, value in new.items():
+        old_value = old.get(key)
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            sub_delta = diff_contents(old_value, value)
+            if len(sub_delta) > 0:
+                delta[key] = sub_delta
+        elif old_value != value or key not in old:
+            delta[key] = value
+    for key in old.keys():
+        if key not in new:
+            delta[key] = None
+    return delta
+
+
+def build_payload(contents, quake_id=None):
+    """
+    FCM data 메시지를 만듦. 이미 알림을 보낸 지진이면 바뀐 필드와 버전만 보내고,
+    더 크거나 크기 제한을 넘으면 전체 내용을 보냄
+
+    :param contents: 알림 내용
+    :param quake_id: 같은 지진인지 구분하는 id (None이면 항상 전체 내용)
+    :return: FCM data 메시지
+    """
+    encoding = global_setting.push_encoding
+    drop_fields = global_setting.push_drop_fields
+    if quake_id is None or not global_setting.delta_push:
+        return payload_encoder.fit_payload('json', contents, {}, encoding, drop_fields)
+
+    with last_payloads_lock:
+        version, base = last_payloads.get(quake_id, (0, None))
+        version += 1
+        last_payloads[quake_id] = (version, copy.deepcopy(contents))
+        last_payloads.move_to_end(quake_id)
+        while len(last_payloads) > MAX_LAST_PAYLOADS:
+            last_payloads.popitem(last=False)
+
+    full = payload_encoder.fit_payload('json', contents, {'qid': quake_id, 'ver': str(version)},
+                                       encoding, drop_fields)
+    if base is None:
+        return full
+
+    delta = payload_encoder.fit_payload('delta', diff_contents(base, contents),
+                                        {'qid': quake_id, 'ver': str(version), 'base': str(version - 1)},
+                                        encoding, drop_fields)
+    full_size = payload_encoder.payload_size(full)
+    delta_size = payload_encoder.payload_size(delta)
+    if delta_size >= full_size or delta_size > payload_encoder.FCM_DATA_LIMIT:
+        return full
+    logger.info(f'<{quake_id}> 변경된 필드만 보냄. 전체 {full_size} bytes -> {delta_size} bytes')
+    return delta
+
+
+def probe():
+    """
+    FCM 인증 토큰과 연결을 미리 만들어 두기 위한 dry run 요청 (connection_keeper에서 주기적으로 호출)
+    """
+    firebase_app.get()
+    messaging.send(messaging.Message(topic=WARMUP_TOPIC), dry_run=True)
 
 
-def send_message(contents, topic):
+def send_message(contents, topic, quake_id=None):
+    data = build_payload(contents, quake_id)
+    size = payload_encoder.payload_size(data)
+    if size > payload_encoder.FCM_DATA_LIMIT:
+        logger.warning(f'<{topic}> 알림 크기가 FCM 제한을 넘음 : {size} bytes')
+    firebase_app.get()
     message = messaging.Message(
         topic=topic,
-        data={'json': json.dumps(contents)}
+        data=data
     )
     try:
         response = messaging.send(message, dry_run=global_setting.notification_dry_run)
     except exceptions.FirebaseError:
+        metrics.FCM_SENDS.inc(topic=topic, result='firebase_error')
         logger.exception('알림 보내기 실패 : Firebase로 알림을 보내는 도중에 실패 했습니다')
+        # 앱이 이 버전을 받지 못했으므로 다음 알림은 전체 내용으로 보냄
+        with last_payloads_lock:
+            last_payloads.pop(quake_id, None)
     except ValueError:
+        metrics.FCM_SENDS.inc(topic=topic, result='invalid')
         logger.exception('알림 보내기 실패 : 무효한 인수가 들어 왔습니다.')
+        with last_payloads_lock:
+            last_payloads.pop(quake_id, None)
     else:
-        logger.info(f'<{topic}> 알림 보내기 성공 - {response}')
+        metrics.FCM_SENDS.inc(topic=topic, result='success')
+        logger.info(f'<{topic}> 알림 보내기 성공 ({size} bytes) - {response}')
 
 
 def get_data(data: dict, *args):
@@ -145,21 +269,38 @@ def replace_data(data: dict, lan, match):
 
 
 def change_data(data: dict, country: str, notify_content):
-    copy_notify_content = copy.deepcopy(notify_content)
-    for key, value in copy_notify_content.items():
+    # 템플릿을 통째로 복사하지 않고 치환한 결과로 새 dict를 만듦
+    copy_notify_content = {}
+    for key, value in notify_content.items():
         if isinstance(value, str):
             d = data if country == COUNTRY_JMA else data.get('ko')
-            result = regex.sub(lambda m: replace_data(d, 'ko', m), value)
-            copy_notify_content[key] = result
+            copy_notify_content[key] = regex.sub(lambda m: replace_data(d, 'ko', m), value)
         elif isinstance(value, dict):
-            content = copy_notify_content[key]
             d = data if country == COUNTRY_JMA else data.get(key)
-            for con_key, con_value in content.items():
-                result = regex.sub(lambda m: replace_data(d, key, m), con_value)
-                copy_notify_content[key][con_key] = result
+            copy_notify_content[key] = {con_key: regex.sub(lambda m: replace_data(d, key, m), con_value)
+                                        for con_key, con_value in value.items()}
+        else:
+            copy_notify_content[key] = copy.deepcopy(value)
     return copy_notify_content
 
 
+def get_quake_id(data: dict, country):
+    """
+    같은 지진에 대한 발표끼리 같은 값을 가지는 id
+
+    :param data: 지진 데이터
+    :param country: 지진 데이터를 받아온 국가 (한국 또는 일본)
+    :return: 지진 id (알 수 없으면 None)
+    """
+    if country == COUNTRY_JMA:
+        event_id = data.get('event_id')
+        return None if event_id is None else f'{COUNTRY_JMA}:{event_id}'
+    ko = data.get('ko')
+    if ko is None or ko.get('datetime') is None:
+        return None
+    return f"{COUNTRY_KMA}:{ko['datetime'][:16]}"
+
+
 def push_notify_support(data: dict, country, notify_content):
     """
     알림 보내기 도움 함수
@@ -171,7 +312,7 @@ def push_notify_support(data: dict, country, notify_content):
     """
     copy_notify_content = change_data(data, country, notify_content)
     push = push_notify_jma if country == COUNTRY_JMA else push_notify_kma
-    push(copy_notify_content)
+    push(copy_notify_content, get_quake_id(data, country))
 
 
 def push_notify(data: dict, notify_type=0):
@@ -0,0 +1,338 @@
+import base64
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+
+import coalescer
+import upstream
+
+logger = logging.getLogger('outbox')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+SUPERSEDED = 'superseded'  # 같은 지진의 새 발표가 들어와서 처리하지 않음
+DEAD = 'dead'  # 최대 시도 횟수를 넘어서 포기함
+
+# 끝난 작업은 이 시간(초)이 지나면 지움
+DONE_RETENTION = 7 * 24 * 60 * 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    event_key TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, next_attempt);
+'''
+
+
+def dumps(*args) -> str:
+    """
+    발행 함수에 넘길 인수를 문자열로 바꿈 (발행 대기열 밖에서 JSON 파일에 저장할 때 사용)
+    """
+    return base64.b64encode(pickle.dumps(args)).decode('ascii')
+
+
+def loads(text: str):
+    """
+    dumps로 바꾼 문자열을 발행 함수에 넘길 인수로 되돌림
+    """
+    return pickle.loads(base64.b64decode(text))
+
+
+class OutboxEvent:
+    """
+    발행 대기열에서 꺼낸 작업 하나
+    """
+
+    def __init__(self, id, idempotency_key, event_key, payload, attempts):
+        self.id = id
+        self.idempotency_key = idempotency_key  # 같은 발표를 두 번 넣지 않기 위한 값
+        self.event_key = event_key  # 같은 지진인지 구분하는 값
+        self.payload = payload
+        self.attempts = attempts
+
+    def args(self):
+        """
+        :return: 발행 함수에 넘길 인수
+        :raises pickle.UnpicklingError: 다른 버전의 코드에서 저장한 작업이라 불러올 수 없는 경우
+        """
+        return pickle.loads(self.payload)
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.id} {self.idempotency_key} (시도 {self.attempts})>'
+
+
+class Outbox:
+    """
+    SQLite에 저장하는 발행 대기열
+
+    크롤링 루프는 새 지진을 넣기만 하고, 발행 작업자가 꺼내서 처리가 끝난 뒤에 완료를 기록하므로
+    처리 도중에 프로그램이 죽어도 다시 시작하면 같은 작업을 다시 처리함 (at-least-once)
+    """
+
+    def __init__(self, path, on_terminal=None):
+        """
+        :param path: SQLite 파일 경로
+        :param on_terminal: 작업이 끝나면(완료, 교체, 포기) idempotency key를 받아서 호출할 함수 (ex. 발행 단계 기록 삭제)
+        """
+        self.path = path
+        self.on_terminal = on_terminal
+        # SIGUSR1 상태 저장은 메인 스레드에서 호출되므로 메인 스레드가 작업을 추가하는 도중에도 잠금을 다시 잡을 수 있어야 함
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+
+    def append(self, idempotency_key, event_key, *args) -> bool:
+        """
+        작업 추가. 같은 지진의 대기중인 이전 작업은 처리하지 않음
+
+        :param idempotency_key: 같은 발표를 두 번 넣지 않기 위한 값
+        :param event_key: 같은 지진인지 구분하는 값
+        :param args: 발행 함수에 넘길 인수 (pickle로 저장)
+        :return: 새로 추가했는지 여부 (이미 있는 발표면 False)
+        """
+        payload = pickle.dumps(args)
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO outbox (idempotency_key, event_key, payload, status, next_attempt, created, '
+                    'updated) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (idempotency_key, event_key, payload, PENDING, now, now, now))
+                inserted = cursor.rowcount > 0
+                superseded = []
+                if inserted:
+                    superseded = [row[0] for row in self._conn.execute(
+                        'SELECT idempotency_key FROM outbox WHERE event_key = ? AND status = ? AND id < ?',
+                        (event_key, PENDING, cursor.lastrowid)).fetchall()]
+                    self._conn.execute(
+                        'UPDATE outbox SET status = ?, updated = ? WHERE event_key = ? AND status = ? AND id < ?',
+                        (SUPERSEDED, now, event_key, PENDING, cursor.lastrowid))
+                    if len(superseded) > 0:
+                        logger.info(f'대기중인 발행 작업을 새로운 발표로 교체 : {event_key}')
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        for key in superseded:
+            self._terminal(key)
+        return inserted
+
+    def claim(self):
+        """
+        처리할 시각이 된 가장 오래된 작업을 꺼냄
+
+        진행중인 작업은 오래 걸려도 다시 꺼내지 않음 (작업자 스레드가 아직 처리중일 수 있으므로).
+        프로그램이 죽어서 멈춘 작업은 다시 시작할 때 recover에서 다시 처리할 수 있게 함
+
+        :return: OutboxEvent (없으면 None)
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT id, idempotency_key, event_key, payload, attempts FROM outbox '
+                    'WHERE status = ? AND next_attempt <= ? ORDER BY id LIMIT 1', (PENDING, now)).fetchone()
+                if row is not None:
+                    self._conn.execute('UPDATE outbox SET status = ?, updated = ? WHERE id = ?',
+                                       (RUNNING, now, row[0]))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return None if row is None else OutboxEvent(*row)
+
+    def _set_status(self, event, status, next_attempt=None, error=None, attempts=None):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE outbox SET status = ?, next_attempt = COALESCE(?, next_attempt), last_error = ?, '
+                'attempts = COALESCE(?, attempts), updated = ? WHERE id = ?',
+                (status, next_attempt, error, attempts, time.time(), event.id))
+
+    def _terminal(self, idempotency_key):
+        if self.on_terminal is None:
+            return
+        try:
+            self.on_terminal(idempotency_key)
+        except Exception:
+            logger.exception(f'끝난 작업 처리 실패 : {idempotency_key}')
+
+    def complete(self, event):
+        self._set_status(event, DONE)
+        self._terminal(event.idempotency_key)
+
+    def supersede(self, event):
+        self._set_status(event, SUPERSEDED)
+        self._terminal(event.idempotency_key)
+
+    def retry(self, event, error, delay):
+        """
+        실패한 작업을 delay초 뒤에 다시 처리
+        """
+        self._set_status(event, PENDING, time.time() + delay, error, event.attempts + 1)
+
+    def dead(self, event, error):
+        """
+        최대 시도 횟수를 넘은 작업을 포기함 (지우지 않고 남겨둠)
+        """
+        self._set_status(event, DEAD, error=error, attempts=event.attempts + 1)
+        self._terminal(event.idempotency_key)
+
+    def recover(self):
+        """
+        프로그램이 시작할 때 이전 실행에서 진행중이던 작업을 다시 처리할 수 있게 함
+
+        :return: 다시 처리할 작업 수
+        """
+        with self._lock:
+            return self._conn.execute('UPDATE outbox SET status = ? WHERE status = ?',
+                                      (PENDING, RUNNING)).rowcount
+
+    def purge(self, retention=DONE_RETENTION):
+        """
+        오래된 완료, 교체된 작업을 지움
+        """
+        with self._lock:
+            return self._conn.execute('DELETE FROM outbox WHERE status IN (?, ?) AND updated < ?',
+                                      (DONE, SUPERSEDED, time.time() - retention)).rowcount
+
+    def status(self, idempotency_key):
+        """
+        :return: 작업 상태 (대기열에 없거나 지워졌으면 None)
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT status FROM outbox WHERE idempotency_key = ?',
+                                     (idempotency_key,)).fetchone()
+        return None if row is None else row[0]
+
+    @property
+    def backlog(self) -> int:
+        """
+        대기중이거나 진행중인 작업 수
+        """
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)',
+                                      (PENDING, RUNNING)).fetchone()[0]
+
+    def in_flight(self) -> int:
+        """
+        진행중이거나 지금 바로 처리할 수 있는 작업 수 (다시 시도를 기다리는 작업은 제외)
+        """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM outbox WHERE status = ? OR (status = ? AND next_attempt <= ?)',
+                (RUNNING, PENDING, time.time())).fetchone()[0]
+
+    def pending_keys(self):
+        """
+        대기중이거나 진행중인 작업의 idempotency key 리스트
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT idempotency_key FROM outbox WHERE status IN (?, ?) ORDER BY id',
+                                      (PENDING, RUNNING)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxWorkers:
+    """
+    발행 대기열에서 작업을 꺼내서 처리하는 작업자 스레드 묶음
+
+    발행 함수는 첫 번째 인수로 PublishToken을 받으며, 같은 지진의 새 발표를 처리하기 시작하면 이전 작업은 다음 단계에서 중단됨
+    """
+
+    def __init__(self, name, box, publisher, func, workers, max_attempts, max_backoff, is_active=None):
+        """
+        :param name: 크롤러 이름 (kma, jma)
+        :param box: Outbox
+        :param publisher: 같은 지진의 작업을 중단하고 알림을 모아서 보내기 위한 EventCoalescer
+        :param func: 발행 함수
+        :param workers: 작업자 스레드 수
+        :param max_attempts: 최대 시도 횟수
+        :param max_backoff: 실패 후 다시 처리할때까지 기다리는 최대 시간(초)
+        :param is_active: False를 돌려주면 작업을 꺼내지 않음 (ex. 리더가 아닌 경우)
+        """
+        self.name = name
+        self.box = box
+        self.publisher = publisher
+        self.func = func
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.is_active = is_active if is_active is not None else (lambda: True)
+        self._wakeup = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f'{name}_outbox_{n}', daemon=True)
+                         for n in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self):
+        """
+        새 작업을 넣은 뒤에 호출하면 기다리지 않고 바로 꺼냄
+        """
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            event = self.box.claim() if self.is_active() else None
+            if event is None:
+                self._wakeup.wait(1)
+                self._wakeup.clear()
+                continue
+            self._process(event)
+
+    def _process(self, event):
+        try:
+            args = event.args()
+        except Exception as e:
+            logger.exception(f'<{self.name}> 발행 작업을 불러올 수 없음 : {event}')
+            self.box.dead(event, repr(e))
+            return
+
+        token = self.publisher.begin(event.event_key)
+        try:
+            self.func(token, *args)
+        except coalescer.StalePublish as e:
+            logger.info(f'<{self.name}> {e}')
+            self.box.supersede(event)
+        except Exception as e:
+            if event.attempts + 1 >= self.max_attempts:
+                logger.exception(f'<{self.name}> 발행 작업 실패, 최대 시도 횟수를 넘어서 포기 : {event}')
+                self.box.dead(event, repr(e))
+            else:
+                delay = upstream.backoff(event.attempts, self.max_backoff, base=1)
+                logger.warning(f'<{self.name}> 발행 작업 실패, {delay:.1f}초 뒤에 다시 시도 : {event} ({e!r})')
+                self.box.retry(event, repr(e), delay)
+        else:
+            self.box.complete(event)
+        finally:
+            self.publisher.end(token)
+
+    def join(self, timeout=None):
+        """
+        대기중이거나 진행중인 작업이 모두 끝날때까지 기다림 (다시 시도를 기다리는 작업은 남아 있을 수 있음)
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.box.in_flight() == 0:
+                return True
+            if end is not None and time.monotonic() > end:
+                return False
+            time.sleep(0.05)
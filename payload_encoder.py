@@ -0,0 +1,95 @@
+import base64
+import copy
+import json
+import logging
+import zlib
+
+logger = logging.getLogger('notification')
+
+# FCM data 메시지의 최대 크기
+FCM_DATA_LIMIT = 4096
+
+ENCODING_JSON = 'json'  # 압축하지 않은 JSON
+ENCODING_ZLIB = 'zlib'  # zlib으로 압축한 JSON을 base64로 인코딩 (키 이름 앞에 'z'를 붙임)
+
+support_encoding = [ENCODING_JSON, ENCODING_ZLIB]
+
+
+class NotSupportEncoding(Exception):
+    def __init__(self, encoding):
+        super().__init__(f"지원 되지 않는 알림 인코딩입니다 : {encoding}")
+
+
+def dumps(obj) -> str:
+    """
+    공백 없이, 한글/일본어/중국어를 \\uXXXX로 바꾸지 않고 JSON으로 변환
+    """
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def payload_size(data: dict) -> int:
+    """
+    FCM data 메시지의 크기 (키와 값의 UTF-8 바이트 수 합)
+    """
+    return sum(len(k.encode('utf8')) + len(v.encode('utf8')) for k, v in data.items())
+
+
+def encode(key: str, obj, encoding=ENCODING_JSON) -> dict:
+    """
+    알림 내용을 FCM data 필드 하나로 인코딩
+
+    :param key: data 필드 이름 (json, delta)
+    :param obj: 알림 내용
+    :param encoding: json 또는 zlib
+    :return: {필드 이름: 인코딩된 문자열}
+    :raises NotSupportEncoding: 지원하지 않는 인코딩인 경우
+    """
+    if encoding == ENCODING_JSON:
+        return {key: dumps(obj)}
+    elif encoding == ENCODING_ZLIB:
+        compressed = zlib.compress(dumps(obj).encode('utf8'), 9)
+        return {'z' + key: base64.b64encode(compressed).decode('ascii')}
+    raise NotSupportEncoding(encoding)
+
+
+def _drop_field(obj: dict, field: str) -> bool:
+    """
+    알림 내용과 언어별 내용에서 필드를 지움
+
+    :return: 지운 필드가 있는지 여부
+    """
+    dropped = obj.pop(field, None) is not None
+    for value in obj.values():
+        if isinstance(value, dict):
+            dropped |= value.pop(field, None) is not None
+    return dropped
+
+
+def fit_payload(key: str, obj, extra: dict, encoding=ENCODING_JSON, drop_fields=(), limit=FCM_DATA_LIMIT) -> dict:
+    """
+    알림 내용을 인코딩하고 크기 제한을 넘으면 우선순위가 낮은 필드부터 지움
+
+    :param key: data 필드 이름 (json, delta)
+    :param obj: 알림 내용
+    :param extra: 같이 보낼 다른 data 필드
+    :param encoding: json 또는 zlib
+    :param drop_fields: 크기 제한을 넘을 때 지울 필드 (앞에 있을수록 먼저 지움)
+    :param limit: 크기 제한(bytes)
+    :return: FCM data 메시지
+    """
+    data = dict(extra, **encode(key, obj, encoding))
+    size = payload_size(data)
+    if size <= limit:
+        return data
+
+    obj = copy.deepcopy(obj)
+    for field in drop_fields:
+        if not _drop_field(obj, field):
+            continue
+        data = dict(extra, **encode(key, obj, encoding))
+        new_size = payload_size(data)
+        logger.warning(f'알림 크기 제한 초과로 필드 삭제 : {field} ({size} bytes -> {new_size} bytes)')
+        size = new_size
+        if size <= limit:
+            break
+    return data
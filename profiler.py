@@ -0,0 +1,160 @@
+import cProfile
+import datetime
+import logging
+import os
+import pstats
+import re
+import signal
+import sys
+import threading
+import traceback
+import tracemalloc
+from pprint import pformat
+
+from var_dump import vars_dump
+
+logger = logging.getLogger('profiler')
+
+# tracemalloc 결과에 남길 상위 할당 위치 수
+TOP_ALLOCATIONS = 30
+
+
+def _file_name(name, suffix, event_id=None):
+    now = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    if event_id is None:
+        return f'{name}_{now}{suffix}'
+    return f"{name}_{now}_{re.sub(r'[^0-9A-Za-z_-]', '_', str(event_id))}{suffix}"
+
+
+class CycleProfiler:
+    """
+    크롤링 사이클을 프로파일링하고, 설정한 시간보다 오래 걸린 사이클만 결과를 파일로 저장하는 클래스
+
+    사용하지 않도록 설정하면 아무 일도 하지 않음
+    """
+
+    def __init__(self, name, output_path, slow_cycle, enabled):
+        """
+        :param name: 크롤러 이름 (kma, jma)
+        :param output_path: 결과를 저장할 경로
+        :param slow_cycle: 결과를 저장할 사이클 소요 시간(초)
+        :param enabled: 사용 여부
+        """
+        self.name = name
+        self.output_path = output_path
+        self.slow_cycle = slow_cycle
+        self.enabled = enabled
+        self._profile = None
+        if self.enabled:
+            os.makedirs(self.output_path, exist_ok=True)
+            tracemalloc.start()
+
+    def start(self):
+        """
+        사이클 시작
+        """
+        if not self.enabled:
+            return
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, elapsed, event_id=None):
+        """
+        사이클 종료. 소요 시간이 slow_cycle 이상이면 cProfile 결과와 tracemalloc 스냅샷을 저장
+
+        :param elapsed: 사이클 소요 시간(초)
+        :param event_id: 사이클에서 처리한 지진 id
+        :return: 저장한 cProfile 결과 파일 경로 (저장하지 않았으면 None)
+        """
+        if self._profile is None:
+            return None
+        profile = self._profile
+        self._profile = None
+        profile.disable()
+        if elapsed < self.slow_cycle:
+            return None
+
+        prof_path = os.path.join(self.output_path, _file_name(self.name, '.prof', event_id))
+        profile.dump_stats(prof_path)
+
+        snapshot = tracemalloc.take_snapshot()
+        mem_path = os.path.join(self.output_path, _file_name(self.name, '.tracemalloc.txt', event_id))
+        with open(mem_path, 'w', encoding='utf8') as f:
+            current, peak = tracemalloc.get_traced_memory()
+            f.write(f'current: {current} bytes, peak: {peak} bytes\n\n')
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                f.write(f'{stat}\n')
+
+        logger.warning(f'느린 사이클 ({elapsed:.1f}초) 프로파일 저장 : {prof_path}, {mem_path}')
+        return prof_path
+
+
+def format_stacks():
+    """
+    모든 스레드의 현재 스택을 문자열로 만듦
+    """
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append(f'--- Thread {names.get(ident, "?")} ({ident}) ---')
+        lines.append(''.join(traceback.format_stack(frame)))
+    return '\n'.join(lines)
+
+
+def dump(name, output_path, state_func):
+    """
+    모든 스레드의 스택과 크롤러 상태를 파일로 저장
+
+    :param name: 크롤러 이름 (kma, jma)
+    :param output_path: 결과를 저장할 경로
+    :param state_func: 크롤러 상태를 dict로 돌려주는 함수
+    :return: 저장한 파일 경로
+    """
+    try:
+        state = {key: vars_dump(value) if hasattr(value, '__dict__') else value
+                 for key, value in state_func().items()}
+        state_text = pformat(state, width=120)
+    except Exception:
+        state_text = traceback.format_exc()
+
+    os.makedirs(output_path, exist_ok=True)
+    path = os.path.join(output_path, _file_name(name, '.dump.txt'))
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('=== State ===\n')
+        f.write(state_text)
+        f.write('\n\n=== Threads ===\n')
+        f.write(format_stacks())
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            f.write(f'\n=== Memory ===\ncurrent: {current} bytes, peak: {peak} bytes\n')
+    return path
+
+
+def install_dump_signal(name, output_path, state_func, signum=getattr(signal, 'SIGUSR1', None)):
+    """
+    시그널(기본 SIGUSR1)을 받으면 스레드 스택과 크롤러 상태를 파일로 저장하도록 등록
+
+    :param name: 크롤러 이름 (kma, jma)
+    :param output_path: 결과를 저장할 경로
+    :param state_func: 크롤러 상태를 dict로 돌려주는 함수
+    :param signum: 시그널 번호 (SIGUSR1이 없는 OS면 등록하지 않음)
+    """
+    if signum is None:
+        return
+
+    def handler(received, frame):
+        path = dump(name, output_path, state_func)
+        logger.info(f'스레드 스택과 상태 저장 : {path}')
+
+    signal.signal(signum, handler)
+
+
+def print_stats(path, limit=30):
+    """
+    저장한 cProfile 결과에서 누적 시간이 긴 함수를 출력 (python -m profiler 파일.prof)
+    """
+    pstats.Stats(path).sort_stats('cumulative').print_stats(limit)
+
+
+if __name__ == '__main__':
+    print_stats(sys.argv[1])
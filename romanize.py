@@ -0,0 +1,135 @@
+"""
+국어의 로마자 표기법(Revised Romanization)으로 한글을 로마자로 바꾸는 모듈
+
+한글 음절을 초성, 중성, 종성으로 나눈 뒤에 음절 사이의 연음, 비음화, 유음화를 반영함
+(된소리되기와 체언의 ㅎ 거센소리되기는 표기법에 따라 반영하지 않음)
+"""
+
+HANGUL_BASE = 0xAC00
+HANGUL_END = 0xD7A3
+
+INITIALS = ['g', 'kk', 'n', 'd', 'tt', 'r', 'm', 'b', 'pp', 's', 'ss', '', 'j', 'jj', 'ch', 'k', 't', 'p', 'h']
+MEDIALS = ['a', 'ae', 'ya', 'yae', 'eo', 'e', 'yeo', 'ye', 'o', 'wa', 'wae', 'oe', 'yo', 'u', 'wo', 'we', 'wi', 'yu',
+           'eu', 'ui', 'i']
+# 종성 (받침 없음, ㄱ ㄲ ㄳ ㄴ ㄵ ㄶ ㄷ ㄹ ㄺ ㄻ ㄼ ㄽ ㄾ ㄿ ㅀ ㅁ ㅂ ㅄ ㅅ ㅆ ㅇ ㅈ ㅊ ㅋ ㅌ ㅍ ㅎ)
+FINALS = ['', 'k', 'k', 'k', 'n', 'n', 'n', 't', 'l', 'k', 'm', 'l', 'l', 'l', 'p', 'l', 'm', 'p', 'p', 't', 't', 'ng',
+          't', 't', 'k', 't', 'p', 't']
+# 다음 음절이 모음으로 시작할 때 (남는 받침 소리, 다음 음절로 넘어가는 소리)
+LIAISON = ['', ('', 'g'), ('', 'kk'), ('k', 's'), ('', 'n'), ('n', 'j'), ('', 'n'), ('', 'd'), ('', 'r'), ('l', 'g'),
+           ('l', 'm'), ('l', 'b'), ('l', 's'), ('l', 't'), ('l', 'p'), ('', 'r'), ('', 'm'), ('', 'b'), ('p', 's'),
+           ('', 's'), ('', 'ss'), ('ng', ''), ('', 'j'), ('', 'ch'), ('', 'k'), ('', 't'), ('', 'p'), ('', '')]
+
+# 초성 번호
+I_N = 2
+I_R = 5
+I_M = 6
+I_SILENT = 11
+I_G = 0
+I_D = 3
+I_J = 12
+# 종성 번호
+F_L = 8
+F_H = 27
+F_LH = 15
+F_NH = 6
+
+# 받침 소리의 비음화 (ㄴ, ㅁ 앞)
+NASAL = {'k': 'ng', 't': 'n', 'p': 'm'}
+# 받침 ㅎ 뒤의 거센소리되기 (좋고 -> joko)
+ASPIRATE = {I_G: 'k', I_D: 't', I_J: 'ch'}
+
+
+def _decompose(char):
+    index = ord(char) - HANGUL_BASE
+    return index // (21 * 28), (index // 28) % 21, index % 28
+
+
+def _is_hangul(char):
+    return HANGUL_BASE <= ord(char) <= HANGUL_END
+
+
+def _romanize_word(word):
+    syllables = [_decompose(c) for c in word]
+    result = []
+    for idx, (initial, medial, final) in enumerate(syllables):
+        if idx == 0:
+            # 첫 음절의 ㄹ은 r
+            onset = INITIALS[initial]
+        else:
+            onset = result.pop()
+        result.append(onset + MEDIALS[medial])
+
+        next_initial = syllables[idx + 1][0] if idx + 1 < len(syllables) else None
+        if next_initial is None:
+            result.append(FINALS[final])
+            result.append('')
+            continue
+
+        coda = FINALS[final]
+        onset = INITIALS[next_initial]
+        if next_initial == I_SILENT:
+            # 연음 (받침이 다음 음절의 첫소리가 됨)
+            if final != 0:
+                coda, onset = LIAISON[final]
+        elif final in (F_H, F_LH, F_NH) and next_initial in ASPIRATE:
+            coda = {F_H: '', F_LH: 'l', F_NH: 'n'}[final]
+            onset = ASPIRATE[next_initial]
+        elif next_initial == I_R:
+            if coda == 'l':
+                onset = 'l'
+            elif coda == 'n':
+                # 신라 -> Silla
+                coda, onset = 'l', 'l'
+            elif coda in ('m', 'ng'):
+                onset = 'n'
+            elif coda in NASAL:
+                # 백령 -> Baengnyeong
+                coda, onset = NASAL[coda], 'n'
+        elif next_initial in (I_N, I_M):
+            if coda == 'l' and next_initial == I_N:
+                onset = 'l'
+            elif coda in NASAL:
+                coda = NASAL[coda]
+        result.append(coda)
+        result.append(onset)
+    return ''.join(result)
+
+
+def romanize(text: str) -> str:
+    """
+    한글을 로마자로 바꿈 (한글이 아닌 글자는 그대로 둠)
+
+    :param text: 한글 문자열 (ex. 강릉)
+    :return: 로마자 문자열 (ex. gangneung)
+    """
+    result = []
+    word = []
+    for char in text:
+        if _is_hangul(char):
+            word.append(char)
+            continue
+        if len(word) > 0:
+            result.append(_romanize_word(word))
+            word = []
+        result.append(char)
+    if len(word) > 0:
+        result.append(_romanize_word(word))
+    return ''.join(result)
+
+
+# 행정 구역 단위 (앞에 붙임표를 넣고 음운 변화는 반영하지 않음)
+PLACE_SUFFIXES = ['시', '군', '구', '읍', '면', '동', '리']
+
+
+def romanize_place(word: str) -> str:
+    """
+    지명을 로마자로 바꿈. 행정 구역 단위는 붙임표로 나누고 첫 글자는 대문자로 씀
+
+    :param word: 지명 (ex. 내남면)
+    :return: 로마자 지명 (ex. Naenam-myeon)
+    """
+    if len(word) > 1 and word[-1] in PLACE_SUFFIXES and _is_hangul(word[-2]):
+        romanized = f'{romanize(word[:-1])}-{romanize(word[-1])}'
+    else:
+        romanized = romanize(word)
+    return romanized[:1].upper() + romanized[1:]
@@ -0,0 +1,201 @@
+import collections
+import datetime
+import json
+import math
+import threading
+
+from state_store import atomic_write_json
+
+EARTH_RADIUS = 6371.0  # km
+
+# 같은 지진의 다른 발표(속보, 정보 등)로 보는 발생 시각 차이(초)
+SAME_EVENT_SECONDS = 60
+
+# 격자 한 칸에 보관할 최대 지진 수 (군발 지진 중에도 조회 시간이 일정하도록 제한)
+MAX_EVENTS_PER_CELL = 256
+
+# 이 수만큼 지진을 추가할 때마다 파일에 저장 (그 사이에는 checkpoint에서 저장)
+SAVE_EVERY = 20
+
+# 격자 칸의 경도 방향 너비가 가장 좁아지는 위도 (한국, 일본 주변)
+MAX_LATITUDE = 50
+
+
+def _distance(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def _timestamp(date_str):
+    return datetime.datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S').timestamp()
+
+
+def cell_width(cell_size):
+    """
+    격자 한 칸의 가장 좁은 너비(km). 주변 3x3 칸만 확인하므로 같은 계열로 보는 진앙 거리 이상이어야 함
+
+    :param cell_size: 격자 한 칸의 크기(도)
+    """
+    return math.radians(cell_size) * EARTH_RADIUS * math.cos(math.radians(MAX_LATITUDE))
+
+
+class SequenceTracker:
+    """
+    지진 이력을 공간 격자 + 시간 창으로 색인해서 같은 지진 계열(본진, 여진, 군발 지진)로 묶는 클래스
+
+    새 지진은 주변 3x3 격자 칸만 확인하고 시간 창이 지난 지진은 시간 순서대로 정리하며,
+    파일에는 SAVE_EVERY개마다 저장하기 때문에 이력의 크기와 상관없이 일정한 시간 안에 처리됨
+    """
+
+    def __init__(self, path, prefix, cell_size, radius, window):
+        """
+        :param path: 이력을 저장할 파일 경로
+        :param prefix: 계열 id 앞에 붙일 이름 (kma, jma)
+        :param cell_size: 격자 한 칸의 크기(도), 가장 좁은 너비(cell_width)가 radius 이상이어야 함
+        :param radius: 같은 계열로 보는 진앙 거리(km)
+        :param window: 같은 계열로 보는 시간(초)
+        :raises ValueError: 격자 한 칸이 radius보다 좁은 경우
+        """
+        if cell_width(cell_size) < radius:
+            raise ValueError(f'격자 한 칸의 너비({cell_width(cell_size):.1f}km)가 진앙 거리({radius}km)보다 좁습니다')
+        self.path = path
+        self.prefix = prefix
+        self.cell_size = cell_size
+        self.radius = radius
+        self.window = window
+        self.cells = {}  # (격자 x, 격자 y): deque([지진, ...])
+        self.timeline = collections.deque()  # 모든 격자 칸의 지진 (추가한 순서)
+        self.unsaved = 0  # 파일에 저장하지 않은 지진 수
+        self.sequences = collections.OrderedDict()  # 계열 id: 계열 정보 (마지막 갱신 순서)
+        self._lock = threading.RLock()  # 여러 발행 작업자가 동시에 추가할 수 있음
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                loaded = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for seq_id, sequence in loaded.get('sequences', []):
+            self.sequences[seq_id] = sequence
+        for event in sorted(loaded.get('events', []), key=lambda e: e['time']):
+            self._cell(event['latitude'], event['longitude']).append(event)
+            self.timeline.append(event)
+
+    def save(self):
+        with self._lock:
+            events = [event for cell in self.cells.values() for event in cell]
+            atomic_write_json(self.path, {'sequences': list(self.sequences.items()), 'events': events})
+            self.unsaved = 0
+
+    def _cell_key(self, latitude, longitude):
+        return int(math.floor(latitude / self.cell_size)), int(math.floor(longitude / self.cell_size))
+
+    def _cell(self, latitude, longitude):
+        key = self._cell_key(latitude, longitude)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = collections.deque(maxlen=MAX_EVENTS_PER_CELL)
+            self.cells[key] = cell
+        return cell
+
+    def _expire(self, now):
+        """
+        시간 창이 지난 계열과 지진을 오래된 순서대로 정리 (한 번 정리된 것은 다시 보지 않으므로 평균 상수 시간)
+        새 지진이 들어오지 않는 격자 칸의 지진도 같이 정리됨
+        """
+        while len(self.sequences) > 0:
+            seq_id, sequence = next(iter(self.sequences.items()))
+            if now - sequence['last_time'] <= self.window:
+                break
+            del self.sequences[seq_id]
+        while len(self.timeline) > 0 and now - self.timeline[0]['time'] > self.window:
+            event = self.timeline.popleft()
+            key = self._cell_key(event['latitude'], event['longitude'])
+            cell = self.cells.get(key)
+            # 격자 칸에도 추가한 순서대로 들어있으므로 아직 남아있다면 맨 앞에 있음
+            if cell is not None and len(cell) > 0 and cell[0] is event:
+                cell.popleft()
+                if len(cell) == 0:
+                    del self.cells[key]
+
+    def _neighbors(self, latitude, longitude, now):
+        cx, cy = self._cell_key(latitude, longitude)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cell = self.cells.get((cx + dx, cy + dy))
+                if cell is None:
+                    continue
+                # 시간 창이 지난 지진은 앞에서부터 정리
+                while len(cell) > 0 and now - cell[0]['time'] > self.window:
+                    cell.popleft()
+                if len(cell) == 0:
+                    del self.cells[(cx + dx, cy + dy)]
+                    continue
+                yield from cell
+
+    def add(self, event_id, date_str, latitude, longitude, magnitude):
+        """
+        새 지진을 색인에 추가하고 계열 정보를 돌려줌
+
+        :param event_id: 지진 고유 id
+        :param date_str: 지진 발생 시각 (년-월-일 시:분:초)
+        :param latitude: 위도
+        :param longitude: 경도
+        :param magnitude: 규모
+        :return: {'id': 계열 id, 'mainshock': 본진 id, 'count': 계열의 지진 수}
+        """
+        with self._lock:
+            return self._add(event_id, date_str, latitude, longitude, magnitude)
+
+    def _add(self, event_id, date_str, latitude, longitude, magnitude):
+        now = _timestamp(date_str)
+        self._expire(now)
+
+        same = None
+        nearest = None
+        for event in self._neighbors(latitude, longitude, now):
+            dist = _distance(latitude, longitude, event['latitude'], event['longitude'])
+            if dist > self.radius or event['sequence'] not in self.sequences:
+                continue
+            if abs(now - event['time']) <= SAME_EVENT_SECONDS:
+                same = event
+                break
+            if nearest is None or dist < nearest[0]:
+                nearest = (dist, event)
+
+        if same is not None:
+            # 같은 지진의 새 발표는 계열 수를 늘리지 않고 정보만 갱신
+            event = same
+            sequence = self.sequences[event['sequence']]
+            if sequence['mainshock'] == event['id']:
+                sequence['mainshock'] = event_id
+                sequence['mainshock_magnitude'] = magnitude
+            event['id'] = event_id
+            event['magnitude'] = magnitude
+        else:
+            if nearest is not None:
+                seq_id = nearest[1]['sequence']
+                sequence = self.sequences[seq_id]
+                sequence['count'] += 1
+            else:
+                seq_id = f"{self.prefix}-{date_str.replace('-', '').replace(':', '').replace(' ', '')}"
+                sequence = {'mainshock': event_id, 'mainshock_magnitude': magnitude, 'count': 1, 'last_time': now}
+                self.sequences[seq_id] = sequence
+            event = {'id': event_id, 'time': now, 'latitude': latitude, 'longitude': longitude,
+                     'magnitude': magnitude, 'sequence': seq_id}
+            self._cell(latitude, longitude).append(event)
+            self.timeline.append(event)
+
+        seq_id = event['sequence']
+        if magnitude >= sequence['mainshock_magnitude']:
+            sequence['mainshock'] = event_id
+            sequence['mainshock_magnitude'] = magnitude
+        sequence['last_time'] = max(sequence['last_time'], now)
+        self.sequences.move_to_end(seq_id)
+        self.unsaved += 1
+        if self.unsaved >= SAVE_EVERY:
+            self.save()
+
+        return {'id': seq_id, 'mainshock': sequence['mainshock'], 'count': sequence['count']}
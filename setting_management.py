@@ -1,11 +1,18 @@
 import os
 import json
 
+import sequence
+
 
 setting_directory_path = 'settings'
 setting_file_name = 'settings.json'
 
 
+class InvalidSetting(Exception):
+    def __init__(self, reason):
+        super().__init__(f"설정 값이 올바르지 않습니다 : {reason}")
+
+
 class BaseSetting:
     """
     설정 파일을 관리하는 클래스가 상속해야할 기본 클래스
@@ -26,17 +33,25 @@ class CommonSetting(BaseSetting):
                  log_file_name,
                  current_data_path,
                  current_data_file_name,
-                 sleep_time):
+                 sleep_time,
+                 state_file_name,
+                 metrics_port):
         self.log_path = log_path
         self.log_file_name = log_file_name
         self.current_data_path = current_data_path
         self.current_data_file_name = current_data_file_name
         self.sleep_time = sleep_time
+        self.state_file_name = state_file_name
+        self.metrics_port = metrics_port  # 메트릭, 상태 확인 서버 포트 (0이면 사용 안함)
 
     @property
     def full_path(self):
         return os.path.join(self.current_data_path, self.current_data_file_name)
 
+    @property
+    def state_full_path(self):
+        return os.path.join(self.current_data_path, self.state_file_name)
+
     @property
     def log_full_path(self):
         return os.path.join(self.log_path, self.log_file_name)
@@ -51,8 +66,13 @@ class KMASetting(CommonSetting):
                  log_file_name,
                  current_data_path,
                  current_data_file_name,
-                 sleep_time):
-        super().__init__(log_path, log_file_name, current_data_path, current_data_file_name, sleep_time)
+                 sleep_time,
+                 state_file_name='state_kma.json',
+                 metrics_port=9101,
+                 translate_deadline=3):
+        super().__init__(log_path, log_file_name, current_data_path, current_data_file_name, sleep_time,
+                         state_file_name, metrics_port)
+        self.translate_deadline = translate_deadline  # 지진 하나의 번역 API 응답을 기다리는 제한 시간(초, 0이면 제한 없음)
 
 
 class JMASetting(CommonSetting):
@@ -64,8 +84,15 @@ class JMASetting(CommonSetting):
                  log_file_name,
                  current_data_path,
                  current_data_file_name,
-                 sleep_time):
-        super().__init__(log_path, log_file_name, current_data_path, current_data_file_name, sleep_time)
+                 sleep_time,
+                 state_file_name='state_jma.json',
+                 img_deadline=30,
+                 impact_threshold=1.5,
+                 metrics_port=9102):
+        super().__init__(log_path, log_file_name, current_data_path, current_data_file_name, sleep_time,
+                         state_file_name, metrics_port)
+        self.img_deadline = img_deadline  # 지진 지도 이미지 주소를 불러오는 제한 시간(초)
+        self.impact_threshold = impact_threshold  # 한반도에 알림을 보낼 최소 추정 계측 진도
 
 
 class MailgunSetting(BaseSetting):
@@ -96,6 +123,98 @@ class AWSSetting(BaseSetting):
         self.region_name = region_name
 
 
+class LeaderSetting(BaseSetting):
+    """
+    이중화(리더 선출)와 관련된 설정을 관리하는 클래스
+    """
+    def __init__(self,
+                 enabled=False,
+                 backend='file',
+                 lease_path='./data/',
+                 ttl=15):
+        self.enabled = enabled
+        self.backend = backend
+        self.lease_path = lease_path
+        self.ttl = ttl
+
+    def lease_full_path(self, name):
+        return os.path.join(self.lease_path, f'{name}_leader.lease')
+
+
+class SequenceSetting(BaseSetting):
+    """
+    지진 계열(본진, 여진) 묶기와 관련된 설정을 관리하는 클래스
+    """
+    def __init__(self,
+                 data_path,
+                 cell_size=0.5,
+                 radius=30,
+                 window_hours=168):
+        self.data_path = data_path
+        self.cell_size = cell_size  # 격자 한 칸의 크기(도)
+        self.radius = radius  # 같은 계열로 보는 진앙 거리(km)
+        self.window_hours = window_hours  # 같은 계열로 보는 시간(시간)
+
+    @property
+    def window(self):
+        return self.window_hours * 60 * 60
+
+    def full_path(self, name):
+        return os.path.join(self.data_path, f'sequence_{name}.json')
+
+
+class ProfileSetting(BaseSetting):
+    """
+    느린 사이클 프로파일링과 관련된 설정을 관리하는 클래스
+    """
+    def __init__(self,
+                 data_path,
+                 enabled=False,
+                 slow_cycle=10):
+        self.data_path = data_path
+        self.enabled = enabled  # 사이클마다 cProfile, tracemalloc을 켤지 여부
+        self.slow_cycle = slow_cycle  # 프로파일 결과를 저장할 사이클 소요 시간(초)
+
+    @property
+    def output_path(self):
+        return os.path.join(self.data_path, 'profile')
+
+
+class UpstreamSetting(BaseSetting):
+    """
+    기상청 서버 요청 정책(헤지 요청, 서킷 브레이커, 재시도 대기)과 관련된 설정을 관리하는 클래스
+    """
+    def __init__(self,
+                 timeout=10,
+                 hedge=True,
+                 failure_threshold=5,
+                 reset_timeout=30,
+                 max_backoff=30):
+        self.timeout = timeout  # 요청 하나의 제한 시간(초)
+        self.hedge = hedge  # 첫 요청이 p95 안에 응답하지 않으면 같은 요청을 하나 더 보낼지 여부
+        self.failure_threshold = failure_threshold  # 요청을 막기 시작할 연속 실패 횟수
+        self.reset_timeout = reset_timeout  # 요청을 막은 뒤에 시험 요청을 보낼때까지의 시간(초)
+        self.max_backoff = max_backoff  # 실패 후 다시 요청할때까지 기다리는 최대 시간(초)
+
+
+class OutboxSetting(BaseSetting):
+    """
+    발행 대기열과 관련된 설정을 관리하는 클래스
+    """
+    def __init__(self,
+                 data_path,
+                 workers=4,
+                 max_attempts=10,
+                 max_backoff=300):
+        self.data_path = data_path
+        self.workers = workers  # 발행 작업자 스레드 수
+        self.max_attempts = max_attempts  # 발행 작업 하나의 최대 시도 횟수
+        self.max_backoff = max_backoff  # 실패 후 다시 처리할때까지 기다리는 최대 시간(초)
+
+    def full_path(self, name):
+        return os.path.join(self.data_path, f'outbox_{name}.sqlite3')
+
+
 class GlobalSetting(BaseSetting):
     """
     전역 설정 파일을 관리하는 클래스
@@ -112,7 +231,23 @@ class GlobalSetting(BaseSetting):
                  jma_setting,
                  notification_log_file,
                  gcloud_secret_key_json_file,
-                 credential_path):
+                 credential_path,
+                 leader=None,
+                 sequence=None,
+                 push_window=60,
+                 delta_push=False,
+                 push_encoding='json',
+                 push_drop_fields=None,
+                 log_max_bytes=1024 * 1024,
+                 log_backup_count=5,
+                 health_max_age=120,
+                 profile=None,
+                 warm_clients=True,
+                 reload_interval=5,
+                 memory_limit_mb=512,
+                 upstream=None,
+                 keepalive_interval=45,
+                 outbox=None):
         self.notification_dry_run = notification_dry_run
         self.credential_path = credential_path
         self.gcloud_secret_key_json_file = gcloud_secret_key_json_file
@@ -124,6 +259,25 @@ class GlobalSetting(BaseSetting):
         self.kma_setting = KMASetting(**kma_setting, current_data_path=data_path, log_path=log_path)
         self.jma_setting = JMASetting(**jma_setting, current_data_path=data_path, log_path=log_path)
         self.notification_log_file = notification_log_file
+        # 나중에 추가된 설정은 예전 설정 파일에 없으면 기본값을 사용
+        self.leader = LeaderSetting(**(leader or {}))
+        self.sequence = SequenceSetting(**(sequence or {}), data_path=data_path)
+        self.profile = ProfileSetting(**(profile or {}), data_path=data_path)
+        self.upstream = UpstreamSetting(**(upstream or {}))
+        self.outbox = OutboxSetting(**(outbox or {}), data_path=data_path)
+        self.keepalive_interval = keepalive_interval  # 쉬는 동안 연결 유지용 요청을 보내는 간격(초), 0이면 시작할 때 한 번만
+        self.warm_clients = warm_clients  # 무거운 SDK와 클라이언트를 첫 사용 전에 백그라운드에서 미리 초기화할지 여부
+        self.reload_interval = reload_interval  # 설정 파일과 규칙 파일이 바뀌었는지 확인하는 간격(초), 0이면 확인 안함
+        self.memory_limit_mb = memory_limit_mb  # 넘으면 상태를 저장하고 다시 실행할 RSS(MB), 0이면 제한 없음
+        self.push_window = push_window  # 같은 지진의 알림을 모아서 보내는 시간(초)
+        self.delta_push = delta_push  # 이미 알린 지진의 갱신 알림을 바뀐 필드만 보낼지 여부
+        self.push_encoding = push_encoding  # 알림 인코딩 (json, zlib)
+        if push_drop_fields is None:
+            push_drop_fields = ['comment', 'sequence_mainshock', 'img_url']
+        self.push_drop_fields = push_drop_fields  # 알림 크기 제한을 넘을 때 지울 필드 (앞에 있을수록 먼저 지움)
+        self.log_max_bytes = log_max_bytes  # 로그 파일 최대 크기
+        self.log_backup_count = log_backup_count  # 압축해서 보관할 이전 로그 파일 수
+        self.health_max_age = health_max_age  # 마지막으로 성공한 크롤링 사이클로부터 이 시간(초)이 지나면 비정상
 
     @property
     def gcloud_secret_key(self):
@@ -133,9 +287,70 @@ class GlobalSetting(BaseSetting):
     def firebase_secret_key(self):
         return os.path.join(self.credential_path, self.firebase_secret_key_json_file)
 
+    # 실행 중에 바뀌어도 적용되지 않고 재시작이 필요한 설정
+    restart_fields = ['credential_path', 'firebase_secret_key_json_file', 'gcloud_secret_key_json_file',
+                      'data_path', 'log_path', 'notification_log_file', 'log_max_bytes', 'log_backup_count',
+                      'mailgun', 'aws', 'leader', 'sequence', 'profile', 'warm_clients', 'reload_interval',
+                      'upstream', 'keepalive_interval', 'outbox']
+
+    def validate(self):
+        """
+        설정 값 검증
+
+        :raises InvalidSetting: 올바르지 않은 값이 있는 경우
+        """
+        for name, common in [('kma_setting', self.kma_setting), ('jma_setting', self.jma_setting)]:
+            if common.sleep_time <= 0:
+                raise InvalidSetting(f'{name}.sleep_time은 0보다 커야 합니다')
+        if self.kma_setting.translate_deadline < 0:
+            raise InvalidSetting('kma_setting.translate_deadline은 0 이상이어야 합니다')
+        if self.push_window < 0:
+            raise InvalidSetting('push_window는 0 이상이어야 합니다')
+        if self.health_max_age <= 0:
+            raise InvalidSetting('health_max_age는 0보다 커야 합니다')
+        if self.upstream.timeout <= 0:
+            raise InvalidSetting('upstream.timeout은 0보다 커야 합니다')
+        if self.upstream.failure_threshold < 1:
+            raise InvalidSetting('upstream.failure_threshold는 1 이상이어야 합니다')
+        if sequence.cell_width(self.sequence.cell_size) < self.sequence.radius:
+            raise InvalidSetting('sequence.cell_size의 격자 너비가 sequence.radius보다 좁습니다')
+        if self.outbox.workers < 1 or self.outbox.max_attempts < 1:
+            raise InvalidSetting('outbox.workers와 outbox.max_attempts는 1 이상이어야 합니다')
+        if not isinstance(self.push_drop_fields, list):
+            raise InvalidSetting('push_drop_fields는 리스트여야 합니다')
+
+    def restart_required(self, other) -> list:
+        """
+        다른 설정과 비교해서 재시작해야 적용되는 설정 중 바뀐 것을 돌려줌
+        """
+        def as_value(value):
+            return vars(value) if isinstance(value, BaseSetting) else value
+
+        changed = [name for name in self.restart_fields
+                   if as_value(getattr(self, name)) != as_value(getattr(other, name))]
+        for name in ['kma_setting', 'jma_setting']:
+            for field in ['log_file_name', 'current_data_file_name', 'state_file_name', 'metrics_port']:
+                if getattr(getattr(self, name), field) != getattr(getattr(other, name), field):
+                    changed.append(f'{name}.{field}')
+        return changed
+
     @staticmethod
-    def create():
-        full_path = os.path.join(setting_directory_path, setting_file_name)
+    def load(full_path):
+        """
+        설정 파일을 읽고 검증
+
+        :param full_path: 설정 파일 경로
+        :raises InvalidSetting: 올바르지 않은 값이 있는 경우
+        """
         with open(full_path, 'r') as setting:
             j = json.load(setting)
-        return GlobalSetting(**j)
+        try:
+            rv = GlobalSetting(**j)
+        except TypeError as e:
+            raise InvalidSetting(str(e))
+        rv.validate()
+        return rv
+
+    @staticmethod
+    def create():
+        return GlobalSetting.load(os.path.join(setting_directory_path, setting_file_name))
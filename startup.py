@@ -0,0 +1,125 @@
+import importlib
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger('startup')
+
+# 첫 크롤링을 시작할 때 출력하는 문자열 (startup_benchmark.py에서 기다림)
+FIRST_POLL_MARKER = 'FIRST_POLL'
+
+# 모듈을 처음 불러온 시각 (인터프리터 시작 시간은 포함되지 않음)
+started = time.monotonic()
+_first_poll_done = set()
+
+
+class LazyModule:
+    """
+    속성에 처음 접근할 때 모듈을 불러오는 클래스
+
+    무거운 SDK(google.cloud, firebase_admin, boto3, PIL 등)를 첫 사용 전까지 불러오지 않아서 시작 시간을 줄임
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, item):
+        return getattr(self.load(), item)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<LazyModule {self._name} ({state})>'
+
+
+def lazy_import(name):
+    """
+    모듈을 처음 사용할 때 불러옴 (이미 불러온 모듈이면 그대로 돌려줌)
+
+    :param name: 모듈 이름 (ex. google.cloud.translate)
+    :return: 모듈 또는 LazyModule
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+class Deferred:
+    """
+    처음 사용할 때 만들어지는 클라이언트. warm()을 호출하면 백그라운드 스레드에서 미리 만듦
+    """
+
+    def __init__(self, name, factory):
+        """
+        :param name: 클라이언트 이름 (로그용)
+        :param factory: 클라이언트를 만드는 함수
+        """
+        self.name = name
+        self.factory = factory
+        self._value = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def get(self):
+        """
+        클라이언트를 돌려줌. 아직 만들어지지 않았으면 만들어질때까지 기다림
+        """
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                start = time.monotonic()
+                self._value = self.factory()
+                self._ready = True
+                logger.info(f'{self.name} 클라이언트 초기화 완료. 소요시간 : {time.monotonic() - start:.3f}')
+        return self._value
+
+    def warm(self):
+        """
+        백그라운드 스레드에서 클라이언트를 미리 만듦 (실패하면 처음 사용할 때 다시 시도)
+        """
+        def run():
+            try:
+                self.get()
+            except Exception:
+                logger.exception(f'{self.name} 클라이언트 미리 초기화 실패')
+
+        threading.Thread(target=run, name=f'warm_{self.name}', daemon=True).start()
+
+
+def warm_modules(*modules):
+    """
+    백그라운드 스레드에서 모듈을 미리 불러옴
+    """
+    def run():
+        for module in modules:
+            if isinstance(module, LazyModule):
+                try:
+                    module.load()
+                except Exception:
+                    logger.exception(f'{module!r} 미리 불러오기 실패')
+
+    threading.Thread(target=run, name='warm_modules', daemon=True).start()
+
+
+def mark_first_poll(name):
+    """
+    첫 크롤링을 시작할 때 한 번만 시작 후 걸린 시간을 출력
+    """
+    if name in _first_poll_done:
+        return
+    _first_poll_done.add(name)
+    print(f'{FIRST_POLL_MARKER} <{name}> {time.monotonic() - started:.3f}', flush=True)
@@ -0,0 +1,50 @@
+"""
+크롤러를 실행해서 첫 크롤링을 시작할 때까지 걸린 시간을 측정하는 스크립트
+
+사용법 : python startup_benchmark.py [kma|jma] [반복 횟수]
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+from startup import FIRST_POLL_MARKER
+
+scripts = {'kma': 'kma_scraper.py', 'jma': 'jma_scraper.py'}
+
+
+def measure(script, timeout=120):
+    """
+    크롤러를 한 번 실행해서 첫 크롤링까지 걸린 시간을 측정
+
+    :return: (프로세스 시작부터 걸린 시간, 크롤러가 출력한 모듈 import 이후 걸린 시간)
+    """
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, script], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               text=True, encoding='utf8')
+    try:
+        for line in process.stdout:
+            if line.startswith(FIRST_POLL_MARKER):
+                return time.monotonic() - start, float(line.split()[-1])
+            if time.monotonic() - start > timeout:
+                break
+        raise RuntimeError(f'{script}이 첫 크롤링을 시작하지 못함')
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else 'kma'
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    totals = []
+    for n in range(count):
+        total, in_process = measure(scripts[name])
+        totals.append(total)
+        print(f'{n + 1}회 : 첫 크롤링까지 {total:.3f}초 (모듈 import 이후 {in_process:.3f}초)')
+    print(f'<{name}> time-to-first-poll 중앙값 {statistics.median(totals):.3f}초, '
+          f'최소 {min(totals):.3f}초, 최대 {max(totals):.3f}초')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def atomic_write_json(path: str, data):
+    """
+    임시 파일에 먼저 쓴 뒤 rename으로 교체해서 JSON 파일을 원자적으로 저장
+
+    :param path: 저장할 파일 경로
+    :param data: JSON으로 변환 가능한 데이터
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.state_', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf8') as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # rename 자체도 디스크에 반영
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class StateStore:
+    """
+    크롤러의 상태(마지막으로 처리한 id, 조건부 GET 검증값, 진행중인 발행 단계)를 파일에 저장하는 클래스
+
+    파일은 임시 파일에 먼저 쓴 뒤 rename으로 교체하기 때문에 저장 도중에 프로그램이 죽어도 파일이 잘리지 않음
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._state = {
+            'last_ids': {},     # 마지막으로 처리가 끝난 데이터의 id
+            'validators': {},   # url별 ETag, Last-Modified 값
+            'publishes': {}     # 진행중인 발행 작업 {uid: {'uid': ..., 'steps': {단계 이름: 결과}, 'extra': ...}}
+        }
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                loaded = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # 예전 버전의 파일이거나 알수 없는 형식이면 처음부터 시작
+            return
+        for key in self._state.keys():
+            if key in loaded:
+                self._state[key] = loaded[key]
+        # 예전 버전은 진행중인 발행 작업을 하나만 저장함
+        if loaded.get('publish') is not None:
+            self._state['publishes'][loaded['publish']['uid']] = loaded['publish']
+
+    def save(self):
+        """
+        상태를 원자적으로 파일에 저장
+        """
+        with self._lock:
+            atomic_write_json(self.path, self._state)
+
+    def get_last_id(self, name: str, default=None):
+        with self._lock:
+            return self._state['last_ids'].get(name, default)
+
+    def set_last_id(self, name: str, value, save=True):
+        with self._lock:
+            self._state['last_ids'][name] = value
+            if save:
+                self.save()
+
+    def get_validators(self, url: str) -> dict:
+        """
+        조건부 GET 요청에 사용할 헤더를 만들어줌
+
+        :param url: 요청할 url
+        :return: If-None-Match, If-Modified-Since 헤더
+        """
+        with self._lock:
+            validator = self._state['validators'].get(url, {})
+        headers = {}
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+        return headers
+
+    def set_validators(self, url: str, response_headers):
+        """
+        응답 헤더에서 ETag, Last-Modified 값을 저장. 값이 바뀐 경우에만 파일에 씀
+
+        :param url: 요청한 url
+        :param response_headers: 응답 헤더
+        """
+        validator = {'etag': response_headers.get('ETag'), 'last_modified': response_headers.get('Last-Modified')}
+        if validator['etag'] is None and validator['last_modified'] is None:
+            return
+        with self._lock:
+            if self._state['validators'].get(url) == validator:
+                return
+            self._state['validators'][url] = validator
+            self.save()
+
+    def clear_validators(self, url: str):
+        with self._lock:
+            if self._state['validators'].pop(url, None) is not None:
+                self.save()
+
+    def begin_publish(self, uid: str, **extra):
+        """
+        발행 작업 시작을 기록. 같은 uid의 작업이 이미 진행중이었으면 완료된 단계를 그대로 이어감
+        (서로 다른 uid의 작업은 따로 기록되므로 동시에 진행할 수 있음)
+
+        :param uid: 발행할 데이터의 id
+        :param extra: 재시작시에 필요한 부가 정보
+        """
+        with self._lock:
+            publish = self._state['publishes'].get(uid)
+            if publish is None:
+                self._state['publishes'][uid] = {'uid': uid, 'steps': {}, 'extra': extra}
+            else:
+                publish['extra'].update(extra)
+            self.save()
+
+    def hold_publish(self, publish_uid: str, event: str, **last_ids):
+        """
+        대기 인스턴스에서 발행하지 않은 데이터를 기록하고 마지막으로 처리한 id들과 함께 한번에 저장
+        (리더를 넘겨받으면 발행 대기열에 넣음)
+
+        :param publish_uid: 발행할 데이터의 id
+        :param event: 발행 함수에 넘길 인수 (outbox.dumps로 바꾼 문자열)
+        :param last_ids: 갱신할 마지막 id 값
+        """
+        with self._lock:
+            self._state['publishes'][publish_uid] = {'uid': publish_uid, 'steps': {},
+                                                     'extra': {'event': event, 'held': time.time()}}
+            self._state['last_ids'].update(last_ids)
+            self.save()
+
+    def pending_publishes(self):
+        """
+        :return: 완료되지 않은 발행 작업 리스트 (시작한 순서)
+        """
+        with self._lock:
+            return copy.deepcopy(list(self._state['publishes'].values()))
+
+    def is_step_done(self, uid: str, step: str) -> bool:
+        with self._lock:
+            publish = self._state['publishes'].get(uid)
+            return publish is not None and step in publish['steps']
+
+    def step_result(self, uid: str, step: str):
+        with self._lock:
+            publish = self._state['publishes'].get(uid)
+            if publish is None:
+                return None
+            return copy.deepcopy(publish['steps'].get(step))
+
+    def mark_step(self, uid: str, step: str, result=None):
+        """
+        발행 단계 하나가 끝났음을 기록
+
+        :param uid: 발행할 데이터의 id
+        :param step: 단계 이름
+        :param result: 재시작시에 다시 사용할 결과 (JSON으로 변환 가능해야 함)
+        """
+        with self._lock:
+            publish = self._state['publishes'].get(uid)
+            if publish is None:
+                return
+            publish['steps'][step] = result
+            self.save()
+
+    def discard_publish(self, uid: str):
+        """
+        발행하지 않고 끝난 작업의 기록을 지움 (마지막으로 처리한 id는 바꾸지 않음)
+
+        :param uid: 발행할 데이터의 id
+        """
+        with self._lock:
+            if self._state['publishes'].pop(uid, None) is not None:
+                self.save()
+
+    def finish_publish(self, publish_uid: str, **last_ids):
+        """
+        발행 작업 종료. 마지막으로 처리한 id들과 함께 한번에 저장
+
+        :param publish_uid: 발행한 데이터의 id (last_ids의 uid와 이름이 겹치지 않게 따로 받음)
+        :param last_ids: 갱신할 마지막 id 값
+        """
+        with self._lock:
+            self._state['publishes'].pop(publish_uid, None)
+            self._state['last_ids'].update(last_ids)
+            self.save()
@@ -0,0 +1,223 @@
+import collections
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+
+import requests
+
+import metrics
+
+logger = logging.getLogger('upstream')
+
+# 지연 시간 백분위를 계산할 최근 응답 수
+LATENCY_WINDOW = 200
+# 이 수보다 응답이 적으면 백분위 대신 timeout의 절반을 헤지 기준으로 사용
+MIN_SAMPLES = 20
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 헤지 요청을 같이 보내기 위한 스레드 풀 (느린 요청은 timeout까지만 스레드를 잡고 있음)
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='upstream')
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name):
+        super().__init__(f"연속된 실패로 요청을 잠시 보내지 않습니다 : {name}")
+
+
+def backoff(attempt, cap, base=0.5):
+    """
+    상한이 있는 지수 백오프 + full jitter
+
+    :param attempt: 실패 횟수 (0부터)
+    :param cap: 최대 대기 시간(초)
+    :param base: 첫 대기 시간(초)
+    :return: 대기할 시간(초)
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """
+    최근 응답의 지연 시간으로 백분위를 계산하는 클래스
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p):
+        """
+        :param p: 백분위 (0~100)
+        :return: 지연 시간(초), 기록이 없으면 None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) == 0:
+            return None
+        idx = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+        return samples[idx]
+
+
+class CircuitBreaker:
+    """
+    연속으로 실패하면 요청을 막고(open), reset_timeout이 지나면 요청 하나만 시험적으로 보내보는(half open) 클래스
+
+    막기 시작할 때와 다시 풀 때만 로그를 남김 (막혀 있는 동안 사이클마다 경고 메일이 가지 않도록)
+    """
+
+    def __init__(self, failure_threshold, reset_timeout, name=''):
+        """
+        :param failure_threshold: 막기 시작할 연속 실패 횟수
+        :param reset_timeout: 막은 뒤에 시험 요청을 보낼때까지의 시간(초)
+        :param name: 주소 이름 (로그용)
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        :return: 요청을 보내도 되는지 여부
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                # 시험 요청은 한 번에 하나만
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            recovered = self.state != CLOSED
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+        if recovered:
+            logger.info(f'<{self.name}> 요청이 다시 성공해서 막았던 요청을 보냄')
+
+    def record_failure(self):
+        with self._lock:
+            opened = False
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                opened = self.state == CLOSED
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            failures = self.failures
+        if opened:
+            logger.warning(f'<{self.name}> 연속으로 {failures}번 실패해서 {self.reset_timeout}초 동안 요청을 막음')
+
+
+class Endpoint:
+    """
+    기상청 서버 주소 하나에 대한 요청 정책 (헤지 요청, 서킷 브레이커, 지연 시간 기록)
+    """
+
+    def __init__(self, name, timeout, hedge, failure_threshold, reset_timeout, session=None):
+        """
+        :param name: 주소 이름 (메트릭, 로그용)
+        :param timeout: 요청 하나의 제한 시간(초)
+        :param hedge: 첫 요청이 p95 안에 응답하지 않으면 같은 요청을 하나 더 보낼지 여부
+        :param failure_threshold: 요청을 막기 시작할 연속 실패 횟수
+        :param reset_timeout: 막은 뒤에 시험 요청을 보낼때까지의 시간(초)
+        :param session: 요청에 사용할 requests 세션 (None이면 requests.get)
+        """
+        self.name = name
+        self.timeout = timeout
+        self.hedge = hedge
+        self.session = session
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, name)
+        for p in [50, 95, 99]:
+            metrics.UPSTREAM_LATENCY_QUANTILE.set_function(lambda p=p: self.latency.percentile(p) or 0,
+                                                           upstream=name, quantile=p / 100)
+        metrics.UPSTREAM_CIRCUIT_OPEN.set_function(lambda: int(self.breaker.state != CLOSED), upstream=name)
+
+    def hedge_delay(self):
+        """
+        두 번째 요청을 보내기 전까지 기다릴 시간(초)
+        """
+        if len(self.latency) < MIN_SAMPLES:
+            return self.timeout / 2
+        return min(self.timeout / 2, self.latency.percentile(95))
+
+    def _request(self, url, kwargs):
+        start = time.monotonic()
+        getter = self.session.get if self.session is not None else requests.get
+        response = getter(url, timeout=self.timeout, **kwargs)
+        return response, time.monotonic() - start
+
+    def get(self, url, **kwargs) -> requests.Response:
+        """
+        GET 요청. 응답 코드는 확인하지 않으므로 호출한 쪽에서 raise_for_status를 호출해야 함
+
+        :raises CircuitOpen: 연속된 실패로 요청을 막고 있는 경우
+        :raises requests.exceptions.RequestException: 모든 요청이 실패한 경우
+        """
+        if not self.breaker.allow():
+            raise CircuitOpen(self.name)
+
+        futures = [executor.submit(self._request, url, kwargs)]
+        done, _ = concurrent.futures.wait(futures, timeout=self.hedge_delay() if self.hedge else None)
+        if len(done) == 0:
+            logger.info(f'<{self.name}> 응답이 늦어 헤지 요청을 보냄')
+            metrics.UPSTREAM_HEDGES.inc(upstream=self.name)
+            futures.append(executor.submit(self._request, url, kwargs))
+
+        error = None
+        pending = set(futures)
+        while len(pending) > 0:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response, latency = future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e
+                    continue
+                self.latency.add(latency)
+                metrics.UPSTREAM_RESPONSES.inc(upstream=self.name, status=response.status_code)
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                return response
+
+        status = 'timeout' if isinstance(error, requests.exceptions.Timeout) else 'error'
+        metrics.UPSTREAM_RESPONSES.inc(upstream=self.name, status=status)
+        self.breaker.record_failure()
+        raise error
+
+
+def create_endpoint(upstream_setting, name, session=None):
+    """
+    설정으로부터 Endpoint를 만듦
+
+    :param upstream_setting: UpstreamSetting
+    :param name: 주소 이름
+    :param session: 요청에 사용할 requests 세션
+    """
+    return Endpoint(name, upstream_setting.timeout, upstream_setting.hedge, upstream_setting.failure_threshold,
+                    upstream_setting.reset_timeout, session)
@@ -1,18 +1,38 @@
-import copy
 import builtins
+import reprlib
 from pprint import pprint
 
+builtin_types = tuple([getattr(builtins, d) for d in dir(builtins) if isinstance(getattr(builtins, d), type)])
 
-def vars_dump(cls):
-    variables = copy.deepcopy(vars(cls))
-    builtin_types = tuple([getattr(builtins, d) for d in dir(builtins) if isinstance(getattr(builtins, d), type)])
-    for key, value in variables.items():
-        if type(value) not in builtin_types:
-            variables[key] = vars_dump(value)
+# 긴 리스트나 문자열은 앞부분만 남김
+_repr = reprlib.Repr()
+_repr.maxstring = 200
+_repr.maxother = 200
+
+
+def vars_dump(cls, max_depth=3):
+    """
+    객체의 멤버 변수를 dict로 변환
+
+    값을 복사하지 않고 새 dict만 만들기 때문에 실행 중인 객체에 사용해도 가벼움
+
+    :param cls: 객체
+    :param max_depth: 내부 객체를 따라 들어갈 최대 깊이 (넘으면 repr 문자열로 요약)
+    :return: {멤버 이름: 값}
+    """
+    if not hasattr(cls, '__dict__'):
+        return _repr.repr(cls)
+    variables = {}
+    for key, value in list(vars(cls).items()):
+        if type(value) in builtin_types:
+            variables[key] = value
+        elif max_depth <= 1 or not hasattr(value, '__dict__'):
+            variables[key] = _repr.repr(value)
+        else:
+            variables[key] = vars_dump(value, max_depth - 1)
 
     return variables
 
 
 def print_vars(cls):
     pprint(vars_dump(cls))
-